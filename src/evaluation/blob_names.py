@@ -0,0 +1,327 @@
+"""Generate NWM blob names without listing the bucket.
+
+The configuration specs are ported from
+refs/potentially_useful_code.py::config_specs.  A persistent manifest
+of bucket listings, keyed by prefix, is kept for when the generated
+names need to be verified against what actually exists.
+"""
+import json
+import os
+import re
+
+import config
+import const
+import gcs
+import utils
+
+from datetime import datetime, timedelta
+from typing import List
+
+# Specs per domain and configuration for NWM v2.2
+#   dir_suffix      suffix of the configuration directory, e.g. _mem1
+#   var_str_suffix  suffix of the variable string in the file name, e.g. channel_rt_1
+#   duration_hrs    simulation period in hours
+#   timestep_int    timestep in hours (fraction if < 1 hour)
+#   runs_per_day    number of executions per day
+#   base_run_hour   hour of the first run of the day
+#   is_forecast     True if forecast, False if AnA
+CONFIG_SPECS = {
+    "conus": {
+        "short_range": dict(dir_suffix="", var_str_suffix="", duration_hrs=18, timestep_int=1,
+                            runs_per_day=24, base_run_hour=0, is_forecast=True),
+        "medium_range": dict(dir_suffix="_mem1", var_str_suffix="_1", duration_hrs=240, timestep_int=1,
+                             runs_per_day=4, base_run_hour=0, is_forecast=True),
+        "analysis_assim": dict(dir_suffix="", var_str_suffix="", duration_hrs=3, timestep_int=1,
+                               runs_per_day=24, base_run_hour=0, is_forecast=False),
+        "analysis_assim_extend": dict(dir_suffix="", var_str_suffix="", duration_hrs=28, timestep_int=1,
+                                      runs_per_day=1, base_run_hour=16, is_forecast=False),
+    },
+    "hawaii": {
+        "short_range": dict(dir_suffix="_hawaii", var_str_suffix="", duration_hrs=48, timestep_int=0.25,
+                            runs_per_day=2, base_run_hour=0, is_forecast=True),
+        "analysis_assim": dict(dir_suffix="_hawaii", var_str_suffix="", duration_hrs=3, timestep_int=0.25,
+                               runs_per_day=24, base_run_hour=0, is_forecast=False),
+    },
+    "puertorico": {
+        "short_range": dict(dir_suffix="_puertorico", var_str_suffix="", duration_hrs=48, timestep_int=1,
+                            runs_per_day=2, base_run_hour=6, is_forecast=True),
+        "analysis_assim": dict(dir_suffix="_puertorico", var_str_suffix="", duration_hrs=3, timestep_int=1,
+                               runs_per_day=24, base_run_hour=0, is_forecast=False),
+    },
+}
+
+# Specs per variable group
+#   dir_prefix  prefix of the configuration directory, e.g. forcing_short_range
+#   use_suffix  append the configuration dir_suffix/var_str_suffix,
+#               always True outside CONUS (e.g. forcing_short_range_hawaii)
+#   var_string  variable string in the file name
+VARIABLE_SPECS = {
+    "forcing": dict(dir_prefix="forcing_", use_suffix=False, var_string="forcing"),
+    "channel_rt": dict(dir_prefix="", use_suffix=True, var_string="channel_rt"),
+}
+
+
+def nwm_version(reference_time: datetime) -> float:
+    """NWM version (2.0, 2.1 or 2.2) of a reference time.
+
+    Versions prior to 2.0 are not handled.
+    """
+    if reference_time >= datetime(2022, 7, 9, 0):
+        return 2.2
+    if reference_time >= datetime(2021, 4, 20, 14):
+        return 2.1
+    return 2.0
+
+
+def config_specs(
+    configuration: str,
+    domain: str = "conus",
+    version: float = 2.2,
+    member: int = 1,
+) -> dict:
+    """Specs of a configuration for a domain and NWM version.
+
+    Parameters
+    ----------
+    configuration : str, required
+        e.g. "short_range", "medium_range", "analysis_assim".
+    domain : str, default "conus"
+        "conus", "hawaii" or "puertorico".
+    version : float, default 2.2
+        NWM version.
+    member : int, default 1
+        Medium range ensemble member.
+
+    Returns
+    -------
+    specs : dict
+        See CONFIG_SPECS.
+    """
+    if domain not in CONFIG_SPECS:
+        raise ValueError(f"Unknown domain {domain}")
+    if domain == "puertorico" and version < 2.1:
+        raise ValueError(f"Domain {domain} does not exist for version {version}")
+    if configuration not in CONFIG_SPECS[domain]:
+        raise ValueError(f"Config {configuration} does not exist for domain {domain}")
+
+    specs = dict(CONFIG_SPECS[domain][configuration])
+
+    if domain == "conus":
+        # In v2.0, medium range time step was 3 hours, changed to 1 hour in v2.1
+        if configuration == "medium_range" and version < 2.1:
+            specs["timestep_int"] = 3
+        # Medium range members 2-7 are shorter and have their own suffixes
+        if configuration == "medium_range" and member > 1:
+            specs["duration_hrs"] = 204
+            specs["dir_suffix"] = f"_mem{member}"
+            specs["var_str_suffix"] = f"_{member}"
+
+    if domain == "hawaii" and version == 2.0:
+        specs["timestep_int"] = 1
+        if configuration == "short_range":
+            specs["duration_hrs"] = 60
+            specs["runs_per_day"] = 4
+
+    return specs
+
+
+def reference_times(
+    configuration: str,
+    start_dt: datetime,
+    end_dt: datetime,
+    domain: str = "conus",
+    version: float = None,
+) -> List[datetime]:
+    """Reference times of a configuration in [start_dt, end_dt)."""
+    specs = config_specs(configuration, domain, version or nwm_version(start_dt))
+    interval = timedelta(hours=24 / specs["runs_per_day"])
+
+    day = datetime(start_dt.year, start_dt.month, start_dt.day)
+    reference_time = day + timedelta(hours=specs["base_run_hour"])
+    times = []
+    while reference_time < end_dt:
+        if reference_time >= start_dt:
+            times.append(reference_time)
+        reference_time += interval
+    return times
+
+
+def lead_hours(
+    configuration: str,
+    domain: str = "conus",
+    version: float = 2.2,
+    member: int = 1,
+) -> List[float]:
+    """Lead hours of every timestep of a run, f001 ... f240 for forecasts
+    and tm00 ... tm02 for analyses."""
+    specs = config_specs(configuration, domain, version, member)
+    timestep = specs["timestep_int"]
+    n_steps = int(round(specs["duration_hrs"] / timestep))
+    if specs["is_forecast"]:
+        return [timestep * (i + 1) for i in range(n_steps)]
+    return [timestep * i for i in range(n_steps)]
+
+
+def _lead_string(lead_hrs: float, timestep_int: float, is_forecast: bool) -> str:
+    """f001 / tm00 style lead string, with minutes for sub-hourly steps."""
+    prefix = "f" if is_forecast else "tm"
+    hours = int(lead_hrs)
+    width = 3 if is_forecast else 2
+    if timestep_int % 1 > 0:
+        minutes = int(round((lead_hrs - hours) * 60))
+        return f"{prefix}{hours:0{width}d}{minutes:02d}"
+    return f"{prefix}{hours:0{width}d}"
+
+
+def generate_blob_names(
+    configuration: str,
+    reference_time: datetime,
+    variable: str = "channel_rt",
+    domain: str = "conus",
+    version: float = None,
+    member: int = 1,
+    leads: List[float] = None,
+) -> List[str]:
+    """Expected blob names of one run, without listing the bucket.
+
+    e.g. nwm.20230101/forcing_medium_range/nwm.t00z.medium_range.forcing.f001.conus.nc
+
+    Parameters
+    ----------
+    configuration : str, required
+        e.g. "short_range", "medium_range", "analysis_assim".
+    reference_time : datetime, required
+        Reference (issue) time of the run.
+    variable : str, default "channel_rt"
+        "channel_rt" or "forcing".
+    domain : str, default "conus"
+        "conus", "hawaii" or "puertorico".
+    version : float, optional
+        NWM version, defaults to the version of the reference time.
+    member : int, default 1
+        Medium range ensemble member.
+    leads : List[float], optional
+        Lead hours to include (e.g. [0] for only the tm00 analysis),
+        defaults to every timestep of the run.
+
+    Returns
+    -------
+    blob_list : List[str]
+    """
+    if version is None:
+        version = nwm_version(reference_time)
+    specs = config_specs(configuration, domain, version, member)
+    var_specs = VARIABLE_SPECS[variable]
+
+    use_suffix = var_specs["use_suffix"] or domain != "conus"
+    dir_suffix = specs["dir_suffix"] if use_suffix else ""
+    var_suffix = specs["var_str_suffix"] if use_suffix else ""
+    directory = f"{var_specs['dir_prefix']}{configuration}{dir_suffix}"
+    var_string = f"{var_specs['var_string']}{var_suffix}"
+
+    timestep = specs["timestep_int"]
+    all_leads = lead_hours(configuration, domain, version, member)
+    if leads is not None:
+        all_leads = [lead for lead in all_leads if lead in set(leads)]
+
+    date_dir = reference_time.strftime("nwm.%Y%m%d")
+    cycle = reference_time.strftime("t%Hz")
+    return [
+        f"{date_dir}/{directory}/nwm.{cycle}.{configuration}.{var_string}."
+        f"{_lead_string(lead, timestep, specs['is_forecast'])}.{domain}.nc"
+        for lead in all_leads
+    ]
+
+
+BLOB_NAME_PATTERN = re.compile(
+    r"nwm\.(?P<date>\d{8})/(?P<directory>[^/]+)/"
+    r"nwm\.t(?P<hour>\d{2})z\.(?P<configuration>\w+?)\."
+    r"(?P<var_string>[a-z_]+?)(?:_(?P<member>\d))?\."
+    r"(?P<lead>f\d+|tm\d+)\.(?P<domain>\w+)\.nc$"
+)
+
+
+def parse_blob_name(blob_name: str) -> dict:
+    """Parts of a blob name, the inverse of `generate_blob_names`.
+
+    Returns
+    -------
+    parts : dict
+        reference_time, configuration, variable ("forcing" or
+        "channel_rt"), member, lead_hrs and domain, or None if the name
+        does not follow the NWM pattern.
+    """
+    match = BLOB_NAME_PATTERN.search(blob_name)
+    if match is None:
+        return None
+
+    lead = match["lead"]
+    digits = lead.lstrip("fmt")
+    width = 3 if lead.startswith("f") else 2
+    lead_hrs = int(digits[:width])
+    if len(digits) > width:
+        lead_hrs += int(digits[width:]) / 60
+
+    return {
+        "reference_time": datetime.strptime(
+            f"{match['date']}{match['hour']}", "%Y%m%d%H"
+        ),
+        "configuration": match["configuration"],
+        "variable": match["var_string"],
+        "member": int(match["member"] or 1),
+        "lead_hrs": lead_hrs,
+        "domain": match["domain"],
+    }
+
+
+def _manifest_filepath(prefix: str, bucket: str) -> str:
+    name = prefix.strip("/").replace("/", "__") or "_root"
+    return os.path.join(config.NWM_MANIFEST_DIR, bucket, f"{name}.json")
+
+
+def list_blob_names_cached(
+    prefix: str,
+    bucket: str = const.NWM_BUCKET,
+    refresh: bool = False,
+) -> List[str]:
+    """List blob names starting with prefix, using a persistent manifest.
+
+    The first listing of a prefix is saved as a JSON manifest under
+    config.NWM_MANIFEST_DIR and later calls read the manifest instead of
+    paging through the bucket listing.  Use refresh=True for prefixes
+    that may still be receiving files (e.g. today).
+    """
+    manifest_filepath = _manifest_filepath(prefix, bucket)
+    if os.path.exists(manifest_filepath) and not refresh:
+        with open(manifest_filepath, "r") as f:
+            return json.load(f)["blob_names"]
+
+    blob_names = gcs.list_blob_names(prefix=prefix, bucket=bucket)
+
+    with utils.atomic_write(manifest_filepath) as tmp_filepath, open(tmp_filepath, "w") as f:
+        json.dump({
+            "prefix": prefix,
+            "bucket": bucket,
+            "listed_at": datetime.utcnow().isoformat(),
+            "blob_names": blob_names,
+        }, f)
+
+    return blob_names
+
+
+def verify_blob_names(
+    blob_names: List[str],
+    bucket: str = const.NWM_BUCKET,
+    refresh: bool = False,
+) -> List[str]:
+    """Blob names that do not exist, checked against the cached manifests
+    of their directories."""
+    missing = []
+    listings = {}
+    for blob_name in blob_names:
+        prefix = blob_name.rsplit("/", 1)[0] + "/"
+        if prefix not in listings:
+            listings[prefix] = set(list_blob_names_cached(prefix, bucket, refresh))
+        if blob_name not in listings[prefix]:
+            missing.append(blob_name)
+    return missing
@@ -0,0 +1,242 @@
+"""Size-bounded disk cache for downloaded NWM files.
+
+Files are stored under the cache directory by blob name, as before, and
+an SQLite index next to them keeps the size, last access time and access
+count of each entry.  When the cache grows over its byte budget the
+least recently (LRU) or least frequently (LFU) used entries are deleted.
+
+Entries are written to a temporary file and renamed into place, so
+process pool workers never read a half-written file, and the SQLite
+index is shared by every process using the cache directory.  Within a
+process one cache (and index connection) is shared by every thread.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import config
+import utils
+
+from typing import Callable, Dict, Optional
+
+INDEX_FILENAME = "cache_index.sqlite"
+
+POLICIES = ("lru", "lfu")
+
+# Order in which entries are evicted per policy
+_EVICTION_ORDER = {
+    "lru": "last_access ASC",
+    "lfu": "access_count ASC, last_access ASC",
+}
+
+COUNTERS = ("hits", "misses", "evictions", "evicted_bytes")
+
+# Caches by process ID, an SQLite connection must not be shared with
+# forked workers (see utils.process_local)
+_caches = {}
+
+
+class DiskCache:
+    """Size-bounded LRU/LFU file cache.
+
+    Parameters
+    ----------
+    cache_dir : str, required
+        Directory of the cached files and of the index.
+    max_bytes : int, optional
+        Byte budget of the cache, unbounded if None.
+    policy : str, default "lru"
+        "lru" evicts the least recently used entries first, "lfu" the
+        least frequently used.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = None,
+        policy: str = "lru",
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy {policy}")
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # The connection is shared by the threads of the process, each
+        # use holds the lock so transactions do not interleave
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.cache_dir, INDEX_FILENAME),
+            timeout=60,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER, "
+            "last_access REAL, access_count INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO counters VALUES (?, 0)",
+            [(name,) for name in COUNTERS]
+        )
+
+    def path(self, key: str) -> str:
+        """Filepath of an entry, whether it is cached or not."""
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key: str) -> bool:
+        """If an entry is cached, without counting a hit or miss."""
+        return os.path.exists(self.path(key))
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE counters SET value = value + ? WHERE name = ?",
+                (value, name)
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        """Filepath of a cached entry, or None if it is not cached.
+
+        A hit updates the last access time and access count of the entry.
+        Files already in the cache directory but not in the index (e.g.
+        cached before the index existed) are added to it.
+        """
+        filepath = self.path(key)
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            self._count("misses")
+            return None
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "last_access = excluded.last_access, "
+                "access_count = access_count + 1",
+                (key, size, time.time())
+            )
+            self._count("hits")
+        return filepath
+
+    def put(self, key: str, write: Callable[[str], None]) -> str:
+        """Add an entry written by `write(filepath)`.
+
+        `write` writes to a temporary file which is renamed into place,
+        then entries are evicted until the cache fits its budget.
+
+        Returns
+        -------
+        filepath : str
+            Filepath of the cached entry.
+        """
+        filepath = self.path(key)
+        with utils.atomic_write(filepath) as tmp_filepath:
+            write(tmp_filepath)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, 1)",
+                (key, os.path.getsize(filepath), time.time())
+            )
+            self.evict(keep=key)
+        return filepath
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        """Add an entry from bytes, see `put`."""
+        def write(filepath):
+            with open(filepath, "wb") as f:
+                f.write(data)
+        return self.put(key, write)
+
+    def total_bytes(self) -> int:
+        """Size of the indexed entries."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+
+    def evict(self, keep: str = None) -> int:
+        """Delete entries until the cache fits its byte budget.
+
+        Parameters
+        ----------
+        keep : str, optional
+            Entry never evicted, e.g. the one just added.
+
+        Returns
+        -------
+        n_evicted : int
+        """
+        if self.max_bytes is None:
+            return 0
+
+        n_evicted = 0
+        evicted_bytes = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                excess = self.total_bytes() - self.max_bytes
+                if excess > 0:
+                    rows = self._conn.execute(
+                        "SELECT key, size FROM entries WHERE key IS NOT ? "
+                        f"ORDER BY {_EVICTION_ORDER[self.policy]}",
+                        (keep,)
+                    )
+                    for key, size in rows.fetchall():
+                        if evicted_bytes >= excess:
+                            break
+                        try:
+                            os.remove(self.path(key))
+                        except FileNotFoundError:
+                            pass
+                        self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        n_evicted += 1
+                        evicted_bytes += size
+                    self._count("evictions", n_evicted)
+                    self._count("evicted_bytes", evicted_bytes)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return n_evicted
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters (shared by all processes) and
+        the current size of the cache."""
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT name, value FROM counters"))
+            stats["entries"] = self._conn.execute(
+                "SELECT COUNT(*) FROM entries"
+            ).fetchone()[0]
+            stats["bytes"] = self.total_bytes()
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def reset_stats(self):
+        """Reset the hit, miss and eviction counters."""
+        with self._lock:
+            self._conn.execute("UPDATE counters SET value = 0")
+
+
+def get_cache() -> DiskCache:
+    """Get the NWM file cache of this process, configured by
+    config.NWM_CACHE_DIR, NWM_CACHE_MAX_BYTES and NWM_CACHE_POLICY."""
+    return utils.process_local(
+        _caches,
+        None,
+        lambda: DiskCache(
+            config.NWM_CACHE_DIR,
+            max_bytes=config.NWM_CACHE_MAX_BYTES,
+            policy=config.NWM_CACHE_POLICY,
+        )
+    )
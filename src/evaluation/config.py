@@ -8,16 +8,33 @@ USGS_CACHE_DIR = os.path.join(CACHE_DIR, "usgs")
 GEO_CACHE_DIR = os.path.join(CACHE_DIR, "geo")
 
 NWM_CACHE_H5 = os.path.join(NWM_CACHE_DIR, "gcp_client.h5")
+NWM_MANIFEST_DIR = os.path.join(NWM_CACHE_DIR, "manifests")
+
+# Byte budget and eviction policy ("lru" or "lfu") of the NWM file cache
+NWM_CACHE_MAX_BYTES = 200 * 2**30
+NWM_CACHE_POLICY = "lru"
+
+# "netcdf" caches one file per blob, "zarr" one compressed store per run
+NWM_CACHE_BACKEND = "netcdf"
+NWM_ZARR_CACHE_DIR = os.path.join(NWM_CACHE_DIR, "zarr")
 
 PARQUET_CACHE_DIR = os.path.join(CACHE_DIR, "parquet")
+# Completed ingest units, see ledger.py
+INGEST_LEDGER_FILEPATH = os.path.join(PARQUET_CACHE_DIR, "ingest_ledger.sqlite")
 MEDIUM_RANGE_FORCING_PARQUET = os.path.join(PARQUET_CACHE_DIR, "forcing_medium_range")
+MEDIUM_RANGE_FORCING_ACCUM_PARQUET = os.path.join(PARQUET_CACHE_DIR, "forcing_medium_range_accum")
 FORCING_ANALYSIS_ASSIM_PARQUET = os.path.join(PARQUET_CACHE_DIR, "forcing_analysis_assim")
 MEDIUM_RANGE_1_PARQUET = os.path.join(PARQUET_CACHE_DIR, "medium_range_mem1")
 USGS_PARQUET = os.path.join(PARQUET_CACHE_DIR, "usgs")
 
 HUC10_SHP_FILEPATH = os.path.join(GEO_CACHE_DIR, "wbdhu10_conus.shp")
 HUC10_PARQUET_FILEPATH = os.path.join(GEO_CACHE_DIR, "wbdhu10_conus.parquet")
-HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH = os.path.join(GEO_CACHE_DIR, "wbdhu10_medium_range_weights.pkl.json")
+HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH = os.path.join(GEO_CACHE_DIR, "wbdhu10_medium_range_weights.bin")
+
+NWM_SPATIAL_WEIGHTS_FILE = os.path.join(GEO_CACHE_DIR, "spatialweights_CONUS_LongRange.nc")
+NWM_CATCHMENT_WEIGHTS_FILEPATH = os.path.join(GEO_CACHE_DIR, "nwm_catchment_weights.bin")
+# Weights built by weights_registry, by domain, grid, layer and version
+WEIGHTS_DIR = os.path.join(GEO_CACHE_DIR, "weights")
 
 ROUTE_LINK_FILE = os.path.join(NWM_CACHE_DIR, "RouteLink_CONUS.nc")
 ROUTE_LINK_PARQUET = os.path.join(NWM_CACHE_DIR, "route_link_conus.parquet")
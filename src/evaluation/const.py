@@ -1,5 +1,9 @@
 NWM_BUCKET = "national-water-model"
 
+# Hive partition columns of model output, in directory order, e.g.
+# configuration=medium_range_mem1/reference_date=2023-01-01/
+PARTITION_COLUMNS = ("configuration", "reference_date")
+
 # WKT strings extracted from NWM grids
 CONUS_NWM_WKT = 'PROJCS["Lambert_Conformal_Conic",GEOGCS["GCS_Sphere",DATUM["D_Sphere",SPHEROID["Sphere",6370000.0,0.0]], \
 PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Lambert_Conformal_Conic_2SP"],PARAMETER["false_easting",0.0],\
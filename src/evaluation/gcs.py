@@ -0,0 +1,219 @@
+"""Shared Google Cloud Storage client.
+
+One anonymous client is created per process and reused, so its HTTP
+connection pool (and TLS sessions) are shared by every list and download
+instead of being set up for each request.
+
+Set the STORAGE_EMULATOR_HOST environment variable (e.g.
+http://localhost:4443 for fake-gcs-server) to use a local stand-in.
+"""
+import time
+
+import const
+import utils
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fsspec
+import requests
+
+from google.api_core import exceptions
+from google.cloud import storage
+
+DEFAULT_POOL_SIZE = 32
+
+# Block size of lazy remote reads, roughly a few HDF5 chunks
+REMOTE_BLOCK_SIZE = 2 * 2**20
+
+# Errors worth retrying, anything else (e.g. NotFound) is raised
+RETRY_EXCEPTIONS = (
+    exceptions.ServerError,
+    exceptions.TooManyRequests,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+# Clients by process ID, a client must not be shared with forked workers
+# (see utils.process_local)
+_clients = {}
+
+
+def get_client(pool_size: int = DEFAULT_POOL_SIZE) -> storage.Client:
+    """Get the anonymous storage client of this process.
+
+    Parameters
+    ----------
+    pool_size : int, default DEFAULT_POOL_SIZE
+        Maximum number of pooled HTTP connections, only used when the
+        client is created.
+
+    Returns
+    -------
+    client : storage.Client
+    """
+    def create_client() -> storage.Client:
+        client = storage.Client.create_anonymous_client()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        )
+        client._http.mount("https://", adapter)
+        client._http.mount("http://", adapter)
+        return client
+
+    return utils.process_local(_clients, None, create_client)
+
+
+def get_bucket(bucket: str = const.NWM_BUCKET) -> storage.Bucket:
+    """Get a bucket of the shared client."""
+    return get_client().bucket(bucket)
+
+
+def list_blob_names(
+    prefix: str,
+    bucket: str = const.NWM_BUCKET
+) -> List[str]:
+    """List the names of the blobs starting with prefix."""
+    client = get_client()
+    blobs = client.list_blobs(client.bucket(bucket), prefix=prefix)
+    return [b.name for b in blobs]
+
+
+def download_blob(
+    blob_name: str,
+    bucket: str = const.NWM_BUCKET,
+    timeout: int = 120,
+    retries: int = 3,
+    backoff: float = 1.0,
+) -> bytes:
+    """Download a blob as bytes, retrying transient errors with
+    exponential backoff.
+
+    The retries of the storage library are turned off, errors are
+    classified by RETRY_EXCEPTIONS only.
+    """
+    blob = get_bucket(bucket).blob(blob_name)
+    for attempt in range(retries + 1):
+        try:
+            return blob.download_as_bytes(timeout=timeout, retry=None)
+        except RETRY_EXCEPTIONS:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_blobs(
+    blob_names: List[str],
+    bucket: str = const.NWM_BUCKET,
+    max_concurrency: int = 16,
+    timeout: int = 120,
+    retries: int = 3,
+) -> Dict[str, bytes]:
+    """Download many blobs concurrently in a thread pool.
+
+    At most `max_concurrency` downloads run at a time, all sharing the
+    pooled client (the HTTP requests release the GIL).
+
+    Parameters
+    ----------
+    blob_names : List[str], required
+        Names of the blobs to download.
+    bucket : str, default const.NWM_BUCKET
+        Bucket name.
+    max_concurrency : int, default 16
+        Maximum number of concurrent downloads.
+    timeout : int, default 120
+        Timeout of each request in seconds.
+    retries : int, default 3
+        Retries of each blob on transient errors.
+
+    Returns
+    -------
+    data : Dict[str, bytes]
+        The data of each blob by blob name, in the order of `blob_names`.
+    """
+    get_client(pool_size=max(max_concurrency, DEFAULT_POOL_SIZE))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        results = executor.map(
+            lambda blob_name: download_blob(blob_name, bucket, timeout, retries),
+            blob_names
+        )
+        return dict(zip(blob_names, results))
+
+
+def prefetch_blobs(
+    blob_names: Iterable[str],
+    bucket: str = const.NWM_BUCKET,
+    workers: int = 4,
+    prefetch: int = None,
+    is_cached: Callable[[str], bool] = None,
+) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """Download blobs in a thread pool ahead of the caller, yielding
+    (blob_name, raw_bytes) in the order of `blob_names`.
+
+    Up to `prefetch` downloads are queued ahead of the blob being
+    yielded, so at most `prefetch` downloaded blobs wait in memory.
+
+    Parameters
+    ----------
+    blob_names : Iterable[str], required
+        Names of the blobs to download.
+    bucket : str, default const.NWM_BUCKET
+        Bucket name.
+    workers : int, default 4
+        Number of concurrent downloads.
+    prefetch : int, optional
+        Maximum number of downloads queued ahead, defaults to
+        2 * workers.
+    is_cached : Callable[[str], bool], optional
+        Called in the download threads, blobs it is true for are not
+        downloaded and yielded with None.
+    """
+    if prefetch is None:
+        prefetch = workers * 2
+
+    def fetch(blob_name: str) -> Optional[bytes]:
+        if is_cached is not None and is_cached(blob_name):
+            return None
+        return download_blob(blob_name, bucket)
+
+    blob_names = iter(blob_names)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        downloads = deque(
+            (blob_name, executor.submit(fetch, blob_name))
+            for blob_name in islice(blob_names, prefetch)
+        )
+        while downloads:
+            blob_name, download = downloads.popleft()
+            raw_bytes = download.result()
+            for next_blob_name in islice(blob_names, 1):
+                downloads.append((next_blob_name, executor.submit(fetch, next_blob_name)))
+            yield blob_name, raw_bytes
+            del raw_bytes
+
+
+def open_blob(
+    blob_name: str,
+    bucket: str = const.NWM_BUCKET,
+    block_size: int = REMOTE_BLOCK_SIZE,
+):
+    """Open a blob as a lazy, seekable remote file.
+
+    Reads are byte-range requests of `block_size` blocks, and fetched
+    blocks are kept in a block cache, so opening an HDF5/NetCDF file and
+    reading one variable or window only transfers the chunks needed.
+
+    Returns
+    -------
+    file : fsspec file-like object
+    """
+    fs = fsspec.filesystem("gcs", token="anon")
+    return fs.open(
+        f"{bucket}/{blob_name}",
+        mode="rb",
+        block_size=block_size,
+        cache_type="blockcache",
+    )
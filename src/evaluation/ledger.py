@@ -0,0 +1,238 @@
+"""Ingest ledger, records completed units of ingest work.
+
+Each unit (e.g. one forecast or one day of observations) of a job (e.g.
+"nwm_medium_range_mem1") is recorded in an SQLite table with its status,
+output file, row count, byte size, checksum and a fingerprint of its
+inputs.  Reruns skip units that are done, whose output is unchanged and
+whose inputs have the same fingerprint, and retry failed, missing or
+interrupted ones, so a backfill can be stopped and resumed at any time.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import config
+import utils
+
+from typing import Callable, Dict, Iterable, List, Optional
+
+STATUSES = ("running", "done", "failed")
+
+# Ledgers by process ID, an SQLite connection must not be shared with
+# forked workers (see utils.process_local)
+_ledgers = {}
+
+
+def fingerprint(*parts) -> str:
+    """Fingerprint of the inputs of a unit, e.g. its blob names, weights
+    file and parameters."""
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def file_checksum(filepath: str, block_size: int = 2**20) -> str:
+    """SHA-256 of a file."""
+    checksum = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+class IngestLedger:
+    """SQLite ledger of ingest units.
+
+    Parameters
+    ----------
+    filepath : str, required
+        Path of the SQLite file.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = str(filepath)
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.filepath,
+            timeout=60,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            "job TEXT, unit TEXT, status TEXT, output_path TEXT, "
+            "rows INTEGER, bytes INTEGER, checksum TEXT, fingerprint TEXT, "
+            "error TEXT, started REAL, finished REAL, "
+            "PRIMARY KEY (job, unit))"
+        )
+
+    def get(self, job: str, unit: str) -> Optional[dict]:
+        """Ledger entry of a unit, or None if it was never started."""
+        cursor = self._conn.execute(
+            "SELECT * FROM units WHERE job = ? AND unit = ?",
+            (job, unit)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cursor.description], row))
+
+    def is_complete(
+        self,
+        job: str,
+        unit: str,
+        fingerprint: str = None,
+        verify: bool = False,
+    ) -> bool:
+        """If a unit is done and its output is still valid.
+
+        The output file must exist with the recorded size and, if given,
+        the inputs must have the same fingerprint.  `verify` also
+        recomputes the checksum of the output.
+        """
+        entry = self.get(job, unit)
+        if entry is None or entry["status"] != "done":
+            return False
+        if fingerprint is not None and entry["fingerprint"] != fingerprint:
+            return False
+        output_path = entry["output_path"]
+        if output_path is not None:
+            try:
+                if os.path.getsize(output_path) != entry["bytes"]:
+                    return False
+            except OSError:
+                return False
+            if verify and file_checksum(output_path) != entry["checksum"]:
+                return False
+        return True
+
+    def pending(
+        self,
+        job: str,
+        units: Iterable[str],
+        fingerprints: Dict[str, str] = None,
+    ) -> List[str]:
+        """Units that are not complete (never run, failed, interrupted or
+        with changed output or inputs), in the given order."""
+        if fingerprints is None:
+            fingerprints = {}
+        return [
+            unit for unit in units
+            if not self.is_complete(job, unit, fingerprints.get(unit))
+        ]
+
+    def start(self, job: str, unit: str, fingerprint: str = None):
+        """Record that a unit started, a unit left running was interrupted."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO units (job, unit, status, fingerprint, started) "
+            "VALUES (?, ?, 'running', ?, ?)",
+            (job, unit, fingerprint, time.time())
+        )
+
+    def complete(
+        self,
+        job: str,
+        unit: str,
+        output_path: str = None,
+        rows: int = None,
+        fingerprint: str = None,
+    ):
+        """Record that a unit is done, with the size and checksum of its
+        output file."""
+        size = checksum = None
+        if output_path is not None:
+            output_path = str(output_path)
+            size = os.path.getsize(output_path)
+            checksum = file_checksum(output_path)
+        self._conn.execute(
+            "INSERT INTO units (job, unit, status, output_path, rows, bytes, "
+            "checksum, fingerprint, finished) "
+            "VALUES (?, ?, 'done', ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(job, unit) DO UPDATE SET "
+            "status = 'done', output_path = excluded.output_path, "
+            "rows = excluded.rows, bytes = excluded.bytes, "
+            "checksum = excluded.checksum, fingerprint = excluded.fingerprint, "
+            "error = NULL, finished = excluded.finished",
+            (job, unit, output_path, rows, size, checksum, fingerprint, time.time())
+        )
+
+    def update_output(self, output_path: str, new_output_path: str = None):
+        """Record the new size and checksum of an output file rewritten
+        (and moved to `new_output_path`) after its unit was done."""
+        output_path = str(output_path)
+        if new_output_path is None:
+            new_output_path = output_path
+        new_output_path = str(new_output_path)
+        self._conn.execute(
+            "UPDATE units SET output_path = ?, bytes = ?, checksum = ? "
+            "WHERE output_path = ? AND status = 'done'",
+            (
+                new_output_path,
+                os.path.getsize(new_output_path),
+                file_checksum(new_output_path),
+                output_path,
+            )
+        )
+
+    def fail(self, job: str, unit: str, error: str):
+        """Record that a unit failed, it is retried by the next run."""
+        self._conn.execute(
+            "INSERT INTO units (job, unit, status, error, finished) "
+            "VALUES (?, ?, 'failed', ?, ?) "
+            "ON CONFLICT(job, unit) DO UPDATE SET "
+            "status = 'failed', error = excluded.error, "
+            "finished = excluded.finished",
+            (job, unit, error, time.time())
+        )
+
+    def run(
+        self,
+        job: str,
+        unit: str,
+        fn: Callable[[], int],
+        output_path: str = None,
+        fingerprint: str = None,
+    ) -> Optional[int]:
+        """Run a unit unless it is complete.
+
+        `fn()` writes `output_path` and returns its number of rows.  If
+        it raises, or does not write `output_path`, the unit is recorded
+        as failed and the error is raised.
+
+        Returns
+        -------
+        rows : int
+            None if the unit was skipped, it is already complete.
+        """
+        if self.is_complete(job, unit, fingerprint):
+            return None
+
+        self.start(job, unit, fingerprint)
+        try:
+            rows = fn()
+            self.complete(job, unit, output_path, rows, fingerprint)
+        except BaseException as e:
+            self.fail(job, unit, repr(e))
+            raise
+        return rows
+
+    def summary(self, job: str = None) -> Dict[str, int]:
+        """Number of units by status, of one or every job."""
+        counts = dict.fromkeys(STATUSES, 0)
+        query = "SELECT status, COUNT(*) FROM units"
+        params = ()
+        if job is not None:
+            query += " WHERE job = ?"
+            params = (job,)
+        counts.update(self._conn.execute(f"{query} GROUP BY status", params))
+        return counts
+
+
+def get_ledger() -> IngestLedger:
+    """Get the ingest ledger of this process, at config.INGEST_LEDGER_FILEPATH."""
+    return utils.process_local(
+        _ledgers,
+        None,
+        lambda: IngestLedger(config.INGEST_LEDGER_FILEPATH)
+    )
@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from typing import Dict, Tuple
+
+# Lead hour windows of the accumulations, None is the full forecast
+ACCUMULATION_WINDOWS = (24, 72, None)
+
+# Arrow types of the accumulation columns
+ACCUMULATION_ARROW_TYPES = {
+    "catchment_id": pa.dictionary(pa.int32(), pa.string()),
+    "reference_time": pa.timestamp("us"),
+    "window_hours": pa.int16(),
+    "value": pa.float32(),
+    "valid_hours": pa.int16(),
+    "measurement_unit": pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+# Per second suffixes of rate units, e.g. "mm s^-1"
+_PER_SECOND_SUFFIXES = (" s^-1", " s-1", " s**-1", "/s")
+
+
+def depth_unit(rate_unit: str) -> str:
+    """Unit of a per second rate integrated over time, e.g. "mm s^-1"
+    is accumulated in "mm"."""
+    for suffix in _PER_SECOND_SUFFIXES:
+        if rate_unit.endswith(suffix):
+            return rate_unit[:-len(suffix)]
+    raise ValueError(f"Unit {rate_unit} is not a per second rate")
+
+
+def _plain(array: pa.Array) -> pa.Array:
+    """Dictionary array decoded to its value type."""
+    if pa.types.is_dictionary(array.type):
+        return array.cast(array.type.value_type)
+    return array
+
+
+class PrecipAccumulator:
+    """Running forecast precipitation totals per catchment and lead window.
+
+    MAP rates are added as the hourly results stream in, each catchment
+    of a reference time has one fixed-size row of totals (one per
+    window), so the accumulations are ready when the last hour arrives
+    without reading the MAP output again.
+
+    Parameters
+    ----------
+    windows : Tuple[int, ...], default ACCUMULATION_WINDOWS
+        Lead hours of each accumulation window, None for the full
+        forecast.
+    variable_name : str, default "precipitation_flux"
+        Variable (standard name) to accumulate.
+    timestep_seconds : float, default 3600
+        Duration of each timestep, the rates (e.g. mm s^-1) are
+        multiplied by it to get depths (mm), the measurement unit of the
+        totals is derived from the unit of the rates (see `depth_unit`).
+    """
+
+    def __init__(
+        self,
+        windows: Tuple[int, ...] = ACCUMULATION_WINDOWS,
+        variable_name: str = "precipitation_flux",
+        timestep_seconds: float = 3600,
+    ):
+        self.windows = tuple(windows)
+        self.variable_name = variable_name
+        self.timestep_seconds = timestep_seconds
+
+        # Lead hour limit of each window, the full forecast has no limit
+        self._limits = np.array(
+            [np.inf if w is None else w for w in self.windows]
+        )
+        self._catchment_ids = pd.Index([], dtype=object)
+        # (catchment x window) totals and valid hours by reference time
+        self._totals: Dict[pd.Timestamp, np.ndarray] = {}
+        self._hours: Dict[pd.Timestamp, np.ndarray] = {}
+        self._max_lead: Dict[pd.Timestamp, float] = {}
+        # Unit of the rates, from the MAP measurement_unit
+        self._rate_unit = None
+
+    def _catchment_rows(self, catchment_ids: np.ndarray) -> np.ndarray:
+        """Row of each of some unique catchment IDs, adding rows for new
+        catchments."""
+        catchment_ids = np.asarray(catchment_ids).astype(str)
+        new_ids = pd.Index(catchment_ids).difference(self._catchment_ids)
+        if len(new_ids):
+            self._catchment_ids = self._catchment_ids.append(new_ids)
+            n_rows = len(self._catchment_ids)
+            for reference_time in self._totals:
+                self._totals[reference_time] = self._grow(self._totals[reference_time], n_rows)
+                self._hours[reference_time] = self._grow(self._hours[reference_time], n_rows)
+        return self._catchment_ids.get_indexer(catchment_ids)
+
+    @staticmethod
+    def _grow(array: np.ndarray, n_rows: int) -> np.ndarray:
+        return np.pad(array, ((0, n_rows - array.shape[0]), (0, 0)))
+
+    def _check_units(self, units: np.ndarray):
+        """Set the unit of the rates with the first values, any other
+        unit raises a ValueError."""
+        units = set(np.asarray(units).astype(str))
+        if self._rate_unit is None and len(units) == 1:
+            self._rate_unit = units.pop()
+            depth_unit(self._rate_unit)
+        if units - {self._rate_unit}:
+            raise ValueError(
+                f"{self.variable_name} in {sorted(units)}, "
+                f"accumulating {self._rate_unit}"
+            )
+
+    def update(self, df: pd.DataFrame):
+        """Add a MAP result (one or more timesteps) to the accumulations.
+
+        Parameters
+        ----------
+        df : pd.DataFrame, required
+            Long format MAP with catchment_id, value, reference_time,
+            value_time, measurement_unit and variable_name columns.
+        """
+        df = df[df["variable_name"] == self.variable_name]
+        if df.empty:
+            return
+
+        self._check_units(df["measurement_unit"].unique())
+        codes, catchment_ids = pd.factorize(df["catchment_id"].astype(str))
+        self._add(
+            self._catchment_rows(np.asarray(catchment_ids))[codes],
+            df["value"].to_numpy(dtype=np.float64, na_value=np.nan),
+            df["reference_time"].to_numpy(dtype="datetime64[us]"),
+            df["value_time"].to_numpy(dtype="datetime64[us]"),
+        )
+
+    def update_record_batch(self, batch: pa.RecordBatch):
+        """Add a MAP record batch, see `update`.
+
+        The columns are read as Arrow and NumPy arrays, catchment IDs
+        are mapped to rows once per dictionary entry.
+        """
+        in_variable = pc.equal(_plain(batch.column("variable_name")), self.variable_name)
+        batch = batch.filter(in_variable)
+        if batch.num_rows == 0:
+            return
+
+        self._check_units(pc.unique(_plain(batch.column("measurement_unit"))).to_numpy(zero_copy_only=False))
+        catchment_ids = batch.column("catchment_id")
+        if pa.types.is_dictionary(catchment_ids.type):
+            indices = catchment_ids.indices.to_numpy(zero_copy_only=False)
+            dictionary = catchment_ids.dictionary.to_numpy(zero_copy_only=False)
+            used = np.unique(indices)
+            dictionary_rows = np.full(len(dictionary), -1)
+            dictionary_rows[used] = self._catchment_rows(dictionary[used])
+            rows = dictionary_rows[indices]
+        else:
+            ids, inverse = np.unique(
+                catchment_ids.cast(pa.string()).to_numpy(zero_copy_only=False),
+                return_inverse=True
+            )
+            rows = self._catchment_rows(ids)[inverse]
+
+        self._add(
+            rows,
+            batch.column("value").to_numpy(zero_copy_only=False).astype(np.float64),
+            batch.column("reference_time").cast(pa.timestamp("us")).to_numpy(zero_copy_only=False),
+            batch.column("value_time").cast(pa.timestamp("us")).to_numpy(zero_copy_only=False),
+        )
+
+    def _add(
+        self,
+        rows: np.ndarray,
+        values: np.ndarray,
+        reference_times: np.ndarray,
+        value_times: np.ndarray,
+    ):
+        """Add rates (NaN if missing) at the catchment rows of every
+        reference time and window."""
+        # Every catchment has a row, also if all its values are missing
+        n_rows = len(self._catchment_ids)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return
+        rows = rows[valid]
+        depth = values[valid] * self.timestep_seconds
+        reference_times = reference_times[valid]
+        lead_hrs = (value_times[valid] - reference_times) / np.timedelta64(1, "h")
+
+        for reference_time in np.unique(reference_times):
+            in_run = reference_times == reference_time
+            reference_time = pd.Timestamp(reference_time)
+            if reference_time not in self._totals:
+                shape = (n_rows, len(self.windows))
+                self._totals[reference_time] = np.zeros(shape)
+                self._hours[reference_time] = np.zeros(shape, dtype=np.int32)
+                self._max_lead[reference_time] = 0
+            totals = self._totals[reference_time]
+            hours = self._hours[reference_time]
+            self._max_lead[reference_time] = max(
+                self._max_lead[reference_time],
+                lead_hrs[in_run].max()
+            )
+
+            for w, limit in enumerate(self._limits):
+                in_window = in_run & (lead_hrs <= limit)
+                totals[:, w] += np.bincount(
+                    rows[in_window],
+                    weights=depth[in_window],
+                    minlength=n_rows
+                )
+                hours[:, w] += np.bincount(rows[in_window], minlength=n_rows)
+
+    def to_df(self) -> pd.DataFrame:
+        """Accumulations as a compact long format DataFrame.
+
+        One row per reference time, window and catchment, window_hours of
+        the full forecast is the last lead hour seen.
+        """
+        dfs = []
+        n_rows = len(self._catchment_ids)
+        for reference_time, totals in self._totals.items():
+            window_hours = [
+                self._max_lead[reference_time] if w is None else w
+                for w in self.windows
+            ]
+            dfs.append(pd.DataFrame({
+                "catchment_id": pd.Categorical.from_codes(
+                    np.tile(np.arange(n_rows), len(self.windows)),
+                    categories=self._catchment_ids
+                ),
+                "reference_time": reference_time,
+                "window_hours": np.repeat(window_hours, n_rows).astype(np.int16),
+                "value": totals.T.ravel().astype(np.float32),
+                "valid_hours": self._hours[reference_time].T.ravel().astype(np.int16),
+                "measurement_unit": pd.Categorical(
+                    [depth_unit(self._rate_unit)] * (n_rows * len(self.windows))
+                ),
+            }))
+        if not dfs:
+            return pd.DataFrame(columns=list(ACCUMULATION_ARROW_TYPES))
+        return pd.concat(dfs, ignore_index=True)
+
+    def to_record_batch(self) -> pa.RecordBatch:
+        """Accumulations as an Arrow record batch with a fixed schema."""
+        schema = pa.schema(list(ACCUMULATION_ARROW_TYPES.items()))
+        return pa.RecordBatch.from_pandas(
+            self.to_df(),
+            schema=schema,
+            preserve_index=False
+        )
@@ -0,0 +1,281 @@
+"""Direct reader of NWM channel_rt files.
+
+Instead of building a pandas frame of every gaged reach per file (see
+`nwm_to_parquet.fetch_nwm`), each file is opened with h5py, streamflow is
+read as the stored scaled integers and only the requested features are
+picked, through an index from feature ID to position in the file's
+feature_id array.  The index is built once and reused for every file
+with the same feature_id array.  Values are decoded in bulk with NumPy
+and assembled straight into Arrow arrays.
+"""
+import io
+import os
+
+import blob_names
+import cache
+import config
+import gcs
+import utils
+
+import h5py
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from datetime import datetime
+from typing import Union
+
+# Arrow types of the output columns, see nwm_to_parquet
+CHANNEL_RT_ARROW_TYPES = {
+    "reference_time": pa.timestamp("us"),
+    "value_time": pa.timestamp("us"),
+    "nwm_feature_id": pa.int64(),
+    "usgs_site_code": pa.dictionary(pa.int32(), pa.string()),
+    "value": pa.float32(),
+    "configuration": pa.dictionary(pa.int32(), pa.string()),
+    "measurement_unit": pa.dictionary(pa.int32(), pa.string()),
+    "variable_name": pa.dictionary(pa.int32(), pa.string()),
+}
+
+EPOCH_UNITS = "minutes since 1970-01-01"
+
+
+class FeatureIndex:
+    """Positions of the requested features in a channel_rt feature_id array.
+
+    The positions are found with one argsort of the file's feature_id
+    array and a searchsorted of the requested IDs, and kept for every
+    following file with the same feature_id array.
+
+    Parameters
+    ----------
+    feature_ids : np.ndarray, required
+        NWM feature IDs to read.
+    site_codes : np.ndarray, optional
+        USGS site code of each feature, added as the usgs_site_code
+        column.
+    """
+
+    def __init__(self, feature_ids: np.ndarray, site_codes: np.ndarray = None):
+        self.feature_ids = np.asarray(feature_ids, dtype=np.int64)
+        self.site_codes = None if site_codes is None else np.asarray(site_codes, dtype=str)
+        self._file_feature_ids = None
+        self._positions = None
+        self._found = None
+
+    def positions(self, file_feature_ids: np.ndarray):
+        """Positions of the requested features found in a file's
+        feature_id array, and which requested features were found."""
+        if self._file_feature_ids is None or not np.array_equal(
+            file_feature_ids,
+            self._file_feature_ids
+        ):
+            order = np.argsort(file_feature_ids, kind="stable")
+            sorted_ids = file_feature_ids[order]
+            if len(sorted_ids):
+                loc = np.searchsorted(sorted_ids, self.feature_ids)
+                loc = np.minimum(loc, len(sorted_ids) - 1)
+                found = sorted_ids[loc] == self.feature_ids
+            else:
+                # No features in the file, none is found
+                loc = np.zeros(len(self.feature_ids), dtype=np.int64)
+                found = np.zeros(len(self.feature_ids), dtype=bool)
+            self._positions = order[loc[found]]
+            self._found = found
+            self._file_feature_ids = file_feature_ids
+        return self._positions, self._found
+
+
+def _decode(raw: np.ndarray, attrs) -> np.ndarray:
+    """Apply the fill value, scale factor and offset of a packed variable."""
+    values = raw.astype(np.float32)
+    if "_FillValue" in attrs:
+        values[raw == attrs["_FillValue"][0]] = np.nan
+    if "missing_value" in attrs:
+        values[raw == attrs["missing_value"][0]] = np.nan
+    if "scale_factor" in attrs:
+        values *= np.float32(attrs["scale_factor"][0])
+    if "add_offset" in attrs:
+        values += np.float32(attrs["add_offset"][0])
+    return values
+
+
+def _read_time(f: h5py.File, variable: str) -> datetime:
+    units = f[variable].attrs["units"]
+    if isinstance(units, bytes):
+        units = units.decode()
+    if not units.startswith(EPOCH_UNITS):
+        raise ValueError(f"Unexpected {variable} units {units}")
+    return pd.Timestamp(0) + pd.Timedelta(minutes=int(f[variable][0]))
+
+
+def read_channel_rt(
+    source,
+    index: FeatureIndex,
+    configuration: str,
+    variable: str = "streamflow",
+) -> pa.RecordBatch:
+    """Read the requested features of one channel_rt file.
+
+    Parameters
+    ----------
+    source : str or file-like, required
+        Path or file object of the NetCDF file.
+    index : FeatureIndex, required
+        Features to read.
+    configuration : str, required
+        Configuration column value, e.g. "medium_range_mem1".
+    variable : str, default "streamflow"
+        Variable to read.
+
+    Returns
+    -------
+    batch : pa.RecordBatch
+        One row per requested feature found in the file, see
+        CHANNEL_RT_ARROW_TYPES.
+    """
+    with h5py.File(source, "r") as f:
+        positions, found = index.positions(f["feature_id"][:])
+        n = len(positions)
+
+        # Only the requested positions are read, as stored (scaled
+        # integers).  h5py selections must be increasing, so the unique
+        # sorted positions are read and put back in requested order.
+        dataset = f[variable]
+        if n:
+            unique_positions, inverse = np.unique(positions, return_inverse=True)
+            raw = dataset[unique_positions][inverse]
+        else:
+            raw = np.empty(0, dtype=dataset.dtype)
+        values = _decode(raw, dataset.attrs)
+
+        units = dataset.attrs.get("units", b"")
+        if isinstance(units, bytes):
+            units = units.decode()
+        reference_time = _read_time(f, "reference_time")
+        value_time = _read_time(f, "time")
+
+    columns = {
+        "reference_time": pa.array(np.full(n, reference_time, dtype="datetime64[us]")),
+        "value_time": pa.array(np.full(n, value_time, dtype="datetime64[us]")),
+        "nwm_feature_id": pa.array(index.feature_ids[found]),
+        "usgs_site_code": (
+            pa.nulls(n, pa.string()) if index.site_codes is None
+            else pa.array(index.site_codes[found])
+        ).dictionary_encode(),
+        "value": pa.array(values),
+        "configuration": _repeat_string(configuration, n),
+        "measurement_unit": _repeat_string(units, n),
+        "variable_name": _repeat_string(variable, n),
+    }
+    return pa.RecordBatch.from_arrays(
+        list(columns.values()),
+        schema=pa.schema(list(CHANNEL_RT_ARROW_TYPES.items())),
+    )
+
+
+def _repeat_string(value: str, n: int) -> pa.DictionaryArray:
+    return pa.DictionaryArray.from_arrays(
+        pa.array(np.zeros(n, dtype=np.int32)),
+        pa.array([value])
+    )
+
+
+def _is_cached(blob_name: str) -> bool:
+    """If a blob is in the NWM file cache, a plain path check so download
+    threads never touch the cache index."""
+    return os.path.exists(os.path.join(config.NWM_CACHE_DIR, blob_name))
+
+
+def _blob_source(blob_name: str, raw_bytes: bytes, use_cache: bool):
+    """Readable source of a prefetched blob, cached if `use_cache`."""
+    if not use_cache:
+        return io.BytesIO(raw_bytes)
+    nc_cache = cache.get_cache()
+    if raw_bytes is None:
+        filepath = nc_cache.get(blob_name)
+        if filepath is not None:
+            return filepath
+        # Evicted since it was checked
+        raw_bytes = gcs.download_blob(blob_name)
+    return nc_cache.put_bytes(blob_name, raw_bytes)
+
+
+def gage_feature_index() -> FeatureIndex:
+    """Index of the reaches with a USGS gage, as in hydrotools."""
+    gages = utils.get_usgs_gages()
+    return FeatureIndex(
+        gages["nwm_feature_id"].to_numpy(),
+        gages["gage_id"].str.strip().to_numpy()
+    )
+
+
+def read_forecast(
+    configuration: str,
+    reference_time: Union[str, datetime],
+    member: int = 1,
+    index: FeatureIndex = None,
+    use_cache: bool = True,
+    download_workers: int = 8,
+) -> pa.Table:
+    """Read every channel_rt file of a forecast.
+
+    Files are downloaded by `download_workers` threads while they are
+    read in order, the feature index is built from the first file and
+    reused for the others.
+
+    Parameters
+    ----------
+    configuration : str, required
+        e.g. "medium_range", see `blob_names.CONFIG_SPECS`.
+    reference_time : Union[str, datetime], required
+        Reference time, YYYYmmddTHHZ if a string.
+    member : int, default 1
+        Ensemble member.
+    index : FeatureIndex, optional
+        Features to read, defaults to the gaged reaches.
+    use_cache : bool, default True
+        If the NWM file cache should be used.
+    download_workers : int, default 8
+        Number of concurrent downloads.
+
+    Returns
+    -------
+    table : pa.Table
+        One row per feature and timestep, see CHANNEL_RT_ARROW_TYPES.
+    """
+    if isinstance(reference_time, str):
+        reference_time = datetime.strptime(reference_time, "%Y%m%dT%HZ")
+    if index is None:
+        index = gage_feature_index()
+
+    blob_list = blob_names.generate_blob_names(
+        configuration,
+        reference_time,
+        variable="channel_rt",
+        member=member
+    )
+    # Members are part of the configuration name, e.g. "medium_range_mem1"
+    specs = blob_names.config_specs(
+        configuration,
+        version=blob_names.nwm_version(reference_time),
+        member=member
+    )
+    configuration_name = configuration
+    if specs["dir_suffix"].startswith("_mem"):
+        configuration_name += specs["dir_suffix"]
+
+    # At most 2 * download_workers downloaded files wait in memory
+    batches = []
+    downloads = gcs.prefetch_blobs(
+        blob_list,
+        workers=download_workers,
+        is_cached=_is_cached if use_cache else None,
+    )
+    for blob_name, raw_bytes in downloads:
+        source = _blob_source(blob_name, raw_bytes, use_cache)
+        batches.append(read_channel_rt(source, index, configuration_name))
+    return pa.Table.from_batches(
+        batches,
+        schema=pa.schema(list(CHANNEL_RT_ARROW_TYPES.items()))
+    )
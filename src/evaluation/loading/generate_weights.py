@@ -1,49 +1,316 @@
-import pickle
+import os
 import config
 import const
+import utils
 
 import geopandas as gpd
 import numpy as np
 import xarray as xr
 
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from affine import Affine
 from rasterio.features import rasterize
 from utils import parquet_to_gdf
 from grid_to_parquet import get_dataset
 
 TEMPLATE_BLOB_NAME = "nwm.20221001/forcing_medium_range/nwm.t00z.medium_range.forcing.f001.conus.nc"
 
+
+def geometry_window(
+    bounds: Tuple[float, float, float, float],
+    transform: Affine,
+    grid_shape: Tuple[int, int],
+    pad: int = 1,
+) -> Tuple[int, int, int, int]:
+    """Grid window (row_start, row_stop, col_start, col_stop) covering bounds.
+
+    Works for north-up and south-up grids.  The window is padded by
+    `pad` cells and clipped to the grid, it is empty if the bounds do
+    not overlap the grid.
+    """
+    minx, miny, maxx, maxy = bounds
+    cols, rows = ~transform * (
+        np.array([minx, maxx, minx, maxx]),
+        np.array([miny, miny, maxy, maxy])
+    )
+    row_start = max(int(np.floor(rows.min())) - pad, 0)
+    row_stop = min(int(np.ceil(rows.max())) + pad, grid_shape[0])
+    col_start = max(int(np.floor(cols.min())) - pad, 0)
+    col_stop = min(int(np.ceil(cols.max())) + pad, grid_shape[1])
+    return row_start, max(row_stop, row_start), col_start, max(col_stop, col_start)
+
+
+def rasterize_window(
+    geometry,
+    transform: Affine,
+    grid_shape: Tuple[int, int],
+    all_touched: bool = True,
+) -> np.ndarray:
+    """Flattened grid cell indices covered by a geometry.
+
+    Only the bounding-box window of the geometry is rasterized instead
+    of the full grid.
+    """
+    row_start, row_stop, col_start, col_stop = geometry_window(
+        geometry.bounds, transform, grid_shape
+    )
+    if row_stop == row_start or col_stop == col_start:
+        return np.zeros(0, dtype=np.int32)
+
+    window_transform = transform * Affine.translation(col_start, row_start)
+    geom_rasterize = rasterize([(geometry, 1)],
+                               out_shape=(row_stop - row_start, col_stop - col_start),
+                               transform=window_transform,
+                               all_touched=all_touched,
+                               fill=0,
+                               dtype='uint8')
+    rows, cols = np.nonzero(geom_rasterize)
+    return np.ravel_multi_index(
+        (rows + row_start, cols + col_start),
+        grid_shape
+    ).astype(np.int32)
+
+
+def coverage_window(
+    geometry,
+    transform: Affine,
+    grid_shape: Tuple[int, int],
+    supersample: int = 10,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Flattened grid cell indices and fractional coverage of a geometry.
+
+    The bounding-box window of the geometry is rasterized on a grid
+    `supersample` times finer than the template, and the fraction of
+    sub-cells inside the geometry is summed back to each grid cell.
+
+    Returns
+    -------
+    cells : np.ndarray
+        Flattened grid cell indices with coverage > 0.
+    fractions : np.ndarray
+        Fraction of each cell covered by the geometry.
+    """
+    row_start, row_stop, col_start, col_stop = geometry_window(
+        geometry.bounds, transform, grid_shape
+    )
+    n_rows = row_stop - row_start
+    n_cols = col_stop - col_start
+    if n_rows == 0 or n_cols == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+    window_transform = (
+        transform
+        * Affine.translation(col_start, row_start)
+        * Affine.scale(1 / supersample)
+    )
+    fine = rasterize([(geometry, 1)],
+                     out_shape=(n_rows * supersample, n_cols * supersample),
+                     transform=window_transform,
+                     all_touched=False,
+                     fill=0,
+                     dtype='uint8')
+    coverage = fine.reshape(
+        n_rows, supersample, n_cols, supersample
+    ).sum(axis=(1, 3), dtype=np.int32)
+
+    rows, cols = np.nonzero(coverage)
+    cells = np.ravel_multi_index(
+        (rows + row_start, cols + col_start),
+        grid_shape
+    ).astype(np.int32)
+    fractions = (coverage[rows, cols] / supersample ** 2).astype(np.float32)
+    return cells, fractions
+
+
+def _rasterize_chunk(args) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Rasterize a chunk of geometries (process pool worker)."""
+    row_offset, geometries, transform, grid_shape, all_touched, supersample = args
+    rows = []
+    cols = []
+    weights = []
+    for i, geometry in enumerate(geometries):
+        if supersample:
+            cells, fractions = coverage_window(
+                geometry, transform, grid_shape, supersample
+            )
+        else:
+            cells = rasterize_window(geometry, transform, grid_shape, all_touched)
+            fractions = np.ones(len(cells), dtype=np.float32)
+        rows.append(np.full(len(cells), row_offset + i, dtype=np.int32))
+        cols.append(cells)
+        weights.append(fractions)
+    if not rows:
+        return (
+            np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.float32),
+        )
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def weights_by_window(
+    geometries: List,
+    transform: Affine,
+    grid_shape: Tuple[int, int],
+    all_touched: bool = True,
+    max_workers: int = None,
+    supersample: int = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Crosswalk rows, cells and weights, rasterizing each geometry in
+    its window.
+
+    Geometries are split into chunks and rasterized across a process pool.
+    Weights are 1, or the fractional coverage of each cell if
+    `supersample` is set (see `coverage_window`).
+    """
+    if max_workers is None:
+        max_workers = max((os.cpu_count() - 2), 1)
+    chunksize = max(len(geometries) // (max_workers * 4), 1)
+
+    chunks = [
+        (
+            start,
+            geometries[start:start + chunksize],
+            transform,
+            grid_shape,
+            all_touched,
+            supersample,
+        )
+        for start in range(0, len(geometries), chunksize)
+    ]
+
+    if max_workers == 1:
+        results = [_rasterize_chunk(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_rasterize_chunk, chunks))
+
+    if not results:
+        return _rasterize_chunk((0, [], transform, grid_shape, all_touched, supersample))
+    rows = np.concatenate([r[0] for r in results])
+    cols = np.concatenate([r[1] for r in results])
+    weights = np.concatenate([r[2] for r in results])
+    return rows, cols, weights
+
+
+def weights_by_label(
+    geometries: List,
+    transform: Affine,
+    grid_shape: Tuple[int, int],
+    all_touched: bool = True,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Crosswalk rows, cells and weights, burning all geometries into one label raster.
+
+    Fastest option, but each cell gets a single label, so a cell on the
+    boundary of two polygons only counts toward one of them.  Only
+    matches the window method for non-touching polygons.
+    """
+    label_raster = rasterize(
+        zip(geometries, range(1, len(geometries) + 1)),
+        out_shape=grid_shape,
+        transform=transform,
+        all_touched=all_touched,
+        fill=0,
+        dtype='int32'
+    ).ravel()
+    cols = np.flatnonzero(label_raster).astype(np.int32)
+    rows = label_raster[cols] - 1
+    return rows, cols, np.ones(len(cols), dtype=np.float32)
+
+
 def generate_weights_file(
     gdf: gpd.GeoDataFrame,
     src: xr.DataArray,
     weights_filepath: str,
-    crosswalk_dict_key: str = None
+    crosswalk_dict_key: str = None,
+    method: str = "window",
+    all_touched: bool = True,
+    max_workers: int = None,
+    coverage: bool = False,
+    supersample: int = 10,
+    crs: str = const.CONUS_NWM_WKT,
 ):
-    """Generate a weights file."""
-
-    gdf_proj = gdf.to_crs(const.CONUS_NWM_WKT)
-
-    crosswalk_dict = {}
-    # This is a probably a really poor performing way to do this
-    for index, row in gdf_proj.iterrows():
-        geom_rasterize = rasterize([(row["geometry"], 1)],
-                                   out_shape=src.rio.shape,
-                                   transform=src.rio.transform(),
-                                   all_touched=True,
-                                   fill=0,
-                                   dtype='uint8')
-        if crosswalk_dict_key:
-            crosswalk_dict[row[crosswalk_dict_key]
-                           ] = np.where(geom_rasterize == 1)
-        else:
-            crosswalk_dict[index] = np.where(geom_rasterize == 1)
+    """Generate a weights file.
+
+    Raises a ValueError if no polygon overlaps the template grid, e.g.
+    CONUS polygons on the Hawaii grid.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame, required
+        Polygons to generate weights for.
+    src : xr.DataArray, required
+        Template grid.
+    weights_filepath : str, required
+        Where to save the weights file.
+    crosswalk_dict_key : str, optional
+        Column used as catchment ID, defaults to the index.
+    method : str, default "window"
+        "window" rasterizes each polygon within its bounding-box window
+        across a process pool.  "label" burns all polygons at once into
+        a label raster (see `weights_by_label`).
+    all_touched : bool, default True
+        Include every cell touched by the polygon.
+    max_workers : int, optional
+        Number of processes for the "window" method.
+    coverage : bool, default False
+        Weight each cell by the fraction of it covered by the polygon
+        instead of binary membership, so the MAP is an area weighted
+        mean.  Only for the "window" method, `all_touched` is ignored.
+    supersample : int, default 10
+        Sub-cells per cell side used to estimate the coverage.
+    crs : str, default const.CONUS_NWM_WKT
+        Projection of the template grid, see weights_registry.DOMAIN_WKT.
+    """
+
+    gdf_proj = gdf.to_crs(crs)
+
+    if crosswalk_dict_key:
+        catchment_ids = gdf_proj[crosswalk_dict_key].astype(str).values
+    else:
+        catchment_ids = gdf_proj.index.astype(str).values
+
+    geometries = list(gdf_proj.geometry.values)
+    grid_shape = tuple(src.rio.shape)
+    transform = src.rio.transform()
+
+    if method == "window":
+        rows, cols, weights = weights_by_window(
+            geometries,
+            transform,
+            grid_shape,
+            all_touched,
+            max_workers,
+            supersample=supersample if coverage else None
+        )
+    elif method == "label":
+        if coverage:
+            raise ValueError("coverage weights require the window method")
+        rows, cols, weights = weights_by_label(
+            geometries, transform, grid_shape, all_touched
+        )
+    else:
+        raise ValueError(f"Unknown method {method}")
+
+    if len(rows) == 0:
+        raise ValueError("No polygon overlaps the template grid")
 
-    utils.save_weights_dict(crosswalk_dict, weights_filepath)
+    sparse_weights = utils.SparseWeights(
+        catchment_ids=catchment_ids,
+        rows=rows,
+        cols=cols,
+        weights=weights,
+        grid_shape=grid_shape,
+    )
+    utils.save_weights_file(sparse_weights, weights_filepath)
 
 
 def main():
     """Generate the weights file."""
     # Not 100% sure how best to manage this yet.  Hope a pattern will emerge.
-    huc10_gdf = parquet_to_gdf(config.HUC10_SHP_FILEPATH)
+    huc10_gdf = parquet_to_gdf(config.HUC10_PARQUET_FILEPATH)
     ds = get_dataset(TEMPLATE_BLOB_NAME, use_cache=True)
     src = ds["RAINRATE"]
     generate_weights_file(huc10_gdf, src, config.HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH, crosswalk_dict_key="huc10")
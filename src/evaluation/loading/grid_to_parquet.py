@@ -1,22 +1,42 @@
 import gc
+import multiprocessing
 import os
 import pickle
+import accumulate
+import blob_names
+import cache
 import config
 import const
+import gcs
+import ledger
 import utils
 import time
+import weights_registry
+import zarr_cache
+import zonal_stats
 
+import dask
 import xarray as xr
+# Registers the .rio accessor (nodata of the grids)
+import rioxarray  # noqa: F401
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-
-from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    FIRST_COMPLETED,
+    as_completed,
+    wait,
+)
 from datetime import datetime, timedelta
+from itertools import chain
 
 from pathlib import Path
-
-from google.cloud import storage
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
 
 from rasterio.io import MemoryFile
 
@@ -25,7 +45,8 @@ def list_blobs_forcing(
     configuration: str,
     reference_time: str,
     must_contain: str = 'channel_rt',
-    bucket: str = const.NWM_BUCKET
+    bucket: str = const.NWM_BUCKET,
+    use_manifest: bool = False
 ) -> list:
     """List available blobs with provided parameters.
 
@@ -40,6 +61,9 @@ def list_blobs_forcing(
         YYYYmmddTHHZ format.
     must_contain : str, optional, default 'channel_rt'
         Optional substring found in each blob name.
+    use_manifest : bool, default False
+        Read the listing from the manifest cache, see
+        `blob_names.list_blob_names_cached`.
 
     Returns
     -------
@@ -53,25 +77,23 @@ def list_blobs_forcing(
     issue_date = tokens[0]
     issue_time = tokens[1].lower()
 
-    # Connect to bucket with anonymous client
-    client = storage.Client.create_anonymous_client()
-    bucket = client.bucket(bucket)
-
-    # Get list of blobs
-    blobs = client.list_blobs(
-        bucket,
-        prefix=f'nwm.{issue_date}/{configuration}/nwm.t{issue_time}'
-    )
+    # Get list of blobs with the shared anonymous client
+    prefix = f'nwm.{issue_date}/{configuration}/nwm.t{issue_time}'
+    if use_manifest:
+        names = blob_names.list_blob_names_cached(prefix, bucket=bucket)
+    else:
+        names = gcs.list_blob_names(prefix=prefix, bucket=bucket)
 
     # Return blob names
-    return [b.name for b in list(blobs) if must_contain in b.name]
+    return [b for b in names if must_contain in b]
 
 
 def list_blobs_assim(
         configuration: str,
         issue_date: str,
         must_contain: str = 'tm00',
-        bucket: str = const.NWM_BUCKET
+        bucket: str = const.NWM_BUCKET,
+        use_manifest: bool = False
 ) -> list:
     """List available blobs with provided parameters.
 
@@ -86,6 +108,9 @@ def list_blobs_assim(
         YYYYmmdd format.
     must_contain : str, optional, default 'tm00
         Optional substring found in each blob name.
+    use_manifest : bool, default False
+        Read the listing from the manifest cache, see
+        `blob_names.list_blob_names_cached`.
 
     Returns
     -------
@@ -94,18 +119,15 @@ def list_blobs_assim(
         parameters.
     """
 
-    # Connect to bucket with anonymous client
-    client = storage.Client.create_anonymous_client()
-    bucket = client.bucket(bucket)
-
-    # Get list of blobs
-    blobs = client.list_blobs(
-        bucket,
-        prefix=f'nwm.{issue_date}/{configuration}/'
-    )
+    # Get list of blobs with the shared anonymous client
+    prefix = f'nwm.{issue_date}/{configuration}/'
+    if use_manifest:
+        names = blob_names.list_blob_names_cached(prefix, bucket=bucket)
+    else:
+        names = gcs.list_blob_names(prefix=prefix, bucket=bucket)
 
     # Return blob names
-    return [b.name for b in list(blobs) if must_contain in b.name]
+    return [b for b in names if must_contain in b]
 
 
 def get_blob(
@@ -127,15 +149,43 @@ def get_blob(
         The data stored in the blob.
 
     """
-    # Setup anonymous client and retrieve blob data
-    client = storage.Client.create_anonymous_client()
-    bucket = client.bucket(bucket)
-    return bucket.blob(blob_name).download_as_bytes(timeout=120)
+    # Retrieve blob data with the shared anonymous client
+    return gcs.download_blob(blob_name, bucket=bucket, timeout=120)
+
+
+def load_dataset(
+    source,
+    window: Tuple[slice, slice] = None,
+    variables: List[str] = None,
+    chunks: dict = None,
+) -> xr.Dataset:
+    """Load a NetCDF file, optionally only some variables and a (y, x)
+    window of it.
+
+    The file is opened lazily, so only the requested variables and the
+    HDF5 chunks overlapping the window are read.  If `chunks` is set the
+    dataset is returned dask-backed and nothing is read until computed.
+    """
+    ds = xr.open_dataset(source, engine='h5netcdf', chunks=chunks)
+    if variables is not None:
+        ds = ds[variables]
+    if window is not None:
+        ds = ds.isel(y=window[0], x=window[1])
+    if chunks is not None:
+        return ds
+    with ds:
+        return ds.load()
 
 
 def get_dataset(
         blob_name: str,
-        use_cache: bool = True
+        use_cache: bool = True,
+        window: Tuple[slice, slice] = None,
+        variables: List[str] = None,
+        raw_bytes: bytes = None,
+        lazy_remote: bool = False,
+        cache_backend: str = None,
+        chunks: dict = None,
 ) -> xr.Dataset:
     """Retrieve a blob from the data service as xarray.Dataset.
 
@@ -148,7 +198,27 @@ def get_dataset(
     use_cacahe: bool, default True
         If cache should be used.  
         If True, checks to see if file is in cache, and 
-        if fetched from remote will save to cache.
+        if fetched from remote will save to cache, evicting old
+        files if the cache is over budget (see `cache.DiskCache`).
+    window: Tuple[slice, slice], optional
+        (y, x) window of the grid to read.  Defaults to the full grid.
+    variables: List[str], optional
+        Variables to read and cache, defaults to ["RAINRATE"].
+    raw_bytes: bytes, optional
+        Blob data that was already downloaded, used instead of fetching
+        the blob if it is not in the cache.
+    lazy_remote: bool, default False
+        If the blob is not in the cache, open it remotely and read only
+        the byte ranges of the requested variables and window instead of
+        downloading the whole blob.  Nothing is written to the cache.
+    cache_backend: str, optional
+        "netcdf" caches one NetCDF file per blob, "zarr" caches every
+        timestep of a run in one compressed Zarr store (see
+        `zarr_cache`).  Defaults to config.NWM_CACHE_BACKEND.
+    chunks: dict, optional
+        Dask chunks, e.g. {"y": 768, "x": 768}.  If set the dataset is
+        returned lazy and dask-backed instead of loaded in memory.  A
+        blob that is not cached is still downloaded and cached first.
 
     Returns
     -------
@@ -156,59 +226,121 @@ def get_dataset(
         The data stored in the blob.
 
     """
-    nc_filepath = os.path.join(utils.get_cache_dir(), blob_name)
-    utils.make_parent_dir(nc_filepath)
+    if variables is None:
+        variables = ["RAINRATE"]
+    if cache_backend is None:
+        cache_backend = config.NWM_CACHE_BACKEND
+
+    if use_cache and cache_backend == "zarr":
+        load = chunks is None
+        ds = zarr_cache.read_blobs([blob_name], variables, window, load=load)
+        if ds is not None:
+            return ds
+
+        # Read the full grid of the blob and cache it in the store of its run
+        if raw_bytes is not None:
+            ds = load_dataset(MemoryFile(raw_bytes), variables=variables)
+        elif lazy_remote:
+            with gcs.open_blob(blob_name) as f:
+                ds = load_dataset(f, variables=variables)
+        else:
+            ds = load_dataset(MemoryFile(get_blob(blob_name)), variables=variables)
+        if zarr_cache.write_blob(blob_name, ds) and not load:
+            return zarr_cache.read_blobs([blob_name], variables, window, load=False)
+        if window is not None:
+            ds = ds.isel(y=window[0], x=window[1])
+        return ds
+
+    nc_cache = cache.get_cache()
 
     # If the file exists and use_cache = True
-    if os.path.exists(nc_filepath) and use_cache:
-        # Get dataset from cache
-        ds = xr.load_dataset(
-            nc_filepath,
-            engine='h5netcdf',
-        )
-        return ds
-    else:
-        # Get raw bytes
+    cached_variables = []
+    nc_filepath = nc_cache.get(blob_name) if use_cache else None
+    if nc_filepath is not None:
+        try:
+            with xr.open_dataset(nc_filepath, engine='h5netcdf') as ds:
+                cached_variables = list(ds.data_vars)
+
+            # Get dataset from cache if it has every variable
+            if set(variables) <= set(cached_variables):
+                ds = load_dataset(nc_filepath, window, variables, chunks)
+                return ds
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            cached_variables = []
+
+    if lazy_remote and raw_bytes is None:
+        if chunks is not None:
+            # The remote file stays open for the dask reads
+            return load_dataset(gcs.open_blob(blob_name), window, variables, chunks)
+        with gcs.open_blob(blob_name) as f:
+            return load_dataset(f, window, variables)
+
+    # Get raw bytes
+    if raw_bytes is None:
         raw_bytes = get_blob(blob_name)
-        # Create Dataset
-        ds = xr.load_dataset(
-            MemoryFile(raw_bytes),
-            engine='h5netcdf',
-        )
-        if use_cache:
-            # Subset and cache
-            ds["RAINRATE"].to_netcdf(
-                nc_filepath,
-                engine='h5netcdf',
-            )
-        return ds
+    if not use_cache:
+        return load_dataset(MemoryFile(raw_bytes), window, variables, chunks)
+
+    # Create Dataset with the cached and requested variables
+    cache_variables = list(dict.fromkeys(cached_variables + variables))
+    ds = load_dataset(MemoryFile(raw_bytes), variables=cache_variables)
+
+    # Cache (written to a temporary file and renamed), then subset
+    nc_filepath = nc_cache.put(
+        blob_name,
+        lambda filepath: ds.to_netcdf(filepath, engine='h5netcdf')
+    )
+    if chunks is not None:
+        return load_dataset(nc_filepath, window, variables, chunks)
+    ds = ds[variables]
+    if window is not None:
+        ds = ds.isel(y=window[0], x=window[1])
+    return ds
 
 
 def calc_zonal_stats_weights(
     src: xr.DataArray,
     weights_filepath: str,
+    catchments: Union[str, List[str]] = None,
+    stats: List[str] = None,
+    threshold: float = None,
 ) -> pd.DataFrame:
-    """Calculates zonal stats"""
+    """Calculates zonal stats
 
-    crosswalk_dict = utils.read_weights_file(weights_filepath)
-                            
-    r_array = src.values[0]
-    r_array[r_array == src.rio.nodata] = np.nan
+    The weights are loaded once per process as a sparse
+    (catchment x grid cell) matrix and the mean for every catchment is
+    calculated with a single NaN-aware sparse mat-vec.
 
-    mean_dict = {}
-    for key, value in crosswalk_dict.items():
-        mean_dict[key] = np.nanmean(r_array[value])
+    If `catchments` is set, `src` must be the window of the grid
+    returned by `zonal_stats.load_weights_subset` for them.
 
-    df = pd.DataFrame.from_dict(mean_dict,
-                                orient='index',
-                                columns=['value'])
+    `stats` adds a column per statistic besides the mean, e.g. ["max",
+    "std", "p90", "frac_above"] with `threshold` for frac_above, see
+    `zonal_stats.calc_zonal_stats`.
+    """
 
-    df.reset_index(inplace=True, names="catchment_id")
+    r_array = src.values[0].astype(np.float64)
+    r_array[r_array == src.rio.nodata] = np.nan
 
-    # This should not be needed, but without memory usage grows
-    del crosswalk_dict
-    del f
-    gc.collect()
+    matrix, catchment_ids, _ = zonal_stats.load_weights_subset(
+        weights_filepath,
+        catchments
+    )
+    zonal_stats.check_grid_shape(matrix, r_array.shape)
+    if not stats:
+        mean, count = zonal_stats.calc_zonal_mean(matrix, r_array.ravel())
+        return zonal_stats.zonal_mean_to_df(catchment_ids, mean, count)
+
+    results = zonal_stats.calc_zonal_stats(
+        matrix,
+        r_array.ravel(),
+        ["mean", *stats],
+        threshold
+    )
+    df = zonal_stats.zonal_mean_to_df(catchment_ids, results["mean"], results["count"])
+    for stat in stats:
+        df[stat] = results[stat]
 
     return df
 
@@ -226,18 +358,12 @@ def add_zonalstats_to_gdf_weights(
     return gdf_map
 
 
-def calculate_map_forcing(
-    blob_name: str,
-    weights_filepath: str,
-    use_cache: bool = True,
-) -> pd.DataFrame:
-    """Calculate the MAP for a single NetCDF file (i.e. one timestep).
+def parse_forcing_blob_name(blob_name: str) -> dict:
+    """Get the reference_time, value_time and configuration of a
+    forcing forecast blob.
 
-    ToDo: add way to filter which catchments are calculated
+    e.g. nwm.20221001/forcing_medium_range/nwm.t00z.medium_range.forcing.f001.conus.nc
     """
-    # print(f"Processing {blob_name}, {datetime.now()}")
-
-    # Get some metainfo from blob_name
     path_split = blob_name.split("/")
     reference_time = datetime.strptime(
         path_split[0].split(".")[1] + path_split[2].split(".")[1],
@@ -247,23 +373,108 @@ def calculate_map_forcing(
     value_time = reference_time + timedelta(hours=offset_hours)
     configuration = path_split[1]
 
-    # Get xr.Dataset/xr.DataArray
-    ds = get_dataset(blob_name, use_cache)
-    src = ds["RAINRATE"]
+    return {
+        "reference_time": reference_time,
+        "value_time": value_time,
+        "configuration": configuration,
+    }
 
-    # Pull out some attributes
-    measurement_unit = src.attrs["units"]
-    variable_name = src.attrs["standard_name"]
 
-    # Calculate MAP
-    df = calc_zonal_stats_weights(src, weights_filepath)
+def parse_assim_blob_name(blob_name: str) -> dict:
+    """Get the value_time and configuration of an analysis blob.
+
+    e.g. nwm.20221001/forcing_analysis_assim/nwm.t00z.analysis_assim.forcing.tm00.conus.nc
+    """
+    path_split = blob_name.split("/")
+    issue_datetime = datetime.strptime(
+        path_split[0].split(".")[1] + path_split[2].split(".")[1],
+        "%Y%m%dt%Hz"
+    )
+    offset_hours = int(path_split[2].split(".")[4][2:])  # tm00
+    value_time = issue_datetime - timedelta(hours=offset_hours)
+    configuration = path_split[1]
+
+    return {
+        "value_time": value_time,
+        "configuration": configuration,
+    }
+
+
+def calculate_map(
+    blob_name: str,
+    weights_filepath: str,
+    parse_blob_name: Callable[[str], dict] = parse_forcing_blob_name,
+    use_cache: bool = True,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    raw_bytes: bytes = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> pd.DataFrame:
+    """Calculate the MAP for a single NetCDF file (i.e. one timestep).
+
+    Every variable in `variables` (default ["RAINRATE"]) is calculated
+    from one read of the file with the same weights, and the results
+    are stacked in long format keyed by `variable_name`.
+
+    `catchments` limits the MAP to a list of catchment IDs or an ID
+    prefix (e.g. HUC2 "03"), and only the grid window covering them is
+    read.
+
+    `raw_bytes` is the already downloaded blob and `lazy_remote` reads
+    only the needed byte ranges of the remote blob, see `get_dataset`.
+
+    `stats` adds a column per zonal statistic besides the mean (value),
+    see `calc_zonal_stats_weights`.
+
+    If `weights_filepath` is None the weights of the domain, grid and
+    NWM version of the blob are used, see `weights_registry`.
+    """
+    if variables is None:
+        variables = ["RAINRATE"]
+    if stats is None:
+        stats = []
+    if weights_filepath is None:
+        weights_filepath = weights_registry.resolve_weights(blob_name)
+
+    # Get some metainfo from blob_name
+    blob_meta = parse_blob_name(blob_name)
+
+    # Get xr.Dataset for the window of the catchments
+    _, _, window = zonal_stats.load_weights_subset(weights_filepath, catchments)
+    ds = get_dataset(
+        blob_name,
+        use_cache,
+        window,
+        variables,
+        raw_bytes=raw_bytes,
+        lazy_remote=lazy_remote
+    )
+
+    dfs = []
+    for variable in variables:
+        src = ds[variable]
+
+        # Calculate MAP
+        df = calc_zonal_stats_weights(
+            src,
+            weights_filepath,
+            catchments,
+            stats,
+            threshold
+        )
+
+        # Pull out some attributes
+        df["measurement_unit"] = src.attrs["units"]
+        df["variable_name"] = src.attrs.get("standard_name", variable)
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index=True)
 
     # Set metainfo for MAP
-    df["reference_time"] = reference_time
-    df["value_time"] = value_time
-    df["configuration"] = configuration
-    df["measurement_unit"] = measurement_unit
-    df["variable_name"] = variable_name
+    for column, value in blob_meta.items():
+        df[column] = value
+    df = df[["catchment_id", "value", "valid_count", *stats, *blob_meta.keys(), "measurement_unit", "variable_name"]]
 
     # Reduce memory foot print
     df['configuration'] = df['configuration'].astype("category")
@@ -283,64 +494,796 @@ def calculate_map_forcing(
     return df
 
 
-def calculate_map_assim(
+def calculate_map_forcing(
     blob_name: str,
     weights_filepath: str,
-    use_cache: bool = True
+    use_cache: bool = True,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
 ) -> pd.DataFrame:
-    """Calculate the MAP for a single NetCDF file (i.e. one timestep).
+    """Calculate the MAP for a single forcing forecast NetCDF file.
 
-    ToDo: add way to filter which catchments are calculated
+    See `calculate_map`.
     """
-    # print(f"Processing {blob_name}")
+    return calculate_map(
+        blob_name,
+        weights_filepath,
+        parse_blob_name=parse_forcing_blob_name,
+        use_cache=use_cache,
+        catchments=catchments,
+        variables=variables,
+        lazy_remote=lazy_remote,
+        stats=stats,
+        threshold=threshold
+    )
 
-    # Get some metainfo from blob_name
-    path_split = blob_name.split("/")
-    issue_datetime = datetime.strptime(
-        path_split[0].split(".")[1] + path_split[2].split(".")[1],
-        "%Y%m%dt%Hz"
+
+def calculate_map_assim(
+    blob_name: str,
+    weights_filepath: str,
+    use_cache: bool = True,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> pd.DataFrame:
+    """Calculate the MAP for a single forcing analysis NetCDF file.
+
+    See `calculate_map`.
+    """
+    return calculate_map(
+        blob_name,
+        weights_filepath,
+        parse_blob_name=parse_assim_blob_name,
+        use_cache=use_cache,
+        catchments=catchments,
+        variables=variables,
+        lazy_remote=lazy_remote,
+        stats=stats,
+        threshold=threshold
     )
-    offset_hours = int(path_split[2].split(".")[4][2:])  # tm00
-    value_time = issue_datetime - timedelta(hours=offset_hours)
-    configuration = path_split[1]
 
-    # Get xr.Dataset/xr.DataArray
-    ds = get_dataset(blob_name, use_cache)
-    src = ds["RAINRATE"]
 
-    # Pull out some attributes
-    measurement_unit = src.attrs["units"]
-    variable_name = src.attrs["standard_name"]
+def calculate_map_batch(
+    blob_list: List[str],
+    weights_filepath: str,
+    parse_blob_name: Callable[[str], dict] = parse_forcing_blob_name,
+    use_cache: bool = True,
+    max_timesteps: int = 24,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> pd.DataFrame:
+    """Calculate the MAP for many NetCDF files (i.e. a whole forecast).
 
-    # Calculate MAP
-    df = calc_zonal_stats_weights(src, weights_filepath)
+    The timesteps of every variable are stacked into a
+    (variable x time, grid cell) array and the means for every catchment,
+    variable and timestep are calculated with a single sparse-matrix
+    dense-matrix product.  Only the grid cells that fall in
+    a catchment are stacked.  At most `max_timesteps` are stacked at once
+    to bound memory (~8M HUC10 cells x 24 hours is ~0.8 GB); None stacks
+    every timestep.
 
-    # Set metainfo for MAP
-    # df["reference_time"] = 0
-    df["value_time"] = value_time
-    df["configuration"] = configuration
-    df["measurement_unit"] = measurement_unit
-    df["variable_name"] = variable_name
+    Parameters
+    ----------
+    blob_list : List[str], required
+        Blob names, one per timestep.
+    weights_filepath : str, required
+        Path to the weights file, None resolves the weights from the
+        first blob name (see `weights_registry.resolve_weights`).
+    parse_blob_name : Callable, default parse_forcing_blob_name
+        Returns the metainfo columns (value_time, configuration, ...)
+        for a blob name.
+    use_cache : bool, default True
+        If cache should be used.
+    max_timesteps : int, default 24
+        Maximum number of timesteps stacked per product.
+    catchments : Union[str, List[str]], optional
+        Catchment IDs or ID prefix to calculate, only the grid window
+        covering them is read.  Defaults to all catchments.
+    variables : List[str], optional
+        Variables to calculate from each file, defaults to ["RAINRATE"].
+    lazy_remote : bool, default False
+        Read only the needed byte ranges of blobs not in the cache, see
+        `get_dataset`.
+    stats : List[str], optional
+        Zonal statistics besides the mean, one column each, e.g. ["max",
+        "std", "p90", "frac_above"], see `zonal_stats.calc_zonal_stats`.
+    threshold : float, optional
+        Threshold of the frac_above statistic.
 
-    # Reduce memory foot print
-    # df["reference_time"] = df["reference_time"].astype("category")
-    df['configuration'] = df['configuration'].astype("category")
-    df['measurement_unit'] = df['measurement_unit'].astype("category")
-    df['variable_name'] = df['variable_name'].astype("category")
-    df["catchment_id"] = df["catchment_id"].astype("category")
+    Returns
+    -------
+    df : pd.DataFrame
+        Long format MAP, one row per variable, catchment and timestep.
+    """
+    if variables is None:
+        variables = ["RAINRATE"]
+    if stats is None:
+        stats = []
+    if max_timesteps is None:
+        max_timesteps = max(len(blob_list), 1)
+    if weights_filepath is None and blob_list:
+        weights_filepath = weights_registry.resolve_weights(blob_list[0])
+
+    full_matrix, catchment_ids, window = zonal_stats.load_weights_subset(
+        weights_filepath,
+        catchments
+    )
+    matrix, cells = zonal_stats.compress_columns(full_matrix)
+
+    results = []
+    blob_metas = []
+    attrs = {}
+    for start in range(0, len(blob_list), max_timesteps):
+        batch_blobs = blob_list[start:start + max_timesteps]
+        cube = np.empty(
+            (len(variables), len(batch_blobs), len(cells)),
+            dtype=np.float32
+        )
+        # Every timestep of the batch in one read if cached as Zarr
+        cube_ds = None
+        if use_cache and config.NWM_CACHE_BACKEND == "zarr":
+            cube_ds = zarr_cache.read_blobs(batch_blobs, variables, window)
+
+        for t, blob_name in enumerate(batch_blobs):
+            if cube_ds is not None:
+                ds = cube_ds.isel(time=[t])
+            else:
+                ds = get_dataset(
+                    blob_name,
+                    use_cache,
+                    window,
+                    variables,
+                    lazy_remote=lazy_remote
+                )
+            for v, variable in enumerate(variables):
+                src = ds[variable]
+
+                # Pull out attributes with the first file
+                if variable not in attrs:
+                    zonal_stats.check_grid_shape(full_matrix, src.shape[-2:])
+                    attrs[variable] = (
+                        src.attrs["units"],
+                        src.attrs.get("standard_name", variable),
+                        src.rio.nodata,
+                    )
+
+                cube[v, t] = src.values[0].ravel()[cells]
+            blob_metas.append(parse_blob_name(blob_name))
+            ds.close()
+
+        for v, variable in enumerate(variables):
+            nodata = attrs[variable][2]
+            if nodata is not None:
+                cube[v][cube[v] == nodata] = np.nan
+
+        batch_results = zonal_stats.calc_zonal_stats(
+            matrix,
+            cube.reshape(-1, len(cells)),
+            ["mean", *stats],
+            threshold
+        )
+        results.append({
+            stat: result.reshape(len(variables), len(batch_blobs), -1)
+            for stat, result in batch_results.items()
+        })
+
+    if not results:
+        return pd.DataFrame()
+
+    results = {
+        stat: np.concatenate([r[stat] for r in results], axis=1)
+        for stat in results[0]
+    }
+    return _map_batch_to_df(
+        results["mean"],
+        results["count"],
+        catchment_ids,
+        blob_metas,
+        variables,
+        attrs,
+        {stat: results[stat] for stat in stats}
+    )
 
-    # print(df.info(verbose=True, memory_usage='deep'))
-    # print(df.memory_usage(index=True, deep=True))
-    # print(df)
 
-    # This should not be needed, but without memory usage grows
-    ds.close()
-    del ds
-    gc.collect()
+def _map_batch_to_df(
+    mean: np.ndarray,
+    count: np.ndarray,
+    catchment_ids: np.ndarray,
+    blob_metas: List[dict],
+    variables: List[str],
+    attrs: dict,
+    extra_stats: dict = None,
+) -> pd.DataFrame:
+    """Format (variable, time, catchment) means, valid counts and other
+    zonal statistics as the long format MAP."""
+    n_variables, n_timesteps, n_catchments = mean.shape
+
+    # Build the long format DataFrame in one go, variable then timestep major
+    df = pd.DataFrame({
+        "catchment_id": pd.Categorical.from_codes(
+            np.tile(np.arange(n_catchments), n_variables * n_timesteps),
+            categories=pd.Index(catchment_ids)
+        ),
+        "value": mean.ravel(),
+        "valid_count": count.ravel().astype(np.float32),
+    })
+    for stat, result in (extra_stats or {}).items():
+        df[stat] = result.ravel()
+    for column in blob_metas[0].keys():
+        df[column] = np.tile(
+            np.repeat(
+                pd.Series([m[column] for m in blob_metas]).values,
+                n_catchments
+            ),
+            n_variables
+        )
+    df["configuration"] = df["configuration"].astype("category")
+    rows_per_variable = n_timesteps * n_catchments
+    df["measurement_unit"] = pd.Categorical(
+        np.repeat([attrs[v][0] for v in variables], rows_per_variable)
+    )
+    df["variable_name"] = pd.Categorical(
+        np.repeat([attrs[v][1] for v in variables], rows_per_variable)
+    )
 
     return df
 
 
+def _zonal_stats_block(
+    block: np.ndarray,
+    matrix,
+    cells: np.ndarray,
+    nodata: float,
+    stats: List[str],
+    threshold: float = None,
+) -> np.ndarray:
+    """Zonal means, valid counts and `stats` of a (time, y, x) chunk,
+    stacked as a (2 + len(stats), time, catchment) result."""
+    values = block.reshape(block.shape[0], -1)[:, cells].astype(np.float32)
+    if nodata is not None:
+        values[values == nodata] = np.nan
+    results = zonal_stats.calc_zonal_stats(matrix, values, ["mean", *stats], threshold)
+    return np.stack([results[stat] for stat in ["mean", "count", *stats]])
+
+
+def calculate_map_dask(
+    blob_list: List[str],
+    weights_filepath: str,
+    parse_blob_name: Callable[[str], dict] = parse_forcing_blob_name,
+    use_cache: bool = True,
+    time_chunk: int = 24,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> pd.DataFrame:
+    """Calculate the MAP for many NetCDF files out of core with dask.
+
+    Every file is opened lazily (see `get_dataset`), the timesteps are
+    stacked into a dask array chunked `time_chunk` timesteps at a time and
+    each chunk is reduced to (time, catchment) means and `stats`, as in
+    `calculate_map_batch`.  Memory is bounded by the chunk
+    size instead of the number of files, and the chunks are computed by
+    the active dask scheduler, e.g. a `dask.distributed.LocalCluster`
+    client.
+
+    Parameters
+    ----------
+    blob_list : List[str], required
+        Blob names, one per timestep.
+    weights_filepath : str, required
+        Path to the weights file, None resolves the weights from the
+        first blob name (see `weights_registry.resolve_weights`).
+    parse_blob_name : Callable, default parse_forcing_blob_name
+        Returns the metainfo columns (value_time, configuration, ...)
+        for a blob name.
+    use_cache : bool, default True
+        If cache should be used.
+    time_chunk : int, default 24
+        Timesteps per dask chunk.
+    catchments : Union[str, List[str]], optional
+        Catchment IDs or ID prefix to calculate, only the grid window
+        covering them is read.  Defaults to all catchments.
+    variables : List[str], optional
+        Variables to calculate from each file, defaults to ["RAINRATE"].
+    lazy_remote : bool, default False
+        Read only the needed byte ranges of blobs not in the cache, see
+        `get_dataset`.
+    stats : List[str], optional
+        Zonal statistics besides the mean, one column each, e.g. ["max",
+        "std", "p90", "frac_above"], see `zonal_stats.calc_zonal_stats`.
+    threshold : float, optional
+        Threshold of the frac_above statistic.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Long format MAP, one row per variable, catchment and timestep.
+    """
+    if variables is None:
+        variables = ["RAINRATE"]
+    if stats is None:
+        stats = []
+    if not blob_list:
+        return pd.DataFrame()
+    if weights_filepath is None:
+        weights_filepath = weights_registry.resolve_weights(blob_list[0])
+
+    full_matrix, catchment_ids, window = zonal_stats.load_weights_subset(
+        weights_filepath,
+        catchments
+    )
+    matrix, cells = zonal_stats.compress_columns(full_matrix)
+
+    datasets = [
+        get_dataset(
+            blob_name,
+            use_cache,
+            window,
+            variables,
+            lazy_remote=lazy_remote,
+            chunks={}
+        )
+        for blob_name in blob_list
+    ]
+    stacked = xr.concat(datasets, dim="time")
+
+    blocks = []
+    attrs = {}
+    for variable in variables:
+        src = datasets[0][variable]
+        zonal_stats.check_grid_shape(full_matrix, src.shape[-2:])
+        attrs[variable] = (
+            src.attrs["units"],
+            src.attrs.get("standard_name", variable),
+            src.rio.nodata,
+        )
+
+        data = stacked[variable].data.rechunk((time_chunk, -1, -1))
+        blocks.append(data.map_blocks(
+            _zonal_stats_block,
+            matrix,
+            cells,
+            attrs[variable][2],
+            stats,
+            threshold,
+            drop_axis=[1, 2],
+            new_axis=[0, 2],
+            chunks=((2 + len(stats),), data.chunks[0], (len(catchment_ids),)),
+            dtype=np.float64,
+        ))
+
+    # (variable, mean/count/stats, time, catchment)
+    results = np.stack(dask.compute(*blocks))
+    blob_metas = [parse_blob_name(blob_name) for blob_name in blob_list]
+    return _map_batch_to_df(
+        results[:, 0],
+        results[:, 1],
+        catchment_ids,
+        blob_metas,
+        variables,
+        attrs,
+        {stat: results[:, 2 + i] for i, stat in enumerate(stats)}
+    )
+
+
+def calculate_map_forcing_batch(
+    reference_time: str,
+    weights_filepath: str,
+    use_cache: bool = True,
+    max_timesteps: int = 24,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> pd.DataFrame:
+    """Calculate the MAP for every hour of a forcing forecast.
+
+    Parameters
+    ----------
+    reference_time : str, required
+        Forecast reference time in YYYYmmddTHHZ format.
+
+    `stats` and `threshold` add zonal statistics columns, see
+    `calculate_map_batch`.
+    """
+    blob_list = list_blobs_forcing(
+        configuration="forcing_medium_range",
+        reference_time=reference_time,
+        must_contain="forcing"
+    )
+    return calculate_map_batch(
+        sorted(blob_list),
+        weights_filepath,
+        parse_blob_name=parse_forcing_blob_name,
+        use_cache=use_cache,
+        max_timesteps=max_timesteps,
+        catchments=catchments,
+        variables=variables,
+        lazy_remote=lazy_remote,
+        stats=stats,
+        threshold=threshold
+    )
+
+
+def calculate_map_assim_batch(
+    issue_date: str,
+    weights_filepath: str,
+    use_cache: bool = True,
+    max_timesteps: int = 24,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> pd.DataFrame:
+    """Calculate the MAP for every analysis hour of an issue date.
+
+    Parameters
+    ----------
+    issue_date : str, required
+        Issue date in YYYYmmdd format.
+
+    `stats` and `threshold` add zonal statistics columns, see
+    `calculate_map_batch`.
+    """
+    blob_list = list_blobs_assim(
+        configuration="forcing_analysis_assim",
+        issue_date=issue_date,
+        must_contain="tm00.conus"
+    )
+    return calculate_map_batch(
+        sorted(blob_list),
+        weights_filepath,
+        parse_blob_name=parse_assim_blob_name,
+        use_cache=use_cache,
+        max_timesteps=max_timesteps,
+        catchments=catchments,
+        variables=variables,
+        lazy_remote=lazy_remote,
+        stats=stats,
+        threshold=threshold
+    )
+
+
+# Arrow types of the MAP columns, strings are dictionary encoded
+MAP_ARROW_TYPES = {
+    "catchment_id": pa.dictionary(pa.int32(), pa.string()),
+    "value": pa.float64(),
+    "valid_count": pa.float32(),
+    "reference_time": pa.timestamp("us"),
+    "value_time": pa.timestamp("us"),
+    "configuration": pa.dictionary(pa.int32(), pa.string()),
+    "measurement_unit": pa.dictionary(pa.int32(), pa.string()),
+    "variable_name": pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+def map_df_to_record_batch(df: pd.DataFrame) -> pa.RecordBatch:
+    """Convert a MAP DataFrame to an Arrow record batch.
+
+    Uses a fixed schema so batches from different files can be written
+    to the same Parquet file.
+    """
+    # Zonal statistics columns besides the mean are float64
+    schema = pa.schema([(c, MAP_ARROW_TYPES.get(c, pa.float64())) for c in df.columns])
+    return pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False)
+
+
+# Per-process arguments set by _init_map_worker
+_map_worker_kwargs = {}
+
+
+def _init_map_worker(
+    weights_filepath: str,
+    parse_blob_name: Callable[[str], dict],
+    use_cache: bool,
+    catchments: Union[str, List[str]],
+    variables: List[str],
+    lazy_remote: bool = False,
+    stats: List[str] = None,
+    threshold: float = None,
+):
+    """Process pool initializer, loads the weights once per worker."""
+    _map_worker_kwargs.update(
+        weights_filepath=weights_filepath,
+        parse_blob_name=parse_blob_name,
+        use_cache=use_cache,
+        catchments=catchments,
+        variables=variables,
+        lazy_remote=lazy_remote,
+        stats=stats,
+        threshold=threshold,
+    )
+    # Weights resolved per blob are loaded with the first blob
+    if weights_filepath is not None:
+        zonal_stats.load_weights_subset(weights_filepath, catchments)
+
+
+def _calculate_map_worker(
+    blob_name: str,
+    raw_bytes: bytes = None,
+) -> pa.RecordBatch:
+    """Calculate the MAP for a blob in a worker process."""
+    df = calculate_map(blob_name, raw_bytes=raw_bytes, **_map_worker_kwargs)
+    return map_df_to_record_batch(df)
+
+
+def imap_bounded(
+    executor: Executor,
+    fn: Callable,
+    iterable: Iterable,
+    max_in_flight: int,
+) -> Iterator:
+    """Like executor.map, but with at most `max_in_flight` tasks submitted
+    at a time and results yielded as they complete (unordered).
+
+    Bounds the number of results waiting in the parent process.
+    """
+    in_flight = set()
+    for item in iterable:
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(executor.submit(fn, item))
+    for future in as_completed(in_flight):
+        yield future.result()
+
+
+def _map_mp_context():
+    """Start method context of the MAP worker processes.
+
+    The Blosc codec of the zarr backend keeps a thread pool (and its
+    locks) in every process that compressed or read a chunk, a forked
+    worker can inherit a lock held by one of those threads and hang on
+    its first chunk.  With the zarr backend workers are spawned, fork
+    (the default) is kept otherwise.
+    """
+    if config.NWM_CACHE_BACKEND == "zarr":
+        return multiprocessing.get_context("spawn")
+    return None
+
+
+def _is_cached(blob_name: str) -> bool:
+    """If a blob is in the cache of the configured backend."""
+    if config.NWM_CACHE_BACKEND == "zarr":
+        return zarr_cache.contains(blob_name)
+    # A plain path check, download threads never touch the cache index
+    return os.path.exists(os.path.join(config.NWM_CACHE_DIR, blob_name))
+
+
+def imap_pipelined(
+    executor: Executor,
+    fn: Callable,
+    blob_list: List[str],
+    max_in_flight: int,
+    download_workers: int = 4,
+    prefetch: int = None,
+    use_cache: bool = True,
+) -> Iterator:
+    """Download blobs in threads while `fn(blob_name, raw_bytes)` computes
+    in `executor`, yielding results as they complete (unordered).
+
+    Up to `prefetch` downloads are queued ahead of the compute pool (see
+    `gcs.prefetch_blobs`), so the network and the CPUs are busy at the same time
+    and throughput approaches the slower of the two instead of their sum.
+
+    The raw bytes of a blob stay in the parent until its task is done
+    (they are held by the executor's queues), so at most `prefetch` +
+    `max_in_flight` blobs are in memory.  With `max_in_flight` equal to
+    the number of compute workers no task waits in the executor's
+    queue, the prefetched blobs keep the workers fed.
+
+    Parameters
+    ----------
+    executor : Executor, required
+        Compute pool.
+    fn : Callable, required
+        Called as fn(blob_name, raw_bytes) in the compute pool.
+    blob_list : List[str], required
+        Blobs to process.
+    max_in_flight : int, required
+        Maximum number of compute tasks submitted at a time, each holds
+        its blob bytes.
+    download_workers : int, default 4
+        Number of concurrent downloads.
+    prefetch : int, optional
+        Maximum number of downloads queued or waiting for compute,
+        defaults to 2 * download_workers.
+    use_cache : bool, default True
+        Skip downloading blobs that are already in the cache.
+    """
+    downloads = gcs.prefetch_blobs(
+        blob_list,
+        workers=download_workers,
+        prefetch=prefetch,
+        is_cached=_is_cached if use_cache else None,
+    )
+    in_flight = set()
+    for blob_name, raw_bytes in downloads:
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(executor.submit(fn, blob_name, raw_bytes))
+        del raw_bytes
+
+    for future in as_completed(in_flight):
+        yield future.result()
+
+
+def write_record_batches(
+    batches: Iterable[pa.RecordBatch],
+    parquet_filepath: str,
+) -> int:
+    """Stream record batches to a Parquet file.
+
+    Each batch is written as it arrives, so only one batch is held in
+    memory.  The file is written through `utils.atomic_write`, no file
+    is written if there are no batches.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows written.
+    """
+    batches = iter(batches)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return 0
+
+    n_rows = 0
+    with utils.atomic_write(parquet_filepath) as tmp_filepath:
+        with pq.ParquetWriter(tmp_filepath, first_batch.schema) as writer:
+            for batch in chain([first_batch], batches):
+                writer.write_batch(batch)
+                n_rows += batch.num_rows
+    return n_rows
+
+
+def map_blobs_to_parquet(
+    blob_list: List[str],
+    weights_filepath: str,
+    parquet_filepath: str,
+    parse_blob_name: Callable[[str], dict] = parse_forcing_blob_name,
+    use_cache: bool = True,
+    catchments: Union[str, List[str]] = None,
+    variables: List[str] = None,
+    max_processes: int = None,
+    download_workers: int = None,
+    prefetch: int = None,
+    lazy_remote: bool = False,
+    accumulator: accumulate.PrecipAccumulator = None,
+    stats: List[str] = None,
+    threshold: float = None,
+) -> int:
+    """Calculate the MAP for blobs across a process pool, streaming the
+    results to a Parquet file.
+
+    Each worker loads the weights once in its initializer and returns an
+    Arrow record batch per blob, which the parent writes as soon as it
+    arrives.
+
+    `max_processes` sets the compute concurrency.  If `download_workers`
+    is set, blobs are downloaded by that many threads in the parent,
+    pipelined with the compute (see `imap_pipelined`), otherwise each
+    worker downloads its own blob.  With `lazy_remote` each worker reads
+    only the byte ranges it needs (see `get_dataset`) and blobs are not
+    prefetched.
+
+    If `accumulator` is set, every batch is also added to its running
+    precipitation totals as it is written.  `stats` and `threshold` add
+    zonal statistics columns, see `calculate_map`.
+
+    If `weights_filepath` is None each blob uses the weights of its
+    domain, grid and NWM version (see `weights_registry`), missing
+    weights are built here before the workers start.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows written.
+    """
+    # Set max processes
+    if max_processes is None:
+        max_processes = max((os.cpu_count() - 2), 1)
+
+    if weights_filepath is None:
+        for blob_name in blob_list:
+            weights_registry.resolve_weights(blob_name)
+
+    with ProcessPoolExecutor(
+        max_workers=max_processes,
+        mp_context=_map_mp_context(),
+        initializer=_init_map_worker,
+        initargs=(
+            weights_filepath,
+            parse_blob_name,
+            use_cache,
+            catchments,
+            variables,
+            lazy_remote,
+            stats,
+            threshold,
+        ),
+    ) as executor:
+        if download_workers and not lazy_remote:
+            batches = imap_pipelined(
+                executor,
+                _calculate_map_worker,
+                blob_list,
+                max_in_flight=max_processes,
+                download_workers=download_workers,
+                prefetch=prefetch,
+                use_cache=use_cache
+            )
+        else:
+            batches = imap_bounded(
+                executor,
+                _calculate_map_worker,
+                blob_list,
+                max_in_flight=max_processes * 2
+            )
+        if accumulator is not None:
+            batches = _accumulate_batches(batches, accumulator)
+        return write_record_batches(batches, parquet_filepath)
+
+
+def _accumulate_batches(
+    batches: Iterable[pa.RecordBatch],
+    accumulator: accumulate.PrecipAccumulator,
+) -> Iterator[pa.RecordBatch]:
+    """Add each batch to the accumulator as it passes through."""
+    for batch in batches:
+        accumulator.update_record_batch(batch)
+        yield batch
+
+
+def rollup_map_parquet(
+    parquet_filepath: str,
+    levels: Tuple[int, ...] = zonal_stats.HUC_LEVELS,
+) -> List[str]:
+    """Roll a HUC10 MAP Parquet file up to coarser HUC levels.
+
+    Uses the valid counts of the HUC10 MAP (see
+    `zonal_stats.rollup_zonal_mean`), no grid is read.  Each level is
+    written to a sibling directory, e.g. forcing_medium_range/20230101T00Z.parquet
+    to forcing_medium_range_huc8/20230101T00Z.parquet.
+
+    Returns
+    -------
+    filepaths : List[str]
+        Parquet file of each level.
+    """
+    df = pd.read_parquet(parquet_filepath)
+    directory, filename = os.path.split(parquet_filepath)
+
+    filepaths = []
+    for digits, level_df in zonal_stats.rollup_levels(df, levels).items():
+        level_filepath = os.path.join(f"{directory}_huc{digits}", filename)
+        write_record_batches([map_df_to_record_batch(level_df)], level_filepath)
+        filepaths.append(level_filepath)
+    return filepaths
+
+
+def weights_fingerprint(weights_filepath: str) -> Tuple:
+    """Path, size and modification time of a weights file, part of the
+    ingest ledger fingerprint of MAP outputs."""
+    stat = os.stat(weights_filepath)
+    return (str(weights_filepath), stat.st_size, stat.st_mtime_ns)
+
+
 def main_2():
     """Calculate MAP Forcing"""
 
@@ -358,41 +1301,51 @@ def main_2():
 
         print(f"Start download of {ref_time_str}")
 
-        blob_list = list_blobs_forcing(
-            configuration = "forcing_medium_range",
-            reference_time = ref_time_str,
-            must_contain = "forcing"
+        # Expected names, no bucket listing needed
+        blob_list = blob_names.generate_blob_names(
+            "medium_range",
+            reference_time,
+            variable="forcing"
         )
 
-        # This can be used to run serial
-        # dfs = []
-        # for blob_name in blob_list:
-        #     df = calculate_map(blob_name, use_cache=True)
-        #     dfs.append(df)
+        # Retrieve data using multiple processes and save as parquet file,
+        # accumulating the precipitation totals on the way
+        parquet_filepath = os.path.join(config.MEDIUM_RANGE_FORCING_PARQUET, f"{ref_time_str}.parquet")
 
-        # Set max processes
-        max_processes = max((os.cpu_count() - 2), 1)
-        chunksize = (len(blob_list) // max_processes) + 1
-
-        # Retrieve data using multiple processes
-        with ProcessPoolExecutor(max_workers=max_processes) as executor:
-            dfs = executor.map(
-                calculate_map_forcing,
+        def ingest() -> int:
+            accumulator = accumulate.PrecipAccumulator()
+            n_rows = map_blobs_to_parquet(
                 blob_list,
-                chunksize=chunksize
+                config.HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH,
+                parquet_filepath,
+                parse_blob_name=parse_forcing_blob_name,
+                download_workers=4,
+                accumulator=accumulator
             )
-        
-        # Join all timesteps into single pd.DataFrame
-        df = pd.concat(dfs)
-
-        # Save as parquet file
-        parquet_filepath = os.path.join(config.MEDIUM_RANGE_PARQUET, f"{ref_time_str}.parquet")
-        make_parent_dir(parquet_filepath)
-        df.to_parquet(parquet_filepath)
-
-        # Print out some DataFrame stats
-        print(df.info(verbose=True, memory_usage='deep'))
-        print(df.memory_usage(index=True, deep=True))
+            print(f"Wrote {n_rows} rows to {parquet_filepath}")
+
+            accum_filepath = os.path.join(config.MEDIUM_RANGE_FORCING_ACCUM_PARQUET, f"{ref_time_str}.parquet")
+            write_record_batches([accumulator.to_record_batch()], accum_filepath)
+            rollup_map_parquet(parquet_filepath)
+            return n_rows
+
+        # Skipped if already in the ingest ledger, failures are recorded
+        # and retried by the next run
+        try:
+            n_rows = ledger.get_ledger().run(
+                "forcing_medium_range",
+                ref_time_str,
+                ingest,
+                parquet_filepath,
+                ledger.fingerprint(
+                    blob_list,
+                    weights_fingerprint(config.HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH)
+                ),
+            )
+            if n_rows is None:
+                print(f"Skipping {ref_time_str}, already ingested")
+        except Exception as e:
+            print(f"Failed: {ref_time_str} {e!r}")
 
 
 def main_3():
@@ -409,43 +1362,54 @@ def main_3():
 
         print(f"Start download of {issue_date_str}")
 
-        blob_list = list_blobs_assim(
-            configuration = "forcing_analysis_assim",
-            issue_date = issue_date_str,
-            must_contain = "tm00.conus"
-        )
-
-        # This can be used to run serial
-        # dfs = []
-        # for blob_name in blob_list:
-        #     df = calculate_map(blob_name, use_cache=True)
-        #     dfs.append(df)
+        # tm00 of every hourly run of the day, no bucket listing needed
+        blob_list = [
+            blob_name
+            for reference_time in blob_names.reference_times(
+                "analysis_assim",
+                issue_date,
+                issue_date + timedelta(days=1)
+            )
+            for blob_name in blob_names.generate_blob_names(
+                "analysis_assim",
+                reference_time,
+                variable="forcing",
+                leads=[0]
+            )
+        ]
 
-        # Set max processes
-        max_processes = max((os.cpu_count() - 2), 1)
-        chunksize = (len(blob_list) // max_processes) + 1
+        # Retrieve data using multiple processes and save as parquet file
+        parquet_filepath = os.path.join(config.FORCING_ANALYSIS_ASSIM_PARQUET, f"{issue_date_str}.parquet")
 
-        # Retrieve data using multiple processes
-        with ProcessPoolExecutor(max_workers=max_processes) as executor:
-            dfs = executor.map(
-                calculate_map_assim,
+        def ingest() -> int:
+            n_rows = map_blobs_to_parquet(
                 blob_list,
-                chunksize=chunksize
+                config.HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH,
+                parquet_filepath,
+                parse_blob_name=parse_assim_blob_name,
+                download_workers=4
             )
-        
-        # Join all timesteps into single pd.DataFrame
-        df = pd.concat(dfs)
-
-        # Save as parquet file
-        df.to_parquet(f"map/data/forcing_analysis_assim/{issue_date_str}.parquet")
-
-        # Print out some DataFrame stats
-        print(df.info(verbose=True, memory_usage='deep'))
-        print(df.memory_usage(index=True, deep=True))
-        # print(df)
-
-        del df
-        gc.collect()
+            print(f"Wrote {n_rows} rows to {parquet_filepath}")
+            rollup_map_parquet(parquet_filepath)
+            return n_rows
+
+        # Skipped if already in the ingest ledger, failures are recorded
+        # and retried by the next run
+        try:
+            n_rows = ledger.get_ledger().run(
+                "forcing_analysis_assim",
+                issue_date_str,
+                ingest,
+                parquet_filepath,
+                ledger.fingerprint(
+                    blob_list,
+                    weights_fingerprint(config.HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH)
+                ),
+            )
+            if n_rows is None:
+                print(f"Skipping {issue_date_str}, already ingested")
+        except Exception as e:
+            print(f"Failed: {issue_date_str} {e!r}")
 
 
 if __name__ == "__main__":
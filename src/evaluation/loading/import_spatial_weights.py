@@ -0,0 +1,100 @@
+import config
+import utils
+
+import numpy as np
+import xarray as xr
+
+from typing import Tuple
+
+# (y, x) shape of the NWM CONUS 1 km forcing (LDASIN) grid
+CONUS_GRID_SHAPE = (3840, 4608)
+
+
+def spatial_weights_to_sparse(
+    ds: xr.Dataset,
+    grid_shape: Tuple[int, int] = CONUS_GRID_SHAPE,
+    weight_variable: str = "weight",
+    flip_y: bool = False,
+) -> utils.SparseWeights:
+    """Convert an NWM spatial weights dataset to SparseWeights.
+
+    The spatial weights files have one entry (along the `data` dimension)
+    per polygon/grid cell overlap, with the polygon in `IDmask` and the
+    cell as 1-based `i_index` (x) and `j_index` (y) into the forcing grid.
+
+    Parameters
+    ----------
+    ds : xr.Dataset, required
+        Opened spatialweights_*.nc file.
+    grid_shape : Tuple[int, int], default CONUS_GRID_SHAPE
+        (y, x) shape of the forcing grid.
+    weight_variable : str, default "weight"
+        "weight" (fraction of the polygon in the cell) for polygon area
+        means, or "regridweight" (fraction of the cell in the polygon).
+    flip_y : bool, default False
+        The indices count rows from the south, like the arrays read from
+        the forcing files.  Set to True for grids stored north-up.
+
+    Returns
+    -------
+    weights : utils.SparseWeights
+    """
+    id_mask = ds["IDmask"].values
+    i_index = ds["i_index"].values.astype(np.int64) - 1
+    j_index = ds["j_index"].values.astype(np.int64) - 1
+    weights = ds[weight_variable].values.astype(np.float32)
+
+    if flip_y:
+        j_index = grid_shape[0] - 1 - j_index
+
+    # Drop entries that fall outside the grid
+    in_grid = (
+        (i_index >= 0) & (i_index < grid_shape[1])
+        & (j_index >= 0) & (j_index < grid_shape[0])
+    )
+    if not in_grid.all():
+        id_mask = id_mask[in_grid]
+        i_index = i_index[in_grid]
+        j_index = j_index[in_grid]
+        weights = weights[in_grid]
+
+    catchment_ids, rows = np.unique(id_mask, return_inverse=True)
+    cols = np.ravel_multi_index((j_index, i_index), grid_shape)
+
+    return utils.SparseWeights(
+        catchment_ids=catchment_ids.astype(str),
+        rows=rows.astype(np.int32),
+        cols=cols.astype(np.int32),
+        weights=weights,
+        grid_shape=tuple(grid_shape),
+    )
+
+
+def import_spatial_weights(
+    nc_filepath: str,
+    weights_filepath: str,
+    grid_shape: Tuple[int, int] = CONUS_GRID_SHAPE,
+    weight_variable: str = "weight",
+    flip_y: bool = False,
+):
+    """Convert an NWM spatial weights NetCDF file to a weights file."""
+    with xr.open_dataset(nc_filepath, engine="h5netcdf") as ds:
+        weights = spatial_weights_to_sparse(
+            ds,
+            grid_shape=grid_shape,
+            weight_variable=weight_variable,
+            flip_y=flip_y
+        )
+    utils.save_weights_file(weights, weights_filepath)
+
+
+def main():
+    """Convert the official NWM catchment spatial weights."""
+    import_spatial_weights(
+        config.NWM_SPATIAL_WEIGHTS_FILE,
+        config.NWM_CATCHMENT_WEIGHTS_FILEPATH
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,35 @@
 import os
+import channel_rt
 import config
 import const
+import ledger
+import timeseries_parquet
 import utils
+import time
 from hydrotools.nwm_client import gcp as nwm
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    FIRST_COMPLETED,
+    wait,
+)
 from datetime import datetime, timedelta
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 
-def fetch_nwm(reference_time: str) -> pd.DataFrame:
+def fetch_nwm(
+    reference_time: str,
+    cache_path: str = config.NWM_CACHE_H5,
+    max_processes: int = None,
+) -> pd.DataFrame:
     # Instantiate model data service
     #  By default, NWM values are in SI units
-    model_data_service = nwm.NWMDataService(cache_path=config.NWM_CACHE_H5)
+    model_data_service = nwm.NWMDataService(
+        max_processes=max_processes,
+        cache_path=cache_path
+    )
 
     # Retrieve forecast data
     #  By default, only retrieves data at USGS gaging sites in
@@ -28,33 +47,240 @@ def fetch_nwm(reference_time: str) -> pd.DataFrame:
     return forecast_data
 
 
-def nwm_to_parquet(df: pd.DataFrame, ref_time_str):
+def forecast_parquet_filepath(configuration: str, ref_time_str: str) -> str:
+    """Parquet file of a forecast in its configuration and reference date
+    partition of MEDIUM_RANGE_1_PARQUET."""
+    reference_time = datetime.strptime(ref_time_str, "%Y%m%dT%HZ")
+    return os.path.join(
+        utils.partition_dir(config.MEDIUM_RANGE_1_PARQUET, configuration, reference_time),
+        f"{ref_time_str}.parquet"
+    )
+
+
+def nwm_to_parquet(df: pd.DataFrame, ref_time_str) -> str:
     # convert to US units
     df["value"] = df["value"]/(0.3048**3)
     df["measurement_unit"] = "ft3/s"
-    df["lead_time"] = df["value_time"] - df["reference_time"]
 
-    # Save as parquet file
-    parquet_filepath = os.path.join(config.MEDIUM_RANGE_1_PARQUET, f"{ref_time_str}.parquet")
-    utils.make_parent_dir(parquet_filepath)
-    df.to_parquet(parquet_filepath)
-    
+    # Save as compact parquet file (lead_hours is added), the
+    # configuration is in the partition path
+    parquet_filepath = forecast_parquet_filepath(df["configuration"].iloc[0], ref_time_str)
+    timeseries_parquet.write_canonical_parquet(
+        df.drop(columns="configuration"),
+        parquet_filepath,
+        timeseries_parquet.NWM_ARROW_TYPES,
+        timeseries_parquet.NWM_SORT_BY
+    )
+    return parquet_filepath
+
+
+def nwm_table_to_parquet(table: pa.Table, ref_time_str) -> str:
+    """Save a forecast read by `channel_rt.read_forecast` as parquet, in
+    US units as `nwm_to_parquet`."""
+    n = table.num_rows
+    table = table.set_column(
+        table.schema.get_field_index("value"),
+        "value",
+        pc.divide(table["value"], pa.scalar(0.3048**3, pa.float32()))
+    )
+    table = table.set_column(
+        table.schema.get_field_index("measurement_unit"),
+        "measurement_unit",
+        pa.DictionaryArray.from_arrays(
+            pa.array([0] * n, pa.int32()),
+            pa.array(["ft3/s"])
+        )
+    )
+
+    # Save as compact parquet file (lead_hours is added), the
+    # configuration is in the partition path
+    configuration = table["configuration"][0].as_py() if n else "medium_range_mem1"
+    parquet_filepath = forecast_parquet_filepath(configuration, ref_time_str)
+    timeseries_parquet.write_canonical_parquet(
+        table.drop(["configuration"]),
+        parquet_filepath,
+        timeseries_parquet.NWM_ARROW_TYPES,
+        timeseries_parquet.NWM_SORT_BY
+    )
+    return parquet_filepath
+
+
+def ingest_forecast(
+    ref_time_str: str,
+    cache_path: str = config.NWM_CACHE_H5,
+    max_processes: int = None,
+    direct: bool = False,
+) -> dict:
+    """Fetch one forecast and save it as parquet.
+
+    If `direct` the channel_rt files are read by `channel_rt.read_forecast`
+    instead of hydrotools, `cache_path` and `max_processes` are ignored.
+
+    Returns
+    -------
+    timing : dict
+        Reference time, output path, number of rows and fetch, write and
+        total seconds.
+    """
+    t = time.perf_counter()
+    if direct:
+        forecast_data = channel_rt.read_forecast("medium_range", ref_time_str, member=1)
+        fetched = time.perf_counter()
+        parquet_filepath = nwm_table_to_parquet(forecast_data, ref_time_str)
+    else:
+        forecast_data = fetch_nwm(ref_time_str, cache_path, max_processes)
+        fetched = time.perf_counter()
+        parquet_filepath = nwm_to_parquet(forecast_data, ref_time_str)
+    written = time.perf_counter()
+    return {
+        "reference_time": ref_time_str,
+        "output_path": parquet_filepath,
+        "rows": len(forecast_data),
+        "fetch_seconds": fetched - t,
+        "write_seconds": written - fetched,
+        "total_seconds": written - t,
+    }
+
+
+def ingest_nwm(
+    start_dt: datetime = datetime(2023, 1, 1),  # First one is at 00Z in date
+    ingest_days: int = 20,
+    max_workers: int = None,
+    max_in_flight: int = None,
+    use_processes: bool = True,
+    direct: bool = False,
+) -> pd.DataFrame:
+    """Fetch forecasts for many reference times concurrently and save
+    each as parquet.
+
+    Reference times are fanned out over a pool of `max_workers` processes
+    (or threads if not `use_processes`), with at most `max_in_flight`
+    forecasts fetched or held in memory at a time.  The cores are split
+    between the forecasts, each NWMDataService gets
+    cpu_count / max_workers processes to read its files.
+
+    The hydrotools HDF5 cache can not be shared by concurrent writers, so
+    with more than one worker each forecast gets its own cache file
+    under NWM_CACHE_DIR/gcp_client/, removed once the forecast is
+    written (or failed).  HDF5 is not thread safe either, so threads are
+    only safe with `direct`.
+
+    Forecasts already in the ingest ledger (see `ledger.py`) are skipped,
+    failed or missing ones are fetched again.
+
+    Parameters
+    ----------
+    start_dt : datetime, default 2023-01-01 00Z
+        First reference time.
+    ingest_days : int, default 20
+        Number of days of forecasts (4 per day) to ingest.
+    max_workers : int, optional
+        Number of forecasts fetched concurrently, defaults to 4.
+    max_in_flight : int, optional
+        Maximum number of forecasts submitted at a time, defaults to
+        max_workers.
+    use_processes : bool, default True
+        Use a process pool instead of a thread pool.
+    direct : bool, default False
+        Read the channel_rt files with `channel_rt.read_forecast` instead
+        of hydrotools.
+
+    Returns
+    -------
+    timings : pd.DataFrame
+        Rows and fetch, write and total seconds per forecast fetched.
+    """
+    job = "nwm_medium_range_mem1"
 
-def ingest_nwm():
     # Setup some criteria
-    ingest_days = 20
-    start_dt = datetime(2023, 1, 1) # First one is at 00Z in date
     td = timedelta(hours=6)
     number_of_forecasts = ingest_days * 4
+    if max_workers is None:
+        max_workers = 4
+    if max_in_flight is None:
+        max_in_flight = max_workers
+    max_processes = max(((os.cpu_count() - 2) // max_workers), 1)
+
+    ref_time_strs = [
+        (start_dt + td * f).strftime("%Y%m%dT%HZ")
+        for f in range(number_of_forecasts)
+    ]
+    fingerprints = {
+        ref_time_str: ledger.fingerprint(
+            "medium_range_mem1",
+            ref_time_str,
+            "direct" if direct else "hydrotools"
+        )
+        for ref_time_str in ref_time_strs
+    }
+    ingest_ledger = ledger.get_ledger()
+    pending_ref_time_strs = ingest_ledger.pending(job, ref_time_strs, fingerprints)
+    print(f"{len(ref_time_strs) - len(pending_ref_time_strs)} forecasts already ingested")
+
+    def cache_path(ref_time_str: str) -> str:
+        if max_workers == 1:
+            return config.NWM_CACHE_H5
+        return os.path.join(config.NWM_CACHE_DIR, "gcp_client", f"{ref_time_str}.h5")
+
+    def remove_cache(ref_time_str: str):
+        # Per-forecast caches are not reused, the parquet file is kept
+        path = cache_path(ref_time_str)
+        if path != config.NWM_CACHE_H5 and os.path.exists(path):
+            os.remove(path)
+
+    timings = []
+    t = time.perf_counter()
+    pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with pool(max_workers=max_workers) as executor:
+        pending = iter(pending_ref_time_strs)
+        in_flight = {}
+        while True:
+            # Keep at most max_in_flight forecasts submitted
+            for ref_time_str in pending:
+                print(f"Fetching NWM: {ref_time_str}")
+                utils.make_parent_dir(cache_path(ref_time_str))
+                ingest_ledger.start(job, ref_time_str, fingerprints[ref_time_str])
+                future = executor.submit(
+                    ingest_forecast,
+                    ref_time_str,
+                    cache_path(ref_time_str),
+                    max_processes,
+                    direct
+                )
+                in_flight[future] = ref_time_str
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                ref_time_str = in_flight.pop(future)
+                remove_cache(ref_time_str)
+                try:
+                    timing = future.result()
+                    ingest_ledger.complete(
+                        job,
+                        ref_time_str,
+                        timing["output_path"],
+                        timing["rows"],
+                        fingerprints[ref_time_str]
+                    )
+                except Exception as e:
+                    print(f"Failed: {ref_time_str} {e!r}")
+                    ingest_ledger.fail(job, ref_time_str, repr(e))
+                    timing = {"reference_time": ref_time_str, "error": repr(e)}
+                else:
+                    print(
+                        f"Fetched: {ref_time_str} {timing['rows']} rows "
+                        f"fetch {timing['fetch_seconds']:0.1f}s "
+                        f"write {timing['write_seconds']:0.1f}s"
+                    )
+                timings.append(timing)
 
-    # Loop though forecasts, fetch and save as parquet
-    for f in range(number_of_forecasts):
-        reference_time = start_dt + td * f
-        ref_time_str = reference_time.strftime("%Y%m%dT%HZ")
-        print(f"Fetching NWM: {ref_time_str}")
-        forecast_data = fetch_nwm(reference_time=ref_time_str)
-        print(f"Fetched: {len(forecast_data)} rows")
-        nwm_to_parquet(forecast_data, ref_time_str)
+    elapsed = time.perf_counter() - t
+    print(f"Ingested {len(timings)} forecasts in {elapsed:0.1f}s")
+    return pd.DataFrame(timings)
 
 
 if __name__ == "__main__":
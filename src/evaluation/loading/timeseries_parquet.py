@@ -0,0 +1,278 @@
+"""Canonical compact schema of the NWM and USGS timeseries Parquet files.
+
+IDs are int32, values float32, repeated strings dictionary-encoded and
+lead time is stored as int16 hours instead of a timedelta column.  Rows
+are sorted by location and time, and written in row groups of
+ROW_GROUP_SIZE rows, so row-group statistics prune the joins by ID.
+Files are zstd compressed.
+
+Run as a script to migrate the files already in MEDIUM_RANGE_1_PARQUET
+and USGS_PARQUET.
+"""
+import os
+from glob import glob
+from typing import Dict, List, Union
+
+import config
+import ledger
+import utils
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 6
+
+# Rows per row group, about 8 MB of raw NWM rows.  A medium range
+# forecast (~2M rows) spans several row groups, so the min/max statistics
+# of the sorted ID column let readers skip the groups of other locations.
+ROW_GROUP_SIZE = 2**18
+
+_DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+# Arrow types of the NWM forecast columns, configuration is left out of
+# the files when it is in the partition path (see utils.partition_dir)
+NWM_ARROW_TYPES = {
+    "reference_time": pa.timestamp("us"),
+    "value_time": pa.timestamp("us"),
+    "nwm_feature_id": pa.int32(),
+    "usgs_site_code": _DICTIONARY,
+    "value": pa.float32(),
+    "configuration": _DICTIONARY,
+    "measurement_unit": _DICTIONARY,
+    "variable_name": _DICTIONARY,
+    "lead_hours": pa.int16(),
+}
+NWM_SORT_BY = ["nwm_feature_id", "value_time"]
+
+# Arrow types of the USGS observation columns
+USGS_ARROW_TYPES = {
+    "value_time": pa.timestamp("us"),
+    "variable_name": _DICTIONARY,
+    "usgs_site_code": _DICTIONARY,
+    "measurement_unit": _DICTIONARY,
+    "value": pa.float32(),
+    "qualifiers": _DICTIONARY,
+    "series": pa.int16(),
+}
+USGS_SORT_BY = ["usgs_site_code", "value_time"]
+
+
+def _cast_column(column: pa.ChunkedArray, arrow_type: pa.DataType) -> pa.ChunkedArray:
+    if pa.types.is_dictionary(arrow_type):
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        column = column.cast(arrow_type.value_type).dictionary_encode()
+    return column.cast(arrow_type)
+
+
+def _check_range(name: str, column: pa.ChunkedArray, arrow_type: pa.DataType):
+    """Raise if the integers of a column do not fit a narrower integer
+    type, e.g. IDs over the int32 range, instead of wrapping them."""
+    if not (pa.types.is_integer(arrow_type) and pa.types.is_integer(column.type)):
+        return
+    min_max = pc.min_max(column)
+    min_value, max_value = min_max["min"].as_py(), min_max["max"].as_py()
+    if min_value is None:
+        return
+    info = np.iinfo(arrow_type.to_pandas_dtype())
+    if min_value < info.min or max_value > info.max:
+        raise ValueError(
+            f"Column {name} has values from {min_value} to {max_value}, "
+            f"out of the range of {arrow_type}"
+        )
+
+
+def _compact_type(arrow_type: pa.DataType) -> pa.DataType:
+    """Compact type of a column without a canonical type."""
+    if pa.types.is_float64(arrow_type):
+        return pa.float32()
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return _DICTIONARY
+    return arrow_type
+
+
+def to_canonical_table(
+    data: Union[pd.DataFrame, pa.Table],
+    arrow_types: Dict[str, pa.DataType],
+    sort_by: List[str] = None,
+) -> pa.Table:
+    """Convert a frame or table to the canonical schema.
+
+    Columns are cast to `arrow_types`, other float64 and string columns
+    are made float32 and dictionary-encoded.  A lead_time column, or
+    reference_time and value_time, become lead_hours if it is one of the
+    canonical columns.  Integers out of the range of their canonical
+    type (e.g. IDs over the int32 range or leads over the int16 range)
+    raise a ValueError.
+
+    Parameters
+    ----------
+    data : Union[pd.DataFrame, pa.Table], required
+        Timeseries to convert.
+    arrow_types : Dict[str, pa.DataType], required
+        Canonical types, e.g. NWM_ARROW_TYPES.
+    sort_by : List[str], optional
+        Columns to sort the rows by, e.g. NWM_SORT_BY.
+    """
+    if isinstance(data, pd.DataFrame):
+        table = pa.Table.from_pandas(data, preserve_index=False)
+    else:
+        table = data
+    # Pandas index saved by DataFrame.to_parquet
+    index_columns = [c for c in table.column_names if c.startswith("__index_level_")]
+    table = table.drop(index_columns).replace_schema_metadata(None)
+
+    if "lead_hours" in arrow_types and "lead_hours" not in table.column_names:
+        if "lead_time" in table.column_names:
+            lead_time = table["lead_time"]
+        elif {"reference_time", "value_time"} <= set(table.column_names):
+            lead_time = pc.subtract(
+                table["value_time"].cast(pa.timestamp("us")),
+                table["reference_time"].cast(pa.timestamp("us"))
+            )
+        else:
+            lead_time = None
+        if lead_time is not None:
+            lead_us = lead_time.cast(pa.duration("us")).cast(pa.int64())
+            lead_hours = pc.divide(lead_us, 3600 * 10**6)
+            table = table.append_column("lead_hours", lead_hours)
+    if "lead_time" in table.column_names:
+        table = table.drop(["lead_time"])
+
+    columns = []
+    fields = []
+    for name in table.column_names:
+        arrow_type = arrow_types.get(name, _compact_type(table[name].type))
+        _check_range(name, table[name], arrow_type)
+        columns.append(_cast_column(table[name], arrow_type))
+        fields.append(pa.field(name, arrow_type))
+    table = pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+    if sort_by:
+        sort_keys = [(c, "ascending") for c in sort_by if c in table.column_names]
+        # Dictionary columns sort by their values
+        sort_columns = {
+            c: table[c].cast(pa.string()) if pa.types.is_dictionary(table[c].type) else table[c]
+            for c, _ in sort_keys
+        }
+        order = pc.sort_indices(pa.table(sort_columns), sort_keys=sort_keys)
+        table = table.take(order)
+    return table
+
+
+def write_canonical_parquet(
+    data: Union[pd.DataFrame, pa.Table],
+    parquet_filepath: str,
+    arrow_types: Dict[str, pa.DataType],
+    sort_by: List[str] = None,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> int:
+    """Write a timeseries in the canonical schema, see `to_canonical_table`.
+
+    The file is written through `utils.atomic_write`.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows written.
+    """
+    table = to_canonical_table(data, arrow_types, sort_by)
+    with utils.atomic_write(parquet_filepath) as tmp_filepath:
+        pq.write_table(
+            table,
+            tmp_filepath,
+            row_group_size=row_group_size,
+            compression=COMPRESSION,
+            compression_level=COMPRESSION_LEVEL,
+        )
+    return table.num_rows
+
+
+def migrate_parquet_dir(
+    directory: str,
+    arrow_types: Dict[str, pa.DataType],
+    sort_by: List[str] = None,
+    partition: bool = False,
+) -> pd.DataFrame:
+    """Rewrite every Parquet file of a directory in the canonical schema.
+
+    Files already in the canonical schema are skipped.  If `partition`,
+    flat files ({directory}/*.parquet) with configuration and
+    reference_time columns are moved to their hive partition (see
+    `utils.partition_dir`) without the configuration column.  Ingest
+    ledger entries of the files are updated, so migrated units are not
+    ingested again.
+
+    Returns
+    -------
+    sizes : pd.DataFrame
+        Path and bytes before and after of every migrated file.
+    """
+    ingest_ledger = ledger.get_ledger()
+    sizes = []
+    filepaths = sorted(glob(os.path.join(directory, "**", "*.parquet"), recursive=True))
+    for filepath in filepaths:
+        schema = pq.read_schema(filepath)
+        flat = os.path.dirname(filepath) == os.path.normpath(directory)
+        move = partition and flat and {"configuration", "reference_time"} <= set(schema.names)
+        canonical = "lead_time" not in schema.names and not any(
+            name.startswith("__index_level_") for name in schema.names
+        ) and all(
+            schema.field(name).type == arrow_types[name]
+            for name in schema.names if name in arrow_types
+        )
+        if canonical and not move:
+            continue
+
+        table = pq.read_table(filepath)
+        new_filepath = filepath
+        if move:
+            configuration = table["configuration"][0].as_py()
+            reference_time = table["reference_time"][0].as_py()
+            new_filepath = os.path.join(
+                utils.partition_dir(directory, configuration, reference_time),
+                os.path.basename(filepath)
+            )
+            table = table.drop(["configuration"])
+
+        bytes_before = os.path.getsize(filepath)
+        write_canonical_parquet(table, new_filepath, arrow_types, sort_by)
+        if new_filepath != filepath:
+            os.remove(filepath)
+        ingest_ledger.update_output(filepath, new_filepath)
+
+        bytes_after = os.path.getsize(new_filepath)
+        print(f"Migrated {new_filepath} {bytes_before} -> {bytes_after} bytes")
+        sizes.append({
+            "path": new_filepath,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+        })
+    return pd.DataFrame(sizes, columns=["path", "bytes_before", "bytes_after"])
+
+
+def main():
+    """Migrate the NWM and USGS timeseries files."""
+    nwm_sizes = migrate_parquet_dir(
+        config.MEDIUM_RANGE_1_PARQUET,
+        NWM_ARROW_TYPES,
+        NWM_SORT_BY,
+        partition=True
+    )
+    usgs_sizes = migrate_parquet_dir(
+        config.USGS_PARQUET,
+        USGS_ARROW_TYPES,
+        USGS_SORT_BY
+    )
+    sizes = pd.concat([nwm_sizes, usgs_sizes])
+    if len(sizes):
+        ratio = sizes["bytes_before"].sum() / sizes["bytes_after"].sum()
+        print(f"Migrated {len(sizes)} files, {ratio:0.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import utils
 import config
+import ledger
 import os
+import timeseries_parquet
 
 from datetime import datetime, timedelta
 
@@ -27,41 +29,70 @@ def fetch_usgs(sites, start_dt: str, end_dt: str):
     return observations_data
 
 
+def usgs_to_parquet(sites, start_dt: datetime, end_dt: datetime, parquet_filepath: str) -> int:
+    """Fetch one period of USGS gage data and save it as parquet.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows written.
+    """
+    observations_data = fetch_usgs(
+        sites=sites,
+        start_dt=start_dt.strftime("%Y-%m-%d"),
+        end_dt=end_dt.strftime("%Y-%m-%d")
+    )
+
+    # Filter out data not on the hour
+    observations_data.set_index("value_time", inplace=True)
+    obs = observations_data[
+        observations_data.index.hour.isin(range(0, 23)) 
+        & (observations_data.index.minute == 0) 
+        & (observations_data.index.second == 0)
+    ]
+    obs.reset_index(level=0, allow_duplicates=True, inplace=True)
+
+    # Save as compact parquet file
+    return timeseries_parquet.write_canonical_parquet(
+        obs,
+        parquet_filepath,
+        timeseries_parquet.USGS_ARROW_TYPES,
+        timeseries_parquet.USGS_SORT_BY
+    )
+
+
 def ingest_usgs():
     start = datetime(2023, 1, 1)
     download_period = timedelta(days=1)
     number_of_periods = 11
 
     sites = utils.get_usgs_gages()
+    site_ids = sorted(sites["gage_id"].astype(str))
 
-    # Fetch USGS gage data in daily batches
+    # Fetch USGS gage data in daily batches, days already in the ingest
+    # ledger are skipped
+    ingest_ledger = ledger.get_ledger()
     for p in range(number_of_periods):
 
         # Setup start and end date for fetch
         start_dt = (start + download_period * p)
         end_dt = (start + download_period * (p + 1))
-        start_dt_str = start_dt.strftime("%Y-%m-%d")
-        end_dt_str = end_dt.strftime("%Y-%m-%d")
-
-        observations_data = fetch_usgs(
-            sites=sites["gage_id"],
-            start_dt=start_dt_str,
-            end_dt=end_dt_str
-        )
-
-        # Filter out data not on the hour
-        observations_data.set_index("value_time", inplace=True)
-        obs = observations_data[
-            observations_data.index.hour.isin(range(0, 23)) 
-            & (observations_data.index.minute == 0) 
-            & (observations_data.index.second == 0)
-        ]
-        obs.reset_index(level=0, allow_duplicates=True, inplace=True)
-
-        # Save as parquet file
-        parquet_filepath = os.path.join(config.USGS_PARQUET, f"{start_dt.strftime('%Y%m%d')}.parquet")
-        utils.make_parent_dir(parquet_filepath)
-        obs.to_parquet(parquet_filepath)
+        unit = start_dt.strftime("%Y%m%d")
+
+        parquet_filepath = os.path.join(config.USGS_PARQUET, f"{unit}.parquet")
+        try:
+            n_rows = ingest_ledger.run(
+                "usgs_iv",
+                unit,
+                lambda: usgs_to_parquet(site_ids, start_dt, end_dt, parquet_filepath),
+                parquet_filepath,
+                ledger.fingerprint(site_ids, start_dt, end_dt),
+            )
+            if n_rows is None:
+                print(f"Skipping {unit}, already ingested")
+        except Exception as e:
+            # Recorded as failed, retried by the next run
+            print(f"Failed: {unit} {e!r}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import os
+import blob_names
+import config
+import const
+
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
+
+# Projection of the forcing grid of each domain
+DOMAIN_WKT = {
+    "conus": const.CONUS_NWM_WKT,
+    "hawaii": const.HI_NWM_WKT,
+    "puertorico": const.PR_NWM_WKT,
+}
+
+# Polygon layers weights can be built for, by domain and layer name
+#   parquet    GeoParquet file of the polygons
+#   id_column  column used as catchment ID
+# HUC10 polygons only cover CONUS, there are no Hawaii or Puerto Rico
+# layers yet.
+POLYGON_LAYERS = {
+    ("conus", "huc10"): dict(parquet=config.HUC10_PARQUET_FILEPATH, id_column="huc10"),
+}
+
+# Weights that exist outside the registry, used for every NWM version
+# (the CONUS forcing grid has not changed between versions).  Layers
+# that can not be built (e.g. imported NWM spatial weights) must be here.
+EXISTING_WEIGHTS = {
+    ("conus", "forcing", "huc10"): config.HUC10_MEDIUM_RANGE_WEIGHTS_FILEPATH,
+    ("conus", "forcing", "nwm_catchments"): config.NWM_CATCHMENT_WEIGHTS_FILEPATH,
+}
+
+# Reference time of the template blobs weights are built from, per version
+TEMPLATE_REFERENCE_TIMES = {
+    2.0: datetime(2021, 1, 1),
+    2.1: datetime(2021, 10, 1),
+    2.2: datetime(2022, 10, 1),
+}
+
+
+class WeightsKey(NamedTuple):
+    """Identifies a weights file."""
+    domain: str
+    grid: str
+    layer: str
+    version: float
+
+
+def weights_filepath(key: WeightsKey) -> str:
+    """Path of the weights file of a key, whether it exists or not."""
+    existing = EXISTING_WEIGHTS.get((key.domain, key.grid, key.layer))
+    if existing is not None:
+        return existing
+    return os.path.join(
+        config.WEIGHTS_DIR,
+        f"{key.layer}_{key.domain}_{key.grid}_v{key.version}.bin"
+    )
+
+
+def template_blob_name(key: WeightsKey) -> str:
+    """A blob on the grid of a key, the first analysis timestep."""
+    if key.grid != "forcing":
+        raise ValueError(f"No template grid for {key}")
+    reference_time = TEMPLATE_REFERENCE_TIMES[key.version]
+    return blob_names.generate_blob_names(
+        "analysis_assim",
+        reference_time,
+        variable=key.grid,
+        domain=key.domain,
+        version=key.version,
+    )[0]
+
+
+def build_weights(key: WeightsKey, filepath: str):
+    """Generate the weights file of a key from its polygon layer and a
+    template blob of its grid.
+
+    Raises a ValueError if the domain has no polygons of the layer, or
+    if none overlaps the grid (see `generate_weights.generate_weights_file`).
+    """
+    # Imported here, generate_weights imports grid_to_parquet which uses
+    # the registry
+    from generate_weights import generate_weights_file
+    from grid_to_parquet import get_dataset
+    from utils import parquet_to_gdf
+
+    layer = POLYGON_LAYERS.get((key.domain, key.layer))
+    if layer is None:
+        raise ValueError(
+            f"No weights for {key}, there are no {key.layer} polygons "
+            f"for the {key.domain} domain"
+        )
+
+    gdf = parquet_to_gdf(layer["parquet"])
+    ds = get_dataset(template_blob_name(key), use_cache=True)
+
+    generate_weights_file(
+        gdf,
+        ds["RAINRATE"],
+        filepath,
+        crosswalk_dict_key=layer["id_column"],
+        crs=DOMAIN_WKT[key.domain],
+    )
+
+
+@lru_cache(maxsize=None)
+def get_weights(key: WeightsKey, build: bool = True) -> str:
+    """Path of the weights file of a key, building it if it does not
+    exist.
+
+    Files are built once and shared by every job using the weights
+    directory, the weights are memory-mapped when read (see
+    `utils.read_weights_file` and `zonal_stats.load_weights_matrix`).
+    """
+    filepath = weights_filepath(key)
+    if not os.path.exists(filepath):
+        if not build:
+            raise FileNotFoundError(f"No weights file for {key}")
+        build_weights(key, filepath)
+    return filepath
+
+
+def resolve_weights(
+    blob_name: str,
+    layer: str = "huc10",
+    build: bool = True,
+) -> str:
+    """Path of the weights file for a blob, from the domain, grid and NWM
+    version in its name.
+
+    e.g. nwm.20230101/forcing_short_range_hawaii/nwm.t00z.short_range.forcing.f00100.hawaii.nc
+    resolves to the Hawaii forcing grid weights of NWM v2.2.
+    """
+    parts = blob_names.parse_blob_name(blob_name)
+    if parts is None:
+        raise ValueError(f"Can not resolve weights for {blob_name}")
+    grid = "forcing" if parts["variable"] == "forcing" else "channel_rt"
+    key = WeightsKey(
+        domain=parts["domain"],
+        grid=grid,
+        layer=layer,
+        version=blob_names.nwm_version(parts["reference_time"]),
+    )
+    return get_weights(key, build)
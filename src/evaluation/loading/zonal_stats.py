@@ -0,0 +1,540 @@
+import utils
+
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from typing import List, Tuple, Union
+
+from scipy import sparse
+
+
+def weights_to_csr(
+    weights: utils.SparseWeights,
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Convert weights to a sparse (catchment x grid cell) matrix.
+
+    Parameters
+    ----------
+    weights : utils.SparseWeights, required
+        Weights with rows sorted by catchment, as read from a weights
+        file.
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        One row per catchment, one column per flattened grid cell.
+    catchment_ids : np.ndarray
+        Catchment ID for each matrix row.
+    """
+    n_catchments = len(weights.catchment_ids)
+    indptr = np.zeros(n_catchments + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(weights.rows, minlength=n_catchments),
+        out=indptr[1:]
+    )
+
+    matrix = sparse.csr_matrix(
+        (weights.weights, weights.cols, indptr),
+        shape=(n_catchments, weights.grid_shape[0] * weights.grid_shape[1])
+    )
+
+    return matrix, np.asarray(weights.catchment_ids)
+
+
+@lru_cache(maxsize=4)
+def load_weights_matrix(
+    weights_filepath: str,
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Load a weights file as a sparse matrix.
+
+    Cached per process so the weights are loaded once, not once per file.
+    """
+    weights = utils.read_weights_file(weights_filepath)
+    return weights_to_csr(weights)
+
+
+def subset_weights(
+    matrix: sparse.csr_matrix,
+    catchment_ids: np.ndarray,
+    grid_shape: Tuple[int, int],
+    catchments: Union[str, List[str]],
+) -> Tuple[sparse.csr_matrix, np.ndarray, Tuple[slice, slice]]:
+    """Subset weights to some catchments and the grid window they cover.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix, required
+        (catchment x grid cell) weights matrix.
+    catchment_ids : np.ndarray, required
+        Catchment ID for each matrix row.
+    grid_shape : Tuple[int, int], required
+        (y, x) shape of the grid.
+    catchments : Union[str, List[str]], required
+        List of catchment IDs, or an ID prefix such as a HUC2 code "03".
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Weights for the catchments, columns are the flattened cells of
+        the window.
+    catchment_ids : np.ndarray
+        Catchment ID for each matrix row.
+    window : Tuple[slice, slice]
+        Minimal (y, x) window of the grid covering the catchments.
+    """
+    catchment_ids = np.asarray(catchment_ids).astype(str)
+    if isinstance(catchments, str):
+        keep = np.char.startswith(catchment_ids, catchments)
+    else:
+        keep = np.isin(catchment_ids, np.asarray(catchments).astype(str))
+
+    subset = matrix[np.flatnonzero(keep)]
+    if subset.nnz == 0:
+        raise ValueError(f"No weights found for catchments {catchments}")
+
+    y, x = np.unravel_index(subset.indices, grid_shape)
+    y_start, x_start = y.min(), x.min()
+    window_shape = (y.max() - y_start + 1, x.max() - x_start + 1)
+    window = (
+        slice(int(y_start), int(y_start + window_shape[0])),
+        slice(int(x_start), int(x_start + window_shape[1])),
+    )
+
+    indices = np.ravel_multi_index(
+        (y - y_start, x - x_start),
+        window_shape
+    ).astype(np.int32)
+    subset = sparse.csr_matrix(
+        (subset.data, indices, subset.indptr),
+        shape=(subset.shape[0], window_shape[0] * window_shape[1])
+    )
+
+    return subset, catchment_ids[keep], window
+
+
+@lru_cache(maxsize=16)
+def _load_weights_subset(
+    weights_filepath: str,
+    catchments: Union[str, Tuple[str, ...]],
+) -> Tuple[sparse.csr_matrix, np.ndarray, Tuple[slice, slice]]:
+    matrix, catchment_ids = load_weights_matrix(weights_filepath)
+    if catchments is None:
+        return matrix, catchment_ids, None
+
+    grid_shape = utils.read_weights_file(weights_filepath).grid_shape
+    return subset_weights(matrix, catchment_ids, grid_shape, catchments)
+
+
+def load_weights_subset(
+    weights_filepath: str,
+    catchments: Union[str, List[str]] = None,
+) -> Tuple[sparse.csr_matrix, np.ndarray, Tuple[slice, slice]]:
+    """Load a weights file as a sparse matrix for some catchments.
+
+    Cached per process.  See `subset_weights`, the window is None (the
+    full grid) if `catchments` is None.
+    """
+    if catchments is not None and not isinstance(catchments, str):
+        catchments = tuple(catchments)
+    return _load_weights_subset(weights_filepath, catchments)
+
+
+def check_grid_shape(matrix: sparse.csr_matrix, grid_shape: Tuple[int, int]):
+    """Raise if the weights were not generated for this grid."""
+    if matrix.shape[1] != grid_shape[0] * grid_shape[1]:
+        raise ValueError(
+            f"Weights are for {matrix.shape[1]} grid cells, "
+            f"grid has shape {grid_shape}"
+        )
+
+
+def compress_columns(
+    matrix: sparse.csr_matrix,
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Drop the grid cells that are not in any catchment.
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Weights matrix with one column per used grid cell.
+    cells : np.ndarray
+        Flattened grid cell index of each column.
+    """
+    cells = np.unique(matrix.indices)
+    indices = np.searchsorted(cells, matrix.indices).astype(np.int32)
+    compressed = sparse.csr_matrix(
+        (matrix.data, indices, matrix.indptr),
+        shape=(matrix.shape[0], len(cells))
+    )
+    return compressed, cells
+
+
+def calc_zonal_mean(
+    matrix: sparse.csr_matrix,
+    values: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """NaN-aware weighted mean of grid values for every catchment.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix, required
+        (catchment x grid cell) weights matrix.
+    values : np.ndarray, required
+        Grid values, either one timestep flattened to one value per
+        matrix column (1-D) or a stack of timesteps with time as the
+        first axis (2-D or 3-D).  Missing values must be NaN.
+
+    Returns
+    -------
+    mean : np.ndarray
+        Weighted mean per catchment (per timestep if `values` is a
+        stack), NaN where no valid cells.
+    count : np.ndarray
+        Sum of weights of the valid cells per catchment.  For binary
+        weights this is the number of valid cells.
+    """
+    values = np.asarray(values)
+    if values.ndim > 1:
+        values = values.reshape(values.shape[0], -1)
+    else:
+        values = values.ravel()
+    valid = ~np.isnan(values)
+
+    # For a stack, (catchment x cell) @ (cell x time) -> (catchment x time)
+    total = matrix @ np.where(valid, values, 0.0).T
+    count = matrix @ valid.T.astype(np.float32)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    mean[count == 0] = np.nan
+
+    return mean.T, count.T
+
+
+# Statistics of calc_zonal_stats besides percentiles ("p90", ...)
+ZONAL_STATS = ("mean", "min", "max", "std", "frac_above")
+
+
+def _is_percentile(stat: str) -> bool:
+    """If a statistic name is a percentile, e.g. "p90"."""
+    return stat[:1] == "p" and stat[1:].replace(".", "", 1).isdigit()
+
+
+def _segment_starts(indptr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start of each CSR row segment with cells, and which rows have cells."""
+    has_cells = np.diff(indptr) > 0
+    return indptr[:-1][has_cells], has_cells
+
+
+def _segment_reduce(
+    ufunc: np.ufunc,
+    values: np.ndarray,
+    indptr: np.ndarray,
+    fill: float,
+) -> np.ndarray:
+    """Reduce each CSR row segment of gathered (time, nnz) values with
+    ufunc, `fill` for the rows without cells."""
+    result = np.full((values.shape[0], len(indptr) - 1), fill, dtype=np.float64)
+    starts, has_cells = _segment_starts(indptr)
+    if len(starts):
+        # reduceat over the rows with cells, segments run to the next start
+        result[:, has_cells] = ufunc.reduceat(values, starts, axis=1)
+    return result
+
+
+def _segment_percentiles(
+    qs: List[float],
+    values: np.ndarray,
+    weights: np.ndarray,
+    indptr: np.ndarray,
+) -> List[np.ndarray]:
+    """Weighted percentiles (inverted CDF) of each CSR row segment of
+    gathered (time, nnz) values.
+
+    The values of every (time, row) segment are sorted at once, missing
+    values have 0 weight, and the cumulative weight is searched for q
+    percent of each segment's total.
+    """
+    n_times, nnz = values.shape
+    n_rows = len(indptr) - 1
+    if nnz == 0:
+        return [np.full((n_times, n_rows), np.nan) for _ in qs]
+
+    # Segment of every gathered value, (time, row) flattened
+    rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+    segments = (np.arange(n_times)[:, None] * n_rows + rows).ravel()
+    if values.dtype == np.float32:
+        # One sort of a (segment, value) uint64 key, an order of magnitude
+        # faster than lexsort.  Float bits are made to sort as unsigned
+        # integers: negative values are inverted, the sign is set on others
+        bits = values.ravel().view(np.uint32)
+        ordered_bits = np.where(bits >> 31, ~bits, bits | np.uint32(0x80000000))
+        order = np.argsort((segments.astype(np.uint64) << np.uint64(32)) | ordered_bits)
+    else:
+        order = np.lexsort((values.ravel(), segments))
+    sorted_values = values.ravel()[order]
+    # float64, the running total over every segment exceeds float32
+    # precision for large matrices
+    cum_weights = np.concatenate(([0.0], np.cumsum(weights.ravel()[order], dtype=np.float64)))
+
+    offsets = np.arange(n_times)[:, None] * nnz
+    segment_start = (offsets + indptr[:-1]).ravel()
+    segment_end = (offsets + indptr[1:]).ravel()
+    total = cum_weights[segment_end] - cum_weights[segment_start]
+
+    results = []
+    for q in qs:
+        target = cum_weights[segment_start] + total * q / 100
+        index = np.searchsorted(cum_weights[1:], target, side="left")
+        # The first value of the segment with weight, not a preceding 0 weight one
+        index = np.clip(np.maximum(index, segment_start), 0, len(sorted_values) - 1)
+        results.append(sorted_values[index].astype(np.float64).reshape(n_times, n_rows))
+    return results
+
+
+def calc_zonal_stats(
+    matrix: sparse.csr_matrix,
+    values: np.ndarray,
+    stats: List[str] = ("mean",),
+    threshold: float = None,
+) -> dict:
+    """NaN-aware zonal statistics for every catchment.
+
+    Weighted sums (mean, fraction above threshold) are sparse products
+    like `calc_zonal_mean`.  std and the order statistics (min, max,
+    percentiles) are segment reductions over the values gathered in CSR
+    order, i.e. grouped by catchment, for every timestep at once, so
+    there is no per-catchment or per-timestep loop.  std is centred on
+    the mean in float64 (a second reduction over the gathered values,
+    not over the grid), E[x^2] - E[x]^2 cancels catastrophically for
+    values far from 0, e.g. temperatures in K.
+
+    The gathered values are (time, nnz) float64, long stacks must be
+    chunked in time (see `max_timesteps` of
+    `grid_to_parquet.calculate_map_batch`).
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix, required
+        (catchment x grid cell) weights matrix.
+    values : np.ndarray, required
+        Grid values, one timestep (1-D) or a stack with time as the
+        first axis, see `calc_zonal_mean`.  Missing values must be NaN.
+    stats : List[str], default ("mean",)
+        Any of ZONAL_STATS and weighted percentiles as "p<q>", e.g.
+        "p90".  std is the weighted population standard deviation and
+        frac_above the weighted fraction of valid cells > threshold.
+    threshold : float, optional
+        Threshold of frac_above.
+
+    Returns
+    -------
+    zonal_stats : dict
+        Array per statistic, (catchment,) or (time, catchment), plus the
+        "count" (sum of weights of the valid cells).  NaN where no valid
+        cells.
+    """
+    for stat in stats:
+        if stat not in ZONAL_STATS and not _is_percentile(stat):
+            raise ValueError(f"Unknown zonal statistic {stat}")
+    if "frac_above" in stats and threshold is None:
+        raise ValueError("frac_above requires a threshold")
+
+    values = np.asarray(values)
+    single = values.ndim == 1
+    values = values.reshape(1, -1) if single else values.reshape(values.shape[0], -1)
+    valid = ~np.isnan(values)
+
+    mean, count = calc_zonal_mean(matrix, values)
+    no_data = count == 0
+    results = {"count": count}
+    if "mean" in stats:
+        results["mean"] = mean
+    if "frac_above" in stats:
+        above = (matrix @ (valid & (np.where(valid, values, 0.0) > threshold)).T.astype(np.float32)).T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            results["frac_above"] = above / count
+
+    indptr = matrix.indptr
+    percentiles = [s for s in stats if _is_percentile(s)]
+    if "std" in stats or "min" in stats or "max" in stats or percentiles:
+        # Values of every (catchment, cell) pair, grouped by catchment
+        gathered = values[:, matrix.indices]
+        gathered_valid = valid[:, matrix.indices]
+        weights = np.where(gathered_valid, matrix.data.astype(np.float64), 0.0)
+        # Cells with 0 weight are not part of the catchment
+        in_zone = weights > 0
+
+    if "std" in stats:
+        gathered64 = np.where(gathered_valid, gathered, 0.0).astype(np.float64)
+        total = _segment_reduce(np.add, weights, indptr, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            row_mean = _segment_reduce(np.add, weights * gathered64, indptr, 0.0) / total
+            rows = np.repeat(np.arange(matrix.shape[0]), np.diff(indptr))
+            deviation = gathered64 - row_mean[:, rows]
+            total_sq = _segment_reduce(np.add, weights * deviation ** 2, indptr, 0.0)
+            results["std"] = np.sqrt(total_sq / total)
+    if "min" in stats:
+        results["min"] = _segment_reduce(
+            np.minimum, np.where(in_zone, gathered, np.inf), indptr, np.nan
+        )
+    if "max" in stats:
+        results["max"] = _segment_reduce(
+            np.maximum, np.where(in_zone, gathered, -np.inf), indptr, np.nan
+        )
+    if percentiles:
+        percentile_values = _segment_percentiles(
+            [float(stat[1:]) for stat in percentiles],
+            np.where(in_zone, gathered, np.inf).astype(gathered.dtype, copy=False),
+            weights,
+            indptr,
+        )
+        results.update(zip(percentiles, percentile_values))
+
+    for stat in results:
+        if stat != "count":
+            results[stat][no_data] = np.nan
+
+    if single:
+        results = {k: v[0] for k, v in results.items()}
+    return results
+
+
+def zonal_mean_to_df(
+    catchment_ids: np.ndarray,
+    mean: np.ndarray,
+    count: np.ndarray = None,
+) -> pd.DataFrame:
+    """Format zonal means (and valid counts) as a DataFrame."""
+    df = pd.DataFrame({
+        "catchment_id": catchment_ids,
+        "value": mean,
+    })
+    if count is not None:
+        df["valid_count"] = count.astype(np.float32)
+    return df
+
+
+# HUC levels (number of digits) the HUC10 MAP is rolled up to
+HUC_LEVELS = (8, 6, 4, 2)
+
+
+def rollup_zonal_mean(
+    df: pd.DataFrame,
+    digits: int,
+    id_column: str = "catchment_id",
+) -> pd.DataFrame:
+    """Aggregate zonal means to the catchments of a coarser level.
+
+    Catchment IDs must be prefix-hierarchical like HUC codes, e.g. the
+    HUC8 of a HUC10 is its first 8 digits.  The mean of a parent is the
+    sum of the child totals (value x valid_count) over the sum of the
+    child valid counts, the same mean as calculated from the grid with
+    the union of the child weights.  No grid is read.
+
+    min, max, std and frac_above columns (see `calc_zonal_stats`) are
+    rolled up exactly as well, percentile columns can not be and are
+    dropped.
+
+    Parameters
+    ----------
+    df : pd.DataFrame, required
+        Zonal means with `id_column`, "value" and "valid_count" columns,
+        any other column (value_time, variable_name, ...) is kept as a
+        group key.
+    digits : int, required
+        Number of leading ID digits of the coarser level, e.g. 8 for HUC8.
+    id_column : str, default "catchment_id"
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Same columns, one row per parent catchment and group.
+    """
+    if "valid_count" not in df.columns:
+        raise ValueError("Roll-up requires the valid_count column")
+
+    # Prefix the (few) categories instead of every row
+    ids = df[id_column].astype("category")
+    parent_codes, parent_ids = pd.factorize(
+        ids.cat.categories.astype(str).str[:digits]
+    )
+    parents = pd.Categorical.from_codes(
+        parent_codes[ids.cat.codes],
+        categories=parent_ids
+    )
+
+    count = df["valid_count"].to_numpy(dtype=np.float64)
+    has_data = count > 0
+    mean = df["value"].to_numpy(dtype=np.float64)
+
+    # Sums of the children, the statistics are recovered from them
+    sums = {
+        "total": np.where(has_data, mean * count, 0.0),
+        "valid_count": count,
+    }
+    if "std" in df.columns:
+        square = df["std"].to_numpy(dtype=np.float64) ** 2 + mean ** 2
+        sums["total_sq"] = np.where(has_data, square * count, 0.0)
+    if "frac_above" in df.columns:
+        frac = df["frac_above"].to_numpy(dtype=np.float64)
+        sums["total_above"] = np.where(has_data, frac * count, 0.0)
+    aggregations = {name: "sum" for name in sums}
+    for stat in ("min", "max"):
+        if stat in df.columns:
+            sums[stat] = df[stat].to_numpy()
+            aggregations[stat] = stat
+
+    stat_columns = [c for c in df.columns if c in ZONAL_STATS or _is_percentile(c)]
+    keys = [
+        c for c in df.columns
+        if c not in (id_column, "value", "valid_count", *stat_columns)
+    ]
+    grouped = pd.DataFrame({
+        id_column: parents,
+        **sums,
+        **{k: df[k].values for k in keys},
+    }).groupby(
+        [id_column, *keys],
+        observed=True,
+        sort=False
+    ).agg(aggregations)
+
+    count = grouped["valid_count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        grouped["value"] = grouped["total"] / count
+        if "total_sq" in grouped:
+            variance = grouped["total_sq"] / count - grouped["value"] ** 2
+            grouped["std"] = np.sqrt(np.maximum(variance, 0))
+        if "total_above" in grouped:
+            grouped["frac_above"] = grouped["total_above"] / count
+    for column in ("value", "std", "frac_above", "min", "max"):
+        if column in grouped:
+            grouped.loc[count == 0, column] = np.nan
+    grouped["valid_count"] = count.astype(np.float32)
+
+    columns = [c for c in df.columns if not _is_percentile(c)]
+    return grouped.reset_index()[columns]
+
+
+def rollup_levels(
+    df: pd.DataFrame,
+    levels: Tuple[int, ...] = HUC_LEVELS,
+    id_column: str = "catchment_id",
+) -> dict:
+    """Roll zonal means up to every level, finest first.
+
+    Each level is aggregated from the previous one, see
+    `rollup_zonal_mean`.
+
+    Returns
+    -------
+    dfs : dict
+        Rolled up DataFrame by number of digits.
+    """
+    dfs = {}
+    for digits in sorted(levels, reverse=True):
+        df = rollup_zonal_mean(df, digits, id_column)
+        dfs[digits] = df
+    return dfs
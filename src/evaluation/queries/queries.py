@@ -1,5 +1,10 @@
+import os
+from datetime import date
+from glob import glob
 from typing import List
 import config
+import const
+import pandas as pd
 
 
 def format_filters(filters: List[dict]) -> List[str]:
@@ -15,7 +20,79 @@ def format_filters(filters: List[dict]) -> List[str]:
         else:
             filter_strs.append(f"""{f["column"]} {f["operator"]} {f["value"]}""")
     return filter_strs
-    
+
+
+def _partition_date(value) -> date:
+    return pd.Timestamp(str(value).strip("'")).date()
+
+
+def _keep_partition(partition: dict, filters: List[dict]) -> bool:
+    """If a partition can hold rows matching the filters.
+
+    Only filters on the partition columns and reference_time (which
+    falls in its reference_date) are checked, partitions are kept for
+    any other column or operator.
+    """
+    for f in filters:
+        column = f["column"]
+        operator = f["operator"].strip().lower()
+        if column in ("reference_time", "reference_date"):
+            partition_value = date.fromisoformat(partition["reference_date"])
+            value = _partition_date(f["value"])
+        elif column == "configuration":
+            partition_value = partition["configuration"]
+            value = str(f["value"]).strip("'")
+        else:
+            continue
+
+        if operator == "=" and partition_value != value:
+            return False
+        if operator in ("!=", "<>") and column == "configuration" and partition_value == value:
+            return False
+        # A reference time bound can fall inside a reference date
+        if operator in (">", ">=") and partition_value < value:
+            return False
+        if operator in ("<", "<=") and partition_value > value:
+            return False
+    return True
+
+
+def parquet_source(directory: str, filters: List[dict]) -> str:
+    """FROM clause source of a Parquet directory, pruned by the filters.
+
+    A hive partitioned directory (see const.PARTITION_COLUMNS) is read
+    only from the partitions that can match the filters, e.g. one
+    reference_time reads a single reference_date partition.  A flat
+    directory is read as '{directory}/*.parquet'.
+
+    A directory with both flat files and partitions raises a ValueError,
+    the flat files would be left out of the partitioned read.  Migrate
+    them to their partitions first (see
+    timeseries_parquet.migrate_parquet_dir).
+    """
+    pattern = os.path.join(directory, *[f"{c}=*" for c in const.PARTITION_COLUMNS])
+    partition_dirs = sorted(glob(pattern))
+    if not partition_dirs:
+        return f"'{directory}/*.parquet'"
+    if glob(os.path.join(directory, "*.parquet")):
+        raise ValueError(
+            f"{directory} has both flat Parquet files and partitions, "
+            "migrate the flat files with timeseries_parquet.migrate_parquet_dir"
+        )
+
+    kept_dirs = []
+    for partition_dir in partition_dirs:
+        parts = os.path.relpath(partition_dir, directory).split(os.sep)
+        partition = dict(part.split("=", 1) for part in parts)
+        if _keep_partition(partition, filters):
+            kept_dirs.append(partition_dir)
+    if not kept_dirs:
+        # Nothing matches, one partition keeps the columns of the result
+        kept_dirs = partition_dirs[:1]
+
+    paths = ", ".join(f"'{d}/*.parquet'" for d in kept_dirs)
+    return f"read_parquet([{paths}], hive_partitioning=true)"
+
 
 def calculate_nwm_feature_metrics(
     forecast_dir: str,
@@ -61,7 +138,7 @@ def calculate_nwm_feature_metrics(
                 ud.value as observed_value,
                 ud.usgs_site_code,
                 nd.value_time - nd.reference_time as lead_time
-            FROM '{forecast_dir}/*.parquet' nd 
+            FROM {parquet_source(forecast_dir, filters)} nd 
             JOIN '{config.ROUTE_LINK_PARQUET}' nux 
                 on nux.nwm_feature_id = nd.nwm_feature_id 
             JOIN '{observed_dir}/*.parquet' ud 
@@ -116,7 +193,7 @@ def get_joined_nwm_feature_timeseries(
                 ud.value as observed_value,
                 ud.usgs_site_code,
                 nd.value_time - nd.reference_time as lead_time
-            FROM '{forecast_dir}/*.parquet' nd 
+            FROM {parquet_source(forecast_dir, filters)} nd 
             JOIN '{config.ROUTE_LINK_PARQUET}' nux 
                 on nux.nwm_feature_id = nd.nwm_feature_id 
             JOIN '{observed_dir}/*.parquet' ud 
@@ -179,7 +256,7 @@ def calculate_catchment_metrics(
                 nd.variable_name,
                 ud.value as observed_value,
                 nd.value_time - nd.reference_time as lead_time
-            FROM '{forecast_dir}/*.parquet' nd 
+            FROM {parquet_source(forecast_dir, filters)} nd 
             JOIN '{observed_dir}/*.parquet' ud 
                 on ud.catchment_id = nd.catchment_id
                 and nd.value_time = ud.value_time 
@@ -251,7 +328,7 @@ def get_joined_catchment_timeseries(
                 nd.variable_name,
                 ud.value as observed_value,
                 nd.value_time - nd.reference_time as lead_time
-            FROM '{forecast_dir}/*.parquet' nd 
+            FROM {parquet_source(forecast_dir, filters)} nd 
             JOIN '{observed_dir}/*.parquet' ud 
                 on ud.catchment_id = nd.catchment_id
                 and nd.value_time = ud.value_time 
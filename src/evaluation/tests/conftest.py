@@ -0,0 +1,13 @@
+import os
+import sys
+
+# Modules of the package import each other by name, e.g. `import config`
+# or `import zonal_stats` from loading and queries
+EVALUATION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVALUATION_DIR, "loading"))
+sys.path.insert(0, os.path.join(EVALUATION_DIR, "queries"))
+sys.path.insert(0, EVALUATION_DIR)
+
+# The gRPC bucket type lookup of gcsfs does not work against the fake-GCS
+# server of tests/fake_gcs.py, use the plain JSON API filesystem
+os.environ.setdefault("GCSFS_EXPERIMENTAL_ZB_HNS_SUPPORT", "false")
@@ -0,0 +1,151 @@
+"""Local fake-GCS HTTP server, a stand-in for the JSON API used through
+STORAGE_EMULATOR_HOST.
+
+Serves the requests of google-cloud-storage and gcsfs needed by gcs.py:
+bucket and object metadata, object listing and (ranged) media
+downloads.  Errors can be injected per object, and the downloads, their
+concurrency and the client connections they use are counted.
+"""
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class FakeGCSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, blobs=None, delay=0.0):
+        super().__init__(("127.0.0.1", 0), FakeGCSHandler)
+        # Objects by (bucket, name)
+        self.blobs = dict(blobs or {})
+        self.delay = delay
+        # HTTP status codes returned before the object, by name
+        self.errors = {}
+        self.downloads = {}
+        self.connections = set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so connection reuse by the client is visible
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode())
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {"error": {"code": status, "message": message}})
+
+    def metadata(self, bucket, name):
+        data = self.server.blobs[(bucket, name)]
+        return {
+            "kind": "storage#object",
+            "bucket": bucket,
+            "name": name,
+            "size": str(len(data)),
+            "generation": "1",
+            "contentType": "application/octet-stream",
+            "updated": "2023-01-01T00:00:00.000Z",
+        }
+
+    def do_GET(self):
+        server = self.server
+        if "alt=media" not in self.path:
+            return self.route()
+
+        # Downloads in progress are counted until the response is written,
+        # not after, so the next request of a client never overlaps one
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+        finally:
+            with server.lock:
+                server.active -= 1
+        self.route()
+
+    def route(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        media = query.get("alt") == ["media"]
+        if parts[0] == "download":
+            parts = parts[1:]
+            media = True
+        # storage/v1/b/{bucket}[/o[/{name}]]
+        if parts[:3] != ["storage", "v1", "b"] or len(parts) < 4 or parts[4:5] not in ([], ["o"]):
+            return self.send_error_json(400, f"Unsupported request {self.path}")
+        bucket = parts[3]
+
+        if len(parts) == 4:
+            # Bucket metadata, looked up by the storage client
+            return self.send_json(200, {"kind": "storage#bucket", "name": bucket, "location": "US"})
+
+        if len(parts) == 5:
+            prefix = query.get("prefix", [""])[0]
+            items = [
+                self.metadata(b, name)
+                for (b, name) in sorted(self.server.blobs)
+                if b == bucket and name.startswith(prefix)
+            ]
+            return self.send_json(200, {"kind": "storage#objects", "items": items})
+
+        name = unquote("/".join(parts[5:]))
+        with self.server.lock:
+            errors = self.server.errors.get(name)
+            status = errors.pop(0) if errors else None
+            if media and status is None:
+                self.server.downloads[name] = self.server.downloads.get(name, 0) + 1
+        if status is not None:
+            return self.send_error_json(status, f"Injected {status}")
+        if (bucket, name) not in self.server.blobs:
+            return self.send_error_json(404, f"No such object: {bucket}/{name}")
+        if not media:
+            return self.send_json(200, self.metadata(bucket, name))
+
+        data = self.server.blobs[(bucket, name)]
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            start, _, end = byte_range.split("=")[1].partition("-")
+            start = int(start)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            return self.send_body(
+                206,
+                data[start:end + 1],
+                "application/octet-stream",
+                {"Content-Range": f"bytes {start}-{end}/{len(data)}"},
+            )
+        return self.send_body(200, data, "application/octet-stream")
@@ -0,0 +1,119 @@
+"""Tests of the running precipitation accumulations."""
+import accumulate
+import grid_to_parquet
+import numpy as np
+import pandas as pd
+import pytest
+
+from datetime import datetime, timedelta
+
+REFERENCE_TIMES = [datetime(2023, 1, 1, 0), datetime(2023, 1, 1, 6)]
+N_LEADS = 100
+
+
+def rate(catchment: int, lead: int, reference_index: int) -> float:
+    """Rate in mm s^-1 of a catchment and lead, missing for some hours."""
+    if catchment == 1 and lead % 10 == 0:
+        return np.nan
+    return (catchment + 1) * lead * 1e-7 + reference_index * 1e-6
+
+
+def map_frames(unit="mm s^-1"):
+    """Hourly long format MAP frames, as streamed by map_blobs_to_parquet,
+    with a temperature variable that is not accumulated."""
+    frames = []
+    for reference_index, reference_time in enumerate(REFERENCE_TIMES):
+        for lead in range(1, N_LEADS + 1):
+            rows = [
+                {
+                    "catchment_id": f"c{catchment}",
+                    "value": rate(catchment, lead, reference_index),
+                    "valid_count": 4.0,
+                    "reference_time": reference_time,
+                    "value_time": reference_time + timedelta(hours=lead),
+                    "configuration": "forcing_medium_range",
+                    "measurement_unit": unit,
+                    "variable_name": "precipitation_flux",
+                }
+                for catchment in range(3)
+            ]
+            rows.append(dict(rows[0], value=280.0, measurement_unit="K", variable_name="air_temperature"))
+            df = pd.DataFrame(rows)
+            # All missing, still gets a row
+            df.loc[len(df)] = dict(rows[0], catchment_id="c3", value=np.nan)
+            for column in ["catchment_id", "configuration", "measurement_unit", "variable_name"]:
+                df[column] = df[column].astype("category")
+            frames.append(df)
+    return frames
+
+
+def expected_totals():
+    rows = []
+    for reference_index, reference_time in enumerate(REFERENCE_TIMES):
+        for window, limit in [(24, 24), (72, 72), (N_LEADS, N_LEADS)]:
+            for catchment in range(4):
+                rates = np.array([
+                    np.nan if catchment == 3 else rate(catchment, lead, reference_index)
+                    for lead in range(1, limit + 1)
+                ])
+                rows.append({
+                    "catchment_id": f"c{catchment}",
+                    "reference_time": reference_time,
+                    "window_hours": window,
+                    "value": np.nansum(rates) * 3600,
+                    "valid_hours": np.sum(~np.isnan(rates)),
+                })
+    return pd.DataFrame(rows)
+
+
+def check_totals(df):
+    expected = expected_totals()
+    df = df.astype({"catchment_id": str}).sort_values(
+        ["reference_time", "window_hours", "catchment_id"]
+    ).reset_index(drop=True)
+    assert len(df) == len(expected)
+    for column in ["catchment_id", "reference_time", "window_hours", "valid_hours"]:
+        assert df[column].tolist() == expected[column].tolist()
+    np.testing.assert_allclose(df["value"], expected["value"], rtol=1e-6)
+    assert set(df["measurement_unit"]) == {"mm"}
+
+
+def test_window_sums_from_frames():
+    accumulator = accumulate.PrecipAccumulator()
+    for df in map_frames():
+        accumulator.update(df)
+    check_totals(accumulator.to_df())
+
+
+def test_window_sums_from_record_batches():
+    accumulator = accumulate.PrecipAccumulator()
+    # Batches in any order, as they complete in the process pool
+    frames = map_frames()
+    for i in np.random.default_rng(0).permutation(len(frames)):
+        accumulator.update_record_batch(grid_to_parquet.map_df_to_record_batch(frames[i]))
+    batch = accumulator.to_record_batch()
+    assert batch.schema.names == list(accumulate.ACCUMULATION_ARROW_TYPES)
+    check_totals(batch.to_pandas())
+
+
+@pytest.mark.parametrize("rate_unit, unit", [
+    ("mm s^-1", "mm"),
+    ("kg m-2 s-1", "kg m-2"),
+    ("mm/s", "mm"),
+])
+def test_depth_unit(rate_unit, unit):
+    assert accumulate.depth_unit(rate_unit) == unit
+
+
+def test_units_are_checked():
+    accumulator = accumulate.PrecipAccumulator()
+    with pytest.raises(ValueError):
+        accumulator.update(map_frames(unit="mm")[0])
+
+    accumulator = accumulate.PrecipAccumulator()
+    frames = map_frames()
+    accumulator.update(frames[0])
+    other_unit = frames[1].astype({"measurement_unit": str})
+    other_unit.loc[other_unit["variable_name"] == "precipitation_flux", "measurement_unit"] = "in s^-1"
+    with pytest.raises(ValueError):
+        accumulator.update(other_unit)
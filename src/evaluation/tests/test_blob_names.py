@@ -0,0 +1,101 @@
+"""Tests of the generated NWM blob names."""
+import blob_names
+import pytest
+
+from datetime import datetime
+
+
+@pytest.mark.parametrize("configuration, domain, variable, reference_time, member, n_leads, first, last", [
+    ("short_range", "conus", "channel_rt", datetime(2023, 1, 1, 5), 1, 18, "f001", "f018"),
+    ("short_range", "conus", "forcing", datetime(2023, 1, 1, 5), 1, 18, "f001", "f018"),
+    ("analysis_assim", "conus", "channel_rt", datetime(2023, 1, 1, 23), 1, 3, "tm00", "tm02"),
+    # Hawaii is sub-hourly, with minutes in the lead string
+    ("short_range", "hawaii", "channel_rt", datetime(2023, 1, 1, 12), 1, 192, "f00015", "f04800"),
+    ("analysis_assim", "hawaii", "channel_rt", datetime(2023, 1, 1, 1), 1, 12, "tm0000", "tm0245"),
+    ("short_range", "puertorico", "channel_rt", datetime(2023, 1, 1, 6), 1, 48, "f001", "f048"),
+    ("short_range", "puertorico", "forcing", datetime(2023, 1, 1, 18), 1, 48, "f001", "f048"),
+    ("medium_range", "conus", "channel_rt", datetime(2023, 1, 1, 6), 1, 240, "f001", "f240"),
+    *[
+        ("medium_range", "conus", "channel_rt", datetime(2023, 1, 1, 6), member, 204, "f001", "f204")
+        for member in range(2, 8)
+    ],
+    # v2.0 medium range has 3 hour steps
+    ("medium_range", "conus", "channel_rt", datetime(2020, 1, 1, 0), 1, 80, "f003", "f240"),
+    ("medium_range", "conus", "forcing", datetime(2020, 1, 1, 0), 1, 80, "f003", "f240"),
+    # v2.0 Hawaii is hourly
+    ("short_range", "hawaii", "channel_rt", datetime(2020, 1, 1, 6), 1, 60, "f001", "f060"),
+])
+def test_generate_parse_round_trip(configuration, domain, variable, reference_time, member, n_leads, first, last):
+    names = blob_names.generate_blob_names(
+        configuration,
+        reference_time,
+        variable=variable,
+        domain=domain,
+        member=member
+    )
+    assert len(names) == n_leads == len(set(names))
+    assert f".{first}.{domain}.nc" in names[0]
+    assert f".{last}.{domain}.nc" in names[-1]
+
+    version = blob_names.nwm_version(reference_time)
+    for name, lead in zip(names, blob_names.lead_hours(configuration, domain, version, member)):
+        parts = blob_names.parse_blob_name(name)
+        assert parts == {
+            "reference_time": reference_time,
+            "configuration": configuration,
+            "variable": variable,
+            "member": member if variable == "channel_rt" else 1,
+            "lead_hrs": pytest.approx(lead),
+            "domain": domain,
+        }
+        assert blob_names.generate_blob_names(
+            parts["configuration"],
+            parts["reference_time"],
+            variable=parts["variable"],
+            domain=parts["domain"],
+            member=parts["member"],
+            leads=[lead],
+        ) == [name]
+
+
+# Names as listed in the gs://national-water-model bucket, one per
+# configuration, domain and NWM version
+LISTED_BLOB_NAMES = [
+    "nwm.20230101/short_range/nwm.t00z.short_range.channel_rt.f001.conus.nc",
+    "nwm.20230101/forcing_short_range/nwm.t23z.short_range.forcing.f018.conus.nc",
+    "nwm.20230101/analysis_assim/nwm.t00z.analysis_assim.channel_rt.tm02.conus.nc",
+    "nwm.20230101/forcing_analysis_assim/nwm.t12z.analysis_assim.forcing.tm00.conus.nc",
+    "nwm.20230101/analysis_assim_extend/nwm.t16z.analysis_assim_extend.channel_rt.tm27.conus.nc",
+    "nwm.20230101/medium_range_mem1/nwm.t00z.medium_range.channel_rt_1.f240.conus.nc",
+    "nwm.20230101/medium_range_mem4/nwm.t18z.medium_range.channel_rt_4.f204.conus.nc",
+    "nwm.20230101/forcing_medium_range/nwm.t06z.medium_range.forcing.f001.conus.nc",
+    "nwm.20230101/short_range_hawaii/nwm.t12z.short_range.channel_rt.f00015.hawaii.nc",
+    "nwm.20230101/short_range_hawaii/nwm.t00z.short_range.channel_rt.f04800.hawaii.nc",
+    "nwm.20230101/analysis_assim_hawaii/nwm.t03z.analysis_assim.channel_rt.tm0145.hawaii.nc",
+    "nwm.20230101/short_range_puertorico/nwm.t06z.short_range.channel_rt.f048.puertorico.nc",
+    "nwm.20230101/forcing_short_range_puertorico/nwm.t18z.short_range.forcing.f001.puertorico.nc",
+    "nwm.20200101/medium_range_mem1/nwm.t00z.medium_range.channel_rt_1.f003.conus.nc",
+    "nwm.20200101/short_range_hawaii/nwm.t06z.short_range.channel_rt.f060.hawaii.nc",
+]
+
+
+@pytest.mark.parametrize("name", LISTED_BLOB_NAMES)
+def test_listed_names_are_generated(name):
+    parts = blob_names.parse_blob_name(name)
+    assert parts is not None
+    names = blob_names.generate_blob_names(
+        parts["configuration"],
+        parts["reference_time"],
+        variable=parts["variable"],
+        domain=parts["domain"],
+        member=parts["member"]
+    )
+    assert name in names
+
+
+@pytest.mark.parametrize("name", [
+    "nwm.20230101/usgs_timeslices/2023-01-01_00:00:00.15min.usgsTimeSlice.ncdf",
+    "nwm.20230101/short_range/nwm.t00z.short_range.channel_rt.f001.conus.nc.json",
+])
+def test_parse_other_names(name):
+    assert blob_names.parse_blob_name(name) is None
@@ -0,0 +1,131 @@
+"""Tests of the size-bounded disk cache."""
+import os
+
+import cache
+import config
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Deterministic access times, one second per call."""
+    now = [0.0]
+
+    def time():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(cache.time, "time", time)
+
+
+def put(disk_cache, key, size=100):
+    return disk_cache.put_bytes(key, b"x" * size)
+
+
+def test_lru_evicts_least_recently_used(tmp_path, clock):
+    disk_cache = cache.DiskCache(tmp_path, max_bytes=300, policy="lru")
+    for key in ["a", "b", "c"]:
+        put(disk_cache, key)
+    assert disk_cache.get("a") is not None
+
+    put(disk_cache, "d")
+    assert not disk_cache.contains("b")
+    assert all(disk_cache.contains(key) for key in ["a", "c", "d"])
+
+    put(disk_cache, "e")
+    assert not disk_cache.contains("c")
+    assert all(disk_cache.contains(key) for key in ["a", "d", "e"])
+
+
+def test_lfu_evicts_least_frequently_used(tmp_path, clock):
+    disk_cache = cache.DiskCache(tmp_path, max_bytes=300, policy="lfu")
+    for key in ["a", "b", "c"]:
+        put(disk_cache, key)
+    for key in ["a", "a", "b", "c"]:
+        disk_cache.get(key)
+
+    # b and c were used twice, b less recently
+    put(disk_cache, "d")
+    assert not disk_cache.contains("b")
+
+    # The new entry was used once
+    put(disk_cache, "e")
+    assert not disk_cache.contains("d")
+    assert all(disk_cache.contains(key) for key in ["a", "c", "e"])
+
+
+def test_byte_budget(tmp_path, clock):
+    disk_cache = cache.DiskCache(tmp_path, max_bytes=1000)
+    for i in range(20):
+        put(disk_cache, f"nwm.20230101/f{i:03d}.nc", size=150)
+        assert disk_cache.total_bytes() <= 1000
+
+    # The entry just added is kept even if it alone is over budget
+    put(disk_cache, "big.nc", size=5000)
+    assert disk_cache.contains("big.nc")
+    assert disk_cache.total_bytes() == 5000
+    # The index (and its WAL files) aside, only that entry is left
+    files = [f for _, _, fs in os.walk(tmp_path) for f in fs]
+    assert [f for f in files if not f.startswith(cache.INDEX_FILENAME)] == ["big.nc"]
+
+    unbounded = cache.DiskCache(tmp_path / "unbounded")
+    for i in range(5):
+        put(unbounded, f"f{i}.nc")
+    assert unbounded.evict() == 0
+    assert unbounded.total_bytes() == 500
+
+
+def test_counters(tmp_path, clock):
+    disk_cache = cache.DiskCache(tmp_path, max_bytes=250)
+    assert disk_cache.get("a") is None
+    put(disk_cache, "a")
+    assert disk_cache.get("a") == disk_cache.path("a")
+    put(disk_cache, "b")
+    put(disk_cache, "c", size=120)
+    assert disk_cache.get("a") is None
+
+    stats = disk_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["evictions"] == 1
+    assert stats["evicted_bytes"] == 100
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 220
+    assert stats["max_bytes"] == 250
+
+    # Shared through the index with other processes
+    assert cache.DiskCache(tmp_path, max_bytes=250).stats()["hits"] == 1
+    disk_cache.reset_stats()
+    assert disk_cache.stats()["misses"] == 0
+
+
+def test_get_adds_unindexed_files(tmp_path):
+    (tmp_path / "old.nc").write_bytes(b"x" * 10)
+    disk_cache = cache.DiskCache(tmp_path)
+    assert disk_cache.get("old.nc") is not None
+    assert disk_cache.total_bytes() == 10
+
+
+def test_get_cache_is_shared_by_threads(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "NWM_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "NWM_CACHE_MAX_BYTES", 2000)
+    monkeypatch.setattr(cache, "_caches", {})
+
+    def put_from_thread(i):
+        disk_cache = cache.get_cache()
+        put(disk_cache, f"f{i:03d}.nc")
+        disk_cache.get(f"f{i:03d}.nc")
+        return disk_cache
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        caches = list(executor.map(put_from_thread, range(50)))
+    assert all(disk_cache is caches[0] for disk_cache in caches)
+    assert cache.get_cache() is caches[0]
+    assert len(cache._caches) == 1
+
+    stats = cache.get_cache().stats()
+    assert stats["bytes"] <= 2000
+    assert stats["evictions"] == 30
+    assert stats["hits"] + stats["misses"] == 50
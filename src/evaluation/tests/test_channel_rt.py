@@ -0,0 +1,68 @@
+"""Tests of the direct channel_rt reader on synthetic files."""
+import channel_rt
+import h5py
+import numpy as np
+import pyarrow as pa
+import pytest
+
+FILE_FEATURE_IDS = np.array([50, 10, 40, 20, 30, 60], dtype=np.int32)
+# Stored as scaled integers, 0.01 m3/s
+STREAMFLOW = np.array([500, 100, -999900, 200, 300, 600], dtype=np.int32)
+
+
+def write_channel_rt(filepath, feature_ids=FILE_FEATURE_IDS, streamflow=STREAMFLOW):
+    with h5py.File(filepath, "w") as f:
+        f["feature_id"] = feature_ids
+        dataset = f.create_dataset("streamflow", data=streamflow, chunks=(2,) if len(streamflow) else None)
+        dataset.attrs["_FillValue"] = np.array([-999900], dtype=np.int32)
+        dataset.attrs["scale_factor"] = np.array([0.01], dtype=np.float32)
+        dataset.attrs["add_offset"] = np.array([0.0], dtype=np.float32)
+        dataset.attrs["units"] = b"m3 s-1"
+        # 2023-01-01 00:00 and 01:00
+        for variable, minutes in [("reference_time", 27875520), ("time", 27875580)]:
+            f[variable] = np.array([minutes], dtype=np.int32)
+            f[variable].attrs["units"] = b"minutes since 1970-01-01 00:00:00 UTC"
+    return filepath
+
+
+def test_feature_index_positions():
+    index = channel_rt.FeatureIndex([30, 99, 10, 60, 10])
+    positions, found = index.positions(FILE_FEATURE_IDS)
+    assert positions.tolist() == [4, 1, 5, 1]
+    assert found.tolist() == [True, False, True, True, True]
+    # Reused for the same feature_id array
+    assert index.positions(FILE_FEATURE_IDS.copy())[0] is positions
+
+
+def test_feature_index_empty_file():
+    index = channel_rt.FeatureIndex([30, 10])
+    positions, found = index.positions(np.zeros(0, dtype=np.int32))
+    assert positions.tolist() == []
+    assert found.tolist() == [False, False]
+
+
+def test_read_channel_rt(tmp_path):
+    filepath = write_channel_rt(str(tmp_path / "channel_rt.nc"))
+    index = channel_rt.FeatureIndex([60, 40, 10, 99, 60], ["g60", "g40", "g10", "g99", "g60b"])
+
+    batch = channel_rt.read_channel_rt(filepath, index, "medium_range_mem1")
+
+    assert batch.schema == pa.schema(list(channel_rt.CHANNEL_RT_ARROW_TYPES.items()))
+    assert batch["nwm_feature_id"].to_pylist() == [60, 40, 10, 60]
+    values = batch["value"].to_numpy(zero_copy_only=False)
+    np.testing.assert_allclose(values, [6.0, np.nan, 1.0, 6.0], rtol=1e-6)
+    assert batch["usgs_site_code"].to_pylist() == ["g60", "g40", "g10", "g60b"]
+    assert batch["measurement_unit"].to_pylist() == ["m3 s-1"] * 4
+    assert batch["reference_time"][0].as_py().isoformat() == "2023-01-01T00:00:00"
+    assert batch["value_time"][0].as_py().isoformat() == "2023-01-01T01:00:00"
+
+
+@pytest.mark.parametrize("file_feature_ids, streamflow", [
+    (FILE_FEATURE_IDS, STREAMFLOW),
+    (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)),
+])
+def test_read_channel_rt_nothing_found(tmp_path, file_feature_ids, streamflow):
+    filepath = write_channel_rt(str(tmp_path / "channel_rt.nc"), file_feature_ids, streamflow)
+    batch = channel_rt.read_channel_rt(filepath, channel_rt.FeatureIndex([1, 2]), "analysis_assim")
+    assert batch.num_rows == 0
+    assert batch.schema == pa.schema(list(channel_rt.CHANNEL_RT_ARROW_TYPES.items()))
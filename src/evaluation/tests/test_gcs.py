@@ -0,0 +1,130 @@
+"""Tests of the shared GCS client against a local fake-GCS HTTP server
+(tests/fake_gcs.py) used through STORAGE_EMULATOR_HOST."""
+import os
+
+import gcs
+import gcsfs
+import pytest
+
+from fake_gcs import FakeGCSServer
+from google.api_core import exceptions
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeGCSServer() as server:
+        monkeypatch.setenv("STORAGE_EMULATOR_HOST", server.url)
+        gcs._clients.clear()
+        gcsfs.GCSFileSystem.clear_instance_cache()
+        yield server
+    gcs._clients.clear()
+    gcsfs.GCSFileSystem.clear_instance_cache()
+
+
+def add_blobs(server, blob_names):
+    for name in blob_names:
+        server.blobs[(BUCKET, name)] = name.encode() * 10
+
+
+def test_get_client_is_reused_per_process(server, monkeypatch):
+    client = gcs.get_client()
+    assert gcs.get_client() is client
+    adapter = client._http.adapters["http://"]
+    assert adapter._pool_maxsize == gcs.DEFAULT_POOL_SIZE
+
+    # A forked worker gets its own client
+    pid = os.getpid()
+    monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+    worker_client = gcs.get_client()
+    assert worker_client is not client
+    assert gcs.get_client() is worker_client
+
+
+def test_list_blob_names(server):
+    add_blobs(server, ["nwm.20230101/a.nc", "nwm.20230101/b.nc", "nwm.20230102/c.nc"])
+    assert gcs.list_blob_names("nwm.20230101/", BUCKET) == [
+        "nwm.20230101/a.nc",
+        "nwm.20230101/b.nc",
+    ]
+
+
+def test_download_blob_retries_transient_errors(server):
+    add_blobs(server, ["a.nc"])
+    server.errors["a.nc"] = [503, 429]
+    assert gcs.download_blob("a.nc", BUCKET, retries=3, backoff=0) == b"a.nc" * 10
+    # The storage library does not retry on its own
+    assert server.errors["a.nc"] == []
+    assert server.downloads["a.nc"] == 1
+
+
+def test_download_blob_raises_after_retries(server):
+    add_blobs(server, ["a.nc"])
+    server.errors["a.nc"] = [500, 503, 503, 200]
+    with pytest.raises(exceptions.ServerError):
+        gcs.download_blob("a.nc", BUCKET, retries=2, backoff=0)
+    # Three attempts, the fourth response is never requested
+    assert server.errors["a.nc"] == [200]
+
+
+def test_download_blob_does_not_retry_not_found(server):
+    server.errors["missing.nc"] = [404, 503]
+    with pytest.raises(exceptions.NotFound):
+        gcs.download_blob("missing.nc", BUCKET, retries=3, backoff=0)
+    assert server.errors["missing.nc"] == [503]
+
+
+def test_fetch_blobs_order_concurrency_and_pooling(server):
+    blob_names = [f"f{i:03d}.nc" for i in range(40)]
+    add_blobs(server, blob_names)
+    server.errors["f007.nc"] = [503]
+    server.delay = 0.01
+
+    data = gcs.fetch_blobs(blob_names, BUCKET, max_concurrency=4)
+
+    assert list(data) == blob_names
+    assert all(data[name] == name.encode() * 10 for name in blob_names)
+    assert 1 < server.max_active <= 4
+    assert server.downloads["f007.nc"] == 1
+    # 41 requests over the pooled keep-alive connections
+    assert len(server.connections) <= 4
+
+
+def test_prefetch_blobs_order_and_bound(server):
+    blob_names = [f"f{i:03d}.nc" for i in range(30)]
+    add_blobs(server, blob_names)
+    server.delay = 0.005
+
+    downloads = gcs.prefetch_blobs(
+        blob_names,
+        BUCKET,
+        workers=3,
+        prefetch=5,
+        is_cached=lambda name: name.endswith("5.nc"),
+    )
+    for i, (name, raw_bytes) in enumerate(downloads):
+        assert name == blob_names[i]
+        if name.endswith("5.nc"):
+            assert raw_bytes is None
+        else:
+            assert raw_bytes == name.encode() * 10
+        # Only `prefetch` downloads are queued ahead of the caller
+        assert len(server.downloads) <= i + 1 + 5
+    assert "f005.nc" not in server.downloads
+    assert len(server.downloads) == 27
+
+
+def test_open_blob_reads_byte_ranges(server):
+    data = bytes(range(256)) * 1000
+    server.blobs[(BUCKET, "nwm.20230101/big.nc")] = data
+
+    with gcs.open_blob("nwm.20230101/big.nc", BUCKET, block_size=4096) as f:
+        f.seek(100_000)
+        assert f.read(10) == data[100_000:100_010]
+        f.seek(10)
+        assert f.read(5000) == data[10:5010]
+        assert f.size == len(data)
+
+    # Only the blocks read were transferred
+    assert server.downloads["nwm.20230101/big.nc"] <= 3
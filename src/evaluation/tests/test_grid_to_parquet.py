@@ -0,0 +1,120 @@
+"""Tests of the MAP calculation of grid_to_parquet."""
+import cache
+import config
+import grid_to_parquet
+import numpy as np
+import pandas as pd
+import pytest
+import utils
+import xarray as xr
+import zarr_cache
+
+from concurrent.futures import ProcessPoolExecutor
+
+BLOB_NAME = "nwm.20230101/forcing_short_range/nwm.t00z.short_range.forcing.f001.conus.nc"
+
+
+def sum_store(store_path: str) -> float:
+    """Read a Zarr store in a worker process."""
+    with xr.open_zarr(store_path) as store:
+        return float(store["RAINRATE"].sum())
+
+
+def test_map_pool_context(monkeypatch, tmp_path):
+    contexts = []
+
+    class RecordingExecutor(ProcessPoolExecutor):
+        def __init__(self, *args, mp_context=None, **kwargs):
+            contexts.append(mp_context)
+            super().__init__(*args, mp_context=mp_context, **kwargs)
+
+    monkeypatch.setattr(grid_to_parquet, "ProcessPoolExecutor", RecordingExecutor)
+    parquet_filepath = str(tmp_path / "map.parquet")
+
+    monkeypatch.setattr(config, "NWM_CACHE_BACKEND", "netcdf")
+    assert grid_to_parquet.map_blobs_to_parquet([], "w.bin", parquet_filepath, max_processes=1) == 0
+    assert contexts[-1] is None
+
+    monkeypatch.setattr(config, "NWM_CACHE_BACKEND", "zarr")
+    assert grid_to_parquet.map_blobs_to_parquet([], "w.bin", parquet_filepath, max_processes=1) == 0
+    assert contexts[-1].get_start_method() == "spawn"
+
+
+def test_zarr_workers_read_after_parent_writes(monkeypatch, tmp_path):
+    # The parent compresses and decompresses chunks first, so Blosc
+    # threads are running when the pool starts (a forked worker could
+    # hang here)
+    monkeypatch.setattr(config, "NWM_ZARR_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "NWM_CACHE_BACKEND", "zarr")
+    ds = xr.Dataset(
+        {"RAINRATE": (("time", "y", "x"), np.full((1, 40, 50), 0.001, dtype=np.float32))},
+        coords={"y": np.arange(40.0), "x": np.arange(50.0)},
+    )
+    assert zarr_cache.write_blob(BLOB_NAME, ds)
+    store_path = zarr_cache.store_location(BLOB_NAME)[0]
+    expected = sum_store(store_path)
+
+    with ProcessPoolExecutor(max_workers=2, mp_context=grid_to_parquet._map_mp_context()) as executor:
+        sums = list(executor.map(sum_store, [store_path] * 4, timeout=120))
+    assert sums == [expected] * 4
+
+
+GRID_SHAPE = (6, 8)
+FORCING_BLOB_NAMES = [
+    f"nwm.20230101/forcing_short_range/nwm.t00z.short_range.forcing.f{lead:03d}.conus.nc"
+    for lead in range(1, 6)
+]
+
+
+@pytest.fixture
+def cached_forcing(monkeypatch, tmp_path):
+    """Forcing blobs in the NetCDF cache and a weights file of 3
+    catchments (the last one partly weighted), on a small grid."""
+    monkeypatch.setattr(config, "NWM_CACHE_DIR", str(tmp_path / "nwm"))
+    monkeypatch.setattr(config, "NWM_CACHE_BACKEND", "netcdf")
+    monkeypatch.setattr(cache, "_caches", {})
+
+    rng = np.random.default_rng(0)
+    nc_cache = cache.get_cache()
+    for blob_name in FORCING_BLOB_NAMES:
+        rainrate = rng.uniform(0, 0.002, (1,) + GRID_SHAPE).astype(np.float32)
+        rainrate[0, 0, :3] = np.nan
+        ds = xr.Dataset(
+            {"RAINRATE": (("time", "y", "x"), rainrate, {"units": "mm s^-1"})},
+            coords={"y": np.arange(GRID_SHAPE[0], dtype=float), "x": np.arange(GRID_SHAPE[1], dtype=float)},
+        )
+        nc_cache.put(blob_name, lambda filepath: ds.to_netcdf(filepath, engine="h5netcdf"))
+
+    cols = np.array([0, 1, 2, 3, 9, 10, 20, 21, 22, 30, 40, 41, 47])
+    weights = utils.SparseWeights(
+        catchment_ids=np.array(["a", "b", "c"]),
+        rows=np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2], dtype=np.int32),
+        cols=cols.astype(np.int32),
+        weights=np.array([1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0.5, 0.25, 1], dtype=np.float32),
+        grid_shape=GRID_SHAPE,
+    )
+    weights_filepath = str(tmp_path / "weights.bin")
+    utils.save_weights_file(weights, weights_filepath)
+    return weights_filepath
+
+
+def test_calculate_map_dask_stats(cached_forcing):
+    stats = ["std", "min", "max", "p90", "frac_above"]
+    expected = grid_to_parquet.calculate_map_batch(
+        FORCING_BLOB_NAMES,
+        cached_forcing,
+        stats=stats,
+        threshold=0.001,
+    )
+    df = grid_to_parquet.calculate_map_dask(
+        FORCING_BLOB_NAMES,
+        cached_forcing,
+        time_chunk=2,
+        stats=stats,
+        threshold=0.001,
+    )
+
+    assert len(df) == 3 * len(FORCING_BLOB_NAMES)
+    assert list(df.columns) == list(expected.columns)
+    assert df["frac_above"].between(0, 1).all()
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
@@ -0,0 +1,134 @@
+"""Tests of the ingest ledger."""
+import os
+
+import ledger
+import pytest
+
+
+@pytest.fixture
+def ingest_ledger(tmp_path):
+    return ledger.IngestLedger(tmp_path / "ledger.sqlite")
+
+
+def writer(filepath, data=b"rows", calls=None):
+    """Unit writing `data` to filepath and returning its row count."""
+    def fn():
+        if calls is not None:
+            calls.append(filepath)
+        with open(filepath, "wb") as f:
+            f.write(data)
+        return len(data)
+    return fn
+
+
+def test_skips_complete_units(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    calls = []
+
+    assert ingest_ledger.run("job", "a", writer(output, calls=calls), output, "fp") == 4
+    assert ingest_ledger.run("job", "a", writer(output, calls=calls), output, "fp") is None
+
+    assert len(calls) == 1
+    entry = ingest_ledger.get("job", "a")
+    assert entry["status"] == "done"
+    assert entry["rows"] == 4
+    assert entry["bytes"] == os.path.getsize(output)
+    assert entry["checksum"] == ledger.file_checksum(output)
+    assert ingest_ledger.pending("job", ["a", "b"], {"a": "fp"}) == ["b"]
+    # Units are per job
+    assert not ingest_ledger.is_complete("other", "a")
+
+
+def test_retries_failed_units(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+
+    def fail():
+        raise IOError("bucket unavailable")
+
+    with pytest.raises(IOError):
+        ingest_ledger.run("job", "a", fail, output)
+    entry = ingest_ledger.get("job", "a")
+    assert entry["status"] == "failed"
+    assert "bucket unavailable" in entry["error"]
+    assert ingest_ledger.pending("job", ["a"]) == ["a"]
+
+    assert ingest_ledger.run("job", "a", writer(output), output) == 4
+    entry = ingest_ledger.get("job", "a")
+    assert entry["status"] == "done" and entry["error"] is None
+
+
+def test_missing_output_is_failed(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    with pytest.raises(FileNotFoundError):
+        ingest_ledger.run("job", "a", lambda: 0, output)
+    assert ingest_ledger.get("job", "a")["status"] == "failed"
+
+
+def test_reruns_changed_fingerprint(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    calls = []
+    ingest_ledger.run("job", "a", writer(output, calls=calls), output, ledger.fingerprint(["x.nc"]))
+
+    fingerprint = ledger.fingerprint(["x.nc", "y.nc"])
+    assert not ingest_ledger.is_complete("job", "a", fingerprint)
+    assert ingest_ledger.run("job", "a", writer(output, calls=calls), output, fingerprint) == 4
+    assert len(calls) == 2
+    assert ingest_ledger.get("job", "a")["fingerprint"] == fingerprint
+    # No fingerprint given, any is accepted
+    assert ingest_ledger.is_complete("job", "a")
+
+
+def test_reruns_changed_or_missing_output(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    ingest_ledger.run("job", "a", writer(output), output)
+
+    # Same size, other content: only caught when verifying the checksum
+    with open(output, "wb") as f:
+        f.write(b"ROWS")
+    assert ingest_ledger.is_complete("job", "a")
+    assert not ingest_ledger.is_complete("job", "a", verify=True)
+
+    # Size mismatch
+    with open(output, "wb") as f:
+        f.write(b"more rows")
+    assert not ingest_ledger.is_complete("job", "a")
+
+    os.remove(output)
+    assert not ingest_ledger.is_complete("job", "a")
+    assert ingest_ledger.pending("job", ["a"]) == ["a"]
+
+
+def test_reruns_interrupted_units(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    # A run killed after start, before complete or fail
+    ingest_ledger.start("job", "a", "fp")
+    assert ingest_ledger.get("job", "a")["status"] == "running"
+    assert ingest_ledger.pending("job", ["a"], {"a": "fp"}) == ["a"]
+
+    assert ingest_ledger.run("job", "a", writer(output), output, "fp") == 4
+    assert ingest_ledger.summary("job") == {"running": 0, "done": 1, "failed": 0}
+
+
+def test_update_output(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    moved = str(tmp_path / "part" / "a.parquet")
+    ingest_ledger.run("job", "a", writer(output), output)
+
+    os.makedirs(os.path.dirname(moved))
+    with open(moved, "wb") as f:
+        f.write(b"rewritten rows")
+    os.remove(output)
+    ingest_ledger.update_output(output, moved)
+
+    entry = ingest_ledger.get("job", "a")
+    assert entry["output_path"] == moved
+    assert entry["bytes"] == os.path.getsize(moved)
+    assert ingest_ledger.is_complete("job", "a", verify=True)
+
+
+def test_persists_across_connections(ingest_ledger, tmp_path):
+    output = str(tmp_path / "a.parquet")
+    ingest_ledger.run("job", "a", writer(output), output)
+    reopened = ledger.IngestLedger(ingest_ledger.filepath)
+    assert reopened.is_complete("job", "a")
+    assert reopened.summary() == {"running": 0, "done": 1, "failed": 0}
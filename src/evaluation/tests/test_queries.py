@@ -0,0 +1,63 @@
+"""Tests of the partition pruning of the query sources."""
+import os
+
+import pytest
+import queries
+
+
+def touch(directory, *parts):
+    filepath = os.path.join(directory, *parts)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    open(filepath, "wb").close()
+    return filepath
+
+
+@pytest.fixture
+def partitioned_dir(tmp_path):
+    directory = str(tmp_path)
+    for configuration in ["medium_range_mem1", "short_range"]:
+        for day in ["2023-01-01", "2023-01-02", "2023-01-03"]:
+            touch(directory, f"configuration={configuration}", f"reference_date={day}", "a.parquet")
+    return directory
+
+
+def partition_paths(source):
+    return [p.strip(" '") for p in source.split("[")[1].split("]")[0].split(",")]
+
+
+def test_flat_directory(tmp_path):
+    touch(str(tmp_path), "20230101T00.parquet")
+    assert queries.parquet_source(str(tmp_path), []) == f"'{tmp_path}/*.parquet'"
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ([], 6),
+    ([{"column": "reference_time", "operator": "=", "value": "2023-01-02 06:00"}], 2),
+    ([{"column": "reference_time", "operator": ">=", "value": "2023-01-02 06:00"}], 4),
+    ([{"column": "reference_time", "operator": "<", "value": "2023-01-02"}], 4),
+    ([{"column": "configuration", "operator": "=", "value": "short_range"}], 3),
+    ([
+        {"column": "configuration", "operator": "!=", "value": "short_range"},
+        {"column": "reference_time", "operator": "=", "value": "2023-01-03 00:00"},
+    ], 1),
+    # Other columns do not prune
+    ([{"column": "nwm_feature_id", "operator": "=", "value": 101}], 6),
+])
+def test_partition_pruning(partitioned_dir, filters, expected):
+    source = queries.parquet_source(partitioned_dir, filters)
+    assert source.endswith("hive_partitioning=true)")
+    paths = partition_paths(source)
+    assert len(paths) == expected
+    for path in paths:
+        assert path.startswith(partitioned_dir) and path.endswith("/*.parquet")
+
+
+def test_no_matching_partition_keeps_one(partitioned_dir):
+    filters = [{"column": "reference_time", "operator": "=", "value": "2024-01-01 00:00"}]
+    assert len(partition_paths(queries.parquet_source(partitioned_dir, filters))) == 1
+
+
+def test_mixed_directory_raises(partitioned_dir):
+    touch(partitioned_dir, "20230104T00.parquet")
+    with pytest.raises(ValueError, match="flat Parquet files"):
+        queries.parquet_source(partitioned_dir, [])
@@ -0,0 +1,124 @@
+"""Tests of the canonical timeseries schema and its migration."""
+import os
+
+import ledger
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import timeseries_parquet
+import utils
+
+from datetime import datetime
+
+
+def nwm_frame(feature_ids=(101, 102, 103), n_hours=4):
+    """Legacy NWM frame, as written by nwm_to_parquet."""
+    reference_time = datetime(2023, 1, 1)
+    rows = [
+        {
+            "reference_time": reference_time,
+            "value_time": reference_time + pd.Timedelta(hours=lead),
+            "nwm_feature_id": feature_id,
+            "usgs_site_code": f"0{feature_id}",
+            "value": feature_id + lead / 10,
+            "configuration": "medium_range_mem1",
+            "measurement_unit": "m3/s",
+            "variable_name": "streamflow",
+        }
+        for feature_id in reversed(feature_ids)
+        for lead in range(1, n_hours + 1)
+    ]
+    df = pd.DataFrame(rows)
+    df["lead_time"] = df["value_time"] - df["reference_time"]
+    return df
+
+
+def test_to_canonical_table():
+    table = timeseries_parquet.to_canonical_table(
+        nwm_frame(),
+        timeseries_parquet.NWM_ARROW_TYPES,
+        timeseries_parquet.NWM_SORT_BY
+    )
+    for name in table.column_names:
+        assert table.schema.field(name).type == timeseries_parquet.NWM_ARROW_TYPES[name]
+    assert "lead_time" not in table.column_names
+    assert table["lead_hours"].to_pylist() == [1, 2, 3, 4] * 3
+    assert table["nwm_feature_id"].to_pylist() == [101] * 4 + [102] * 4 + [103] * 4
+
+
+@pytest.mark.parametrize("column, value", [
+    ("nwm_feature_id", 2**31),
+    ("nwm_feature_id", -2**31 - 1),
+    ("lead_hours", 2**15),
+])
+def test_out_of_range_integers_raise(column, value):
+    df = nwm_frame().drop(columns=["lead_time"])
+    df["lead_hours"] = 1
+    df.loc[0, column] = value
+    with pytest.raises(ValueError, match=column):
+        timeseries_parquet.to_canonical_table(df, timeseries_parquet.NWM_ARROW_TYPES)
+
+
+def test_lead_time_out_of_range_raises():
+    df = nwm_frame()
+    df.loc[0, "lead_time"] = pd.Timedelta(hours=40000)
+    with pytest.raises(ValueError, match="lead_hours"):
+        timeseries_parquet.to_canonical_table(df, timeseries_parquet.NWM_ARROW_TYPES)
+
+
+def test_migrate_legacy_flat_file(monkeypatch, tmp_path):
+    ingest_ledger = ledger.IngestLedger(tmp_path / "ledger.sqlite")
+    monkeypatch.setattr(ledger, "get_ledger", lambda: ingest_ledger)
+    directory = str(tmp_path / "medium_range_mem1")
+    os.makedirs(directory)
+    legacy_filepath = os.path.join(directory, "20230101T00.parquet")
+    df = nwm_frame()
+    df.to_parquet(legacy_filepath)
+    ingest_ledger.complete("medium_range", "20230101T00", legacy_filepath, rows=len(df))
+
+    sizes = timeseries_parquet.migrate_parquet_dir(
+        directory,
+        timeseries_parquet.NWM_ARROW_TYPES,
+        timeseries_parquet.NWM_SORT_BY,
+        partition=True
+    )
+
+    new_filepath = os.path.join(
+        utils.partition_dir(directory, "medium_range_mem1", datetime(2023, 1, 1)),
+        "20230101T00.parquet"
+    )
+    assert sizes["path"].tolist() == [new_filepath]
+    assert not os.path.exists(legacy_filepath)
+
+    # Canonical dtypes, without the partition column
+    table = pq.read_table(new_filepath)
+    assert "configuration" not in table.column_names
+    assert "lead_time" not in table.column_names
+    for name in table.column_names:
+        assert table.schema.field(name).type == timeseries_parquet.NWM_ARROW_TYPES[name]
+
+    # Same values, sorted by ID and time
+    expected = df.sort_values(["nwm_feature_id", "value_time"]).reset_index(drop=True)
+    migrated = table.to_pandas()
+    np.testing.assert_array_equal(migrated["nwm_feature_id"], expected["nwm_feature_id"])
+    np.testing.assert_array_equal(migrated["value_time"], expected["value_time"])
+    np.testing.assert_allclose(migrated["value"], expected["value"], rtol=1e-6)
+    np.testing.assert_array_equal(migrated["lead_hours"], expected["lead_time"].dt.total_seconds() // 3600)
+    assert migrated["usgs_site_code"].astype(str).tolist() == expected["usgs_site_code"].tolist()
+
+    # The ledger entry follows the file
+    entry = ingest_ledger.get("medium_range", "20230101T00")
+    assert entry["output_path"] == new_filepath
+    assert entry["bytes"] == os.path.getsize(new_filepath)
+    assert entry["checksum"] == ledger.file_checksum(new_filepath)
+    assert entry["rows"] == len(df)
+
+    # Canonical files are left alone
+    assert timeseries_parquet.migrate_parquet_dir(
+        directory,
+        timeseries_parquet.NWM_ARROW_TYPES,
+        timeseries_parquet.NWM_SORT_BY,
+        partition=True
+    ).empty
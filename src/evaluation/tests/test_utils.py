@@ -0,0 +1,54 @@
+"""Tests of the atomic write and process local helpers."""
+import os
+import threading
+
+import pytest
+import utils
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_atomic_write_threads_of_one_process(tmp_path):
+    filepath = str(tmp_path / "out" / "data.bin")
+    barrier = threading.Barrier(8)
+
+    def write(i):
+        with utils.atomic_write(filepath) as tmp_filepath:
+            with open(tmp_filepath, "wb") as f:
+                f.write(bytes([i]) * 1000)
+                # Every thread has its temp file open at once
+                barrier.wait(timeout=10)
+                f.write(bytes([i]) * 1000)
+        return tmp_filepath
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tmp_filepaths = list(executor.map(write, range(8)))
+
+    assert len(set(tmp_filepaths)) == 8
+    data = open(filepath, "rb").read()
+    assert len(data) == 2000 and len(set(data)) == 1
+    assert os.listdir(tmp_path / "out") == ["data.bin"]
+
+
+def test_atomic_write_removes_temp_on_error(tmp_path):
+    filepath = str(tmp_path / "data.bin")
+    with pytest.raises(RuntimeError):
+        with utils.atomic_write(filepath) as tmp_filepath:
+            os.mkdir(tmp_filepath)
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
+
+
+def test_process_local_one_instance_per_process(monkeypatch):
+    instances = {}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        created = list(executor.map(
+            lambda _: utils.process_local(instances, "key", object),
+            range(32)
+        ))
+    assert all(instance is created[0] for instance in created)
+
+    pid = os.getpid()
+    monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+    assert utils.process_local(instances, "key", object) is not created[0]
+    assert list(instances) == [(pid + 1, "key")]
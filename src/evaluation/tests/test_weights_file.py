@@ -0,0 +1,115 @@
+"""Tests of the binary weights file format."""
+import numpy as np
+import pytest
+import utils
+
+GRID_SHAPE = (30, 40)
+
+
+def sparse_weights(seed=0, n_catchments=25):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 30, n_catchments)
+    rows = np.repeat(np.arange(n_catchments, dtype=np.int32), counts)
+    # Unsorted rows, save_weights_file sorts them
+    shuffle = rng.permutation(len(rows))
+    return utils.SparseWeights(
+        catchment_ids=np.array([f"{1000000000 + i}" for i in range(n_catchments)]),
+        rows=rows[shuffle],
+        cols=rng.integers(0, GRID_SHAPE[0] * GRID_SHAPE[1], len(rows)).astype(np.int32),
+        weights=rng.random(len(rows)).astype(np.float32),
+        grid_shape=GRID_SHAPE,
+    )
+
+
+def as_triples(weights):
+    """Sorted (row, col, weight) triples of weights."""
+    triples = np.rec.fromarrays([
+        np.asarray(weights.rows, dtype=np.int64),
+        np.asarray(weights.cols, dtype=np.int64),
+        np.asarray(weights.weights, dtype=np.float32),
+    ])
+    return np.sort(triples)
+
+
+def test_round_trip(tmp_path):
+    weights = sparse_weights()
+    filepath = tmp_path / "weights.bin"
+
+    utils.save_weights_file(weights, filepath)
+    read = utils.read_weights_file(filepath)
+
+    np.testing.assert_array_equal(read.catchment_ids, weights.catchment_ids)
+    assert read.grid_shape == GRID_SHAPE
+    np.testing.assert_array_equal(as_triples(read), as_triples(weights))
+    # Rows sorted for the CSR matrix, arrays memory-mapped read only
+    assert np.all(np.diff(read.rows) >= 0)
+    assert isinstance(read.cols, np.memmap) and not read.cols.flags.writeable
+    assert read.rows.dtype == np.dtype("<i4") and read.weights.dtype == np.dtype("<f4")
+    assert list(tmp_path.iterdir()) == [filepath]
+
+
+def test_round_trip_empty(tmp_path):
+    weights = utils.SparseWeights(
+        catchment_ids=np.array(["a"]),
+        rows=np.zeros(0, dtype=np.int32),
+        cols=np.zeros(0, dtype=np.int32),
+        weights=np.zeros(0, dtype=np.float32),
+        grid_shape=(2, 3),
+    )
+    filepath = tmp_path / "weights.bin"
+    utils.save_weights_file(weights, filepath)
+    read = utils.read_weights_file(filepath)
+    assert list(read.catchment_ids) == ["a"]
+    assert len(read.rows) == len(read.cols) == len(read.weights) == 0
+    assert read.grid_shape == (2, 3)
+
+
+def test_rejects_wrong_magic(tmp_path):
+    filepath = tmp_path / "weights.bin"
+    utils.save_weights_file(sparse_weights(), filepath)
+    data = bytearray(filepath.read_bytes())
+    data[:8] = b"NOTWGTS!"
+    filepath.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="not a weights file"):
+        utils.read_weights_file(filepath)
+
+
+def test_rejects_other_version(tmp_path):
+    filepath = tmp_path / "weights.bin"
+    utils.save_weights_file(sparse_weights(), filepath)
+    data = bytearray(filepath.read_bytes())
+    data[8:12] = (utils.WEIGHTS_VERSION + 1).to_bytes(4, "little")
+    filepath.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="Unsupported weights file version"):
+        utils.read_weights_file(filepath)
+
+
+def test_rejects_truncated_header(tmp_path):
+    filepath = tmp_path / "weights.bin"
+    filepath.write_bytes(utils.WEIGHTS_MAGIC)
+    with pytest.raises(ValueError, match="not a weights file"):
+        utils.read_weights_file(filepath)
+
+
+def test_convert_weights_dict_file(tmp_path):
+    rng = np.random.default_rng(3)
+    crosswalk = {
+        f"{i:010d}": np.where(rng.random(GRID_SHAPE) < 0.05)
+        for i in range(15)
+    }
+    json_filepath = tmp_path / "weights.json"
+    weights_filepath = tmp_path / "weights.bin"
+    utils.save_weights_dict(crosswalk, json_filepath)
+
+    utils.convert_weights_dict_file(json_filepath, weights_filepath, GRID_SHAPE)
+
+    json_weights = utils.read_weights_dict(json_filepath)
+    read = utils.read_weights_file(weights_filepath)
+    assert list(read.catchment_ids) == list(json_weights)
+    np.testing.assert_array_equal(read.weights, 1.0)
+    for i, (key, (y, x)) in enumerate(json_weights.items()):
+        cols = np.sort(read.cols[read.rows == i])
+        np.testing.assert_array_equal(cols, np.sort(np.ravel_multi_index((y, x), GRID_SHAPE)))
+        # Same cells as indexing the grid with the legacy index arrays
+        grid = np.arange(GRID_SHAPE[0] * GRID_SHAPE[1]).reshape(GRID_SHAPE)
+        np.testing.assert_array_equal(np.sort(grid[y, x]), cols)
@@ -0,0 +1,93 @@
+"""Tests of the Zarr cache of forcing grids."""
+import multiprocessing
+import os
+
+import config
+import numpy as np
+import pytest
+import xarray as xr
+import zarr_cache
+
+from concurrent.futures import ProcessPoolExecutor
+
+BLOB_NAME = "nwm.20230101/forcing_short_range/nwm.t00z.short_range.forcing.f{:03d}.conus.nc"
+LEADS = range(1, 9)
+GRID_SHAPE = (40, 50)
+
+
+def forcing_dataset(lead: int) -> xr.Dataset:
+    """One hour of a forcing grid, RAINRATE in mm/s."""
+    rng = np.random.default_rng(lead)
+    rainrate = rng.uniform(0, 0.01, (1,) + GRID_SHAPE).astype(np.float32)
+    rainrate[0, 0, 0] = np.nan
+    temperature = rng.uniform(250, 300, (1,) + GRID_SHAPE).astype(np.float32)
+    return xr.Dataset(
+        {
+            "RAINRATE": (("time", "y", "x"), rainrate, {"units": "mm s^-1"}),
+            "T2D": (("time", "y", "x"), temperature, {"units": "K"}),
+        },
+        coords={"y": np.arange(GRID_SHAPE[0], dtype=float), "x": np.arange(GRID_SHAPE[1], dtype=float)},
+    )
+
+
+def write_blob(cache_dir: str, lead: int) -> bool:
+    """Write a blob in a spawned worker, which does not see the parent's
+    config."""
+    config.NWM_ZARR_CACHE_DIR = cache_dir
+    return zarr_cache.write_blob(BLOB_NAME.format(lead), forcing_dataset(lead))
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "NWM_ZARR_CACHE_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+def test_store_location():
+    store_path, time_index, value_times = zarr_cache.store_location(BLOB_NAME.format(3))
+    assert store_path.endswith("nwm.20230101/forcing_short_range/nwm.t00z.short_range.forcing.conus.zarr")
+    assert time_index == 2
+    assert len(value_times) == 18
+    assert zarr_cache.store_location("not/an/nwm/blob.nc") == (None, None, None)
+
+
+def test_concurrent_writers_and_round_trip(cache_dir):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=4, mp_context=context) as executor:
+        assert all(executor.map(write_blob, [cache_dir] * len(LEADS), LEADS, timeout=300))
+
+    # One store for the run, each worker filled its own hours
+    store_path = zarr_cache.store_location(BLOB_NAME.format(1))[0]
+    assert os.listdir(os.path.dirname(store_path)) == [os.path.basename(store_path)]
+    blob_list = [BLOB_NAME.format(lead) for lead in LEADS]
+    assert all(zarr_cache.contains(blob_name) for blob_name in blob_list)
+    assert not zarr_cache.contains(BLOB_NAME.format(9))
+    assert zarr_cache.read_blobs(blob_list + [BLOB_NAME.format(9)], ["RAINRATE"]) is None
+
+    ds = zarr_cache.read_blobs(blob_list, ["RAINRATE", "T2D"])
+    assert ds.sizes == {"time": len(LEADS), "y": GRID_SHAPE[0], "x": GRID_SHAPE[1]}
+    assert ds["RAINRATE"].attrs["units"] == "mm s^-1"
+    for i, lead in enumerate(LEADS):
+        expected = forcing_dataset(lead)
+        # Quantized to QUANTIZE_DIGITS decimals, the error is at most
+        # half of the last decimal
+        bound = 0.5 * 10 ** -zarr_cache.QUANTIZE_DIGITS["RAINRATE"]
+        rainrate = ds["RAINRATE"].values[i]
+        assert np.isnan(rainrate[0, 0])
+        assert np.nanmax(np.abs(rainrate - expected["RAINRATE"].values[0])) <= bound
+        # Others are lossless
+        np.testing.assert_array_equal(ds["T2D"].values[i], expected["T2D"].values[0])
+
+    # A window of some timesteps
+    window = (slice(5, 10), slice(20, 30))
+    ds = zarr_cache.read_blobs(blob_list[2:4], ["T2D"], window)
+    np.testing.assert_array_equal(
+        ds["T2D"].values[1],
+        forcing_dataset(LEADS[3])["T2D"].values[0][window]
+    )
+
+
+def test_write_blob_rejects_other_variables(cache_dir):
+    assert zarr_cache.write_blob(BLOB_NAME.format(1), forcing_dataset(1)[["RAINRATE"]])
+    assert not zarr_cache.write_blob(BLOB_NAME.format(2), forcing_dataset(2))
+    assert not zarr_cache.contains(BLOB_NAME.format(2))
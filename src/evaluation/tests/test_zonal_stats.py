@@ -0,0 +1,244 @@
+"""Tests of the sparse weights matrix and zonal means against the
+per-catchment np.nanmean loop they replaced."""
+import warnings
+
+import numpy as np
+import pytest
+import utils
+import zonal_stats
+
+GRID_SHAPE = (12, 15)
+
+
+def crosswalk_dict(seed=0):
+    """Crosswalk of np.where index arrays per catchment, as the legacy
+    JSON weights files, with an empty catchment."""
+    rng = np.random.default_rng(seed)
+    crosswalk = {}
+    for i in range(20):
+        mask = rng.random(GRID_SHAPE) < 0.1
+        crosswalk[f"{i:04d}"] = np.where(mask)
+    crosswalk["empty"] = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    return crosswalk
+
+
+def nanmean_loop(crosswalk, grid):
+    """The per-catchment loop of the original calc_zonal_stats_weights."""
+    means = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for value in crosswalk.values():
+            means.append(np.nanmean(grid[value]))
+    return np.array(means)
+
+
+def random_grid(seed=1, nan_fraction=0.2):
+    rng = np.random.default_rng(seed)
+    grid = rng.gamma(2.0, 3.0, GRID_SHAPE).astype(np.float32)
+    grid[rng.random(GRID_SHAPE) < nan_fraction] = np.nan
+    return grid
+
+
+def test_weights_to_csr():
+    crosswalk = crosswalk_dict()
+    weights = utils.weights_dict_to_sparse(crosswalk, GRID_SHAPE)
+    matrix, catchment_ids = zonal_stats.weights_to_csr(weights)
+
+    assert matrix.shape == (len(crosswalk), GRID_SHAPE[0] * GRID_SHAPE[1])
+    assert list(catchment_ids) == list(crosswalk)
+    for i, value in enumerate(crosswalk.values()):
+        cells = np.ravel_multi_index(value, GRID_SHAPE)
+        row = matrix.getrow(i)
+        np.testing.assert_array_equal(np.sort(row.indices), np.sort(cells))
+        np.testing.assert_array_equal(row.data, 1.0)
+
+
+def test_calc_zonal_mean_matches_nanmean_loop():
+    crosswalk = crosswalk_dict()
+    matrix, _ = zonal_stats.weights_to_csr(
+        utils.weights_dict_to_sparse(crosswalk, GRID_SHAPE)
+    )
+    grid = random_grid()
+    # Every cell of one catchment is missing
+    grid[crosswalk["0003"]] = np.nan
+
+    mean, count = zonal_stats.calc_zonal_mean(matrix, grid.ravel())
+
+    np.testing.assert_allclose(mean, nanmean_loop(crosswalk, grid), rtol=1e-6)
+    expected_count = [np.count_nonzero(~np.isnan(grid[v])) for v in crosswalk.values()]
+    np.testing.assert_array_equal(count, expected_count)
+    assert np.isnan(mean[3]) and count[3] == 0
+    assert np.isnan(mean[-1]) and count[-1] == 0
+
+
+def test_calc_zonal_mean_stack():
+    crosswalk = crosswalk_dict()
+    matrix, _ = zonal_stats.weights_to_csr(
+        utils.weights_dict_to_sparse(crosswalk, GRID_SHAPE)
+    )
+    grids = np.stack([random_grid(seed) for seed in range(4)])
+
+    mean, count = zonal_stats.calc_zonal_mean(matrix, grids)
+
+    assert mean.shape == count.shape == (4, len(crosswalk))
+    for t, grid in enumerate(grids):
+        np.testing.assert_allclose(mean[t], nanmean_loop(crosswalk, grid), rtol=1e-6)
+
+
+def test_calc_zonal_mean_zero_weights():
+    # Row 0 has a 0 weight cell, row 1 only 0 weights, row 2 no cells
+    weights = utils.SparseWeights(
+        catchment_ids=np.array(["a", "b", "c"]),
+        rows=np.array([0, 0, 0, 1, 1], dtype=np.int32),
+        cols=np.array([0, 1, 2, 3, 4], dtype=np.int32),
+        weights=np.array([1.0, 0.5, 0.0, 0.0, 0.0], dtype=np.float32),
+        grid_shape=(1, 5),
+    )
+    matrix, _ = zonal_stats.weights_to_csr(weights)
+    values = np.array([1.0, 4.0, 100.0, 7.0, np.nan])
+
+    mean, count = zonal_stats.calc_zonal_mean(matrix, values)
+
+    np.testing.assert_allclose(mean[0], (1.0 + 0.5 * 4.0) / 1.5)
+    np.testing.assert_allclose(count, [1.5, 0.0, 0.0])
+    assert np.isnan(mean[1]) and np.isnan(mean[2])
+
+
+def test_subset_weights():
+    crosswalk = crosswalk_dict()
+    matrix, catchment_ids = zonal_stats.weights_to_csr(
+        utils.weights_dict_to_sparse(crosswalk, GRID_SHAPE)
+    )
+    grid = random_grid()
+    full_mean, _ = zonal_stats.calc_zonal_mean(matrix, grid.ravel())
+
+    subset, subset_ids, window = zonal_stats.subset_weights(
+        matrix, catchment_ids, GRID_SHAPE, ["0002", "0005"]
+    )
+    assert list(subset_ids) == ["0002", "0005"]
+    cells = np.concatenate([np.ravel_multi_index(crosswalk[k], GRID_SHAPE) for k in subset_ids])
+    y, x = np.unravel_index(cells, GRID_SHAPE)
+    assert window == (slice(y.min(), y.max() + 1), slice(x.min(), x.max() + 1))
+
+    mean, _ = zonal_stats.calc_zonal_mean(subset, grid[window].ravel())
+    np.testing.assert_allclose(mean, full_mean[[2, 5]], rtol=1e-6)
+
+    # Prefix selection
+    _, prefix_ids, _ = zonal_stats.subset_weights(matrix, catchment_ids, GRID_SHAPE, "001")
+    assert list(prefix_ids) == [f"{i:04d}" for i in range(10, 20)]
+
+    with pytest.raises(ValueError):
+        zonal_stats.subset_weights(matrix, catchment_ids, GRID_SHAPE, ["empty"])
+
+
+def test_compress_columns():
+    crosswalk = crosswalk_dict()
+    matrix, _ = zonal_stats.weights_to_csr(
+        utils.weights_dict_to_sparse(crosswalk, GRID_SHAPE)
+    )
+    grid = random_grid().ravel()
+
+    compressed, cells = zonal_stats.compress_columns(matrix)
+
+    assert compressed.shape == (matrix.shape[0], len(cells))
+    np.testing.assert_array_equal(cells, np.unique(matrix.indices))
+    full = zonal_stats.calc_zonal_mean(matrix, grid)
+    packed = zonal_stats.calc_zonal_mean(compressed, grid[cells])
+    np.testing.assert_allclose(packed[0], full[0], rtol=1e-6)
+    np.testing.assert_array_equal(packed[1], full[1])
+
+
+def test_check_grid_shape():
+    matrix, _ = zonal_stats.weights_to_csr(
+        utils.weights_dict_to_sparse(crosswalk_dict(), GRID_SHAPE)
+    )
+    zonal_stats.check_grid_shape(matrix, GRID_SHAPE)
+    with pytest.raises(ValueError):
+        zonal_stats.check_grid_shape(matrix, (GRID_SHAPE[0], GRID_SHAPE[1] + 1))
+
+
+def reference_stats(matrix, grid, q, threshold):
+    """Statistics of every catchment, one catchment at a time."""
+    stats = {k: [] for k in ("mean", "std", "min", "max", f"p{q}", "frac_above")}
+    for i in range(matrix.shape[0]):
+        row = matrix.getrow(i)
+        x = grid[row.indices].astype(np.float64)
+        w = row.data.astype(np.float64)
+        keep = ~np.isnan(x) & (w > 0)
+        x, w = x[keep], w[keep]
+        if len(x) == 0:
+            for values in stats.values():
+                values.append(np.nan)
+            continue
+        mean = np.average(x, weights=w)
+        stats["mean"].append(mean)
+        stats["std"].append(np.sqrt(np.average((x - mean) ** 2, weights=w)))
+        stats["min"].append(x.min())
+        stats["max"].append(x.max())
+        stats["frac_above"].append(w[x > threshold].sum() / w.sum())
+        order = np.argsort(x, kind="stable")
+        cum = np.cumsum(w[order])
+        stats[f"p{q}"].append(x[order][np.searchsorted(cum, cum[-1] * q / 100)])
+    return {k: np.array(v) for k, v in stats.items()}
+
+
+def weighted_matrix(seed=2):
+    crosswalk = crosswalk_dict(seed)
+    weights = utils.weights_dict_to_sparse(crosswalk, GRID_SHAPE)
+    rng = np.random.default_rng(seed)
+    # Fractional weights, some 0
+    fractions = rng.random(len(weights.cols)).astype(np.float32)
+    fractions[rng.random(len(fractions)) < 0.1] = 0.0
+    matrix, _ = zonal_stats.weights_to_csr(weights._replace(weights=fractions))
+    return matrix, crosswalk
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("offset", [0.0, 280.0, -8.0])
+def test_calc_zonal_stats_matches_reference(offset, dtype):
+    matrix, crosswalk = weighted_matrix()
+    grids = np.stack([random_grid(seed) + np.float32(offset) for seed in range(5)]).astype(dtype)
+    grids[2][crosswalk["0004"]] = np.nan
+    threshold = offset + 6.0
+    stats = ["mean", "std", "min", "max", "p90", "p50", "frac_above"]
+
+    results = zonal_stats.calc_zonal_stats(matrix, grids, stats, threshold)
+
+    for t, grid in enumerate(grids):
+        for q in (90, 50):
+            expected = reference_stats(matrix, grid.ravel(), q, threshold)
+            for stat in ("mean", "min", "max", f"p{q}", "frac_above"):
+                # The mean is a float32 sparse product
+                np.testing.assert_allclose(
+                    results[stat][t], expected[stat], rtol=1e-6, atol=1e-5, err_msg=f"{stat} t={t}"
+                )
+            # Centred in float64, no cancellation for large offsets
+            np.testing.assert_allclose(
+                results["std"][t], expected["std"], rtol=1e-6, atol=1e-9, err_msg=f"std t={t}"
+            )
+    assert np.isnan(results["p90"][2][4]) and results["count"][2][4] == 0
+
+
+def test_calc_zonal_stats_single_timestep():
+    matrix, _ = weighted_matrix()
+    grid = random_grid().ravel()
+    stats = ["mean", "std", "min", "max", "p90", "frac_above"]
+
+    single = zonal_stats.calc_zonal_stats(matrix, grid, stats, threshold=6.0)
+    stack = zonal_stats.calc_zonal_stats(matrix, grid[None], stats, threshold=6.0)
+
+    for stat in stats + ["count"]:
+        assert single[stat].shape == (matrix.shape[0],)
+        np.testing.assert_array_equal(single[stat], stack[stat][0])
+    mean, count = zonal_stats.calc_zonal_mean(matrix, grid)
+    np.testing.assert_array_equal(single["mean"], mean)
+    np.testing.assert_array_equal(single["count"], count)
+
+
+def test_calc_zonal_stats_rejects_unknown():
+    matrix, _ = weighted_matrix()
+    grid = random_grid().ravel()
+    with pytest.raises(ValueError):
+        zonal_stats.calc_zonal_stats(matrix, grid, ["median"])
+    with pytest.raises(ValueError):
+        zonal_stats.calc_zonal_stats(matrix, grid, ["frac_above"])
@@ -2,6 +2,9 @@ import gc
 import os
 import pickle
 import json
+import shutil
+import struct
+import threading
 
 import config
 import const
@@ -9,7 +12,9 @@ import time
 
 from pathlib import Path
 import geopandas as gpd
+from contextlib import contextmanager
 from functools import wraps
+from typing import Callable, Hashable, Iterator, NamedTuple, Tuple, TypeVar
 
 from datetime import datetime, timedelta
 
@@ -39,6 +44,76 @@ def make_parent_dir(filepath):
     Path(filepath).parent.mkdir(parents=True, exist_ok=True)
 
 
+T = TypeVar("T")
+
+
+@contextmanager
+def atomic_write(filepath: str) -> Iterator[str]:
+    """Write a file (or directory) through a temp path renamed into place.
+
+    Yields the temp path to write to, `{filepath}.{pid}.{thread_id}.tmp`,
+    unique to the writing process and thread.  It is renamed to
+    `filepath` when the block exits without error, so readers never see
+    a partial file, and removed otherwise.
+
+    e.g.
+    with atomic_write(parquet_filepath) as tmp_filepath:
+        pq.write_table(table, tmp_filepath)
+    """
+    make_parent_dir(filepath)
+    tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_filepath
+        os.replace(tmp_filepath, filepath)
+    finally:
+        if os.path.isdir(tmp_filepath):
+            shutil.rmtree(tmp_filepath, ignore_errors=True)
+        elif os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+
+# Creation of process_local instances, so concurrent threads get one
+# instance.  Replaced in forked children, a parent thread may hold it.
+_process_local_lock = threading.Lock()
+
+
+def _reset_process_local_lock():
+    global _process_local_lock
+    _process_local_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_process_local_lock)
+
+
+def process_local(instances: dict, key: Hashable, factory: Callable[[], T]) -> T:
+    """Get the instance of this process for key, created by `factory()`
+    the first time.
+
+    `instances` is a module level dict.  Instances inherited from a
+    parent process are dropped, so forked workers never share a
+    connection (e.g. an SQLite or HTTP connection) with their parent.
+    Every thread of a process gets the same instance.
+    """
+    pid = os.getpid()
+    if (pid, key) not in instances:
+        with _process_local_lock:
+            if (pid, key) not in instances:
+                for other_key in [k for k in instances if k[0] != pid]:
+                    del instances[other_key]
+                instances[(pid, key)] = factory()
+    return instances[(pid, key)]
+
+
+def partition_dir(base_dir: str, configuration: str, reference_time: datetime) -> str:
+    """Hive partition directory of a forecast (see const.PARTITION_COLUMNS),
+    e.g. {base_dir}/configuration=medium_range_mem1/reference_date=2023-01-01"""
+    return os.path.join(
+        base_dir,
+        f"configuration={configuration}",
+        f"reference_date={reference_time:%Y-%m-%d}"
+    )
+
+
 def profile(fn):
     @wraps(fn)
     def inner(*args, **kwargs):
@@ -88,17 +163,169 @@ def list_to_np(l):
 
 
 def save_weights_dict(weights: dict, filepath: str):
+    """Save a crosswalk dict as JSON (legacy format)."""
     # To json
-    j = json.dumps({k: np_to_list(v) for k, v in crosswalk_dict.items()})
-    
+    j = json.dumps({k: np_to_list(v) for k, v in weights.items()})
+
     # Write to disk
     with open(filepath, "w") as f:
         f.write(j)
 
-def read_weights_file(filepath: str) -> dict:
+
+def read_weights_dict(filepath: str) -> dict:
+    """Read a JSON crosswalk dict (legacy format)."""
     with open(filepath, "r") as f:
         j = f.read()
-    
+
     # Back to dict
     a = {k: list_to_np(v) for k, v in json.loads(j).items()}
     return a
+
+
+# Binary weights file
+#
+# A fixed size little-endian header followed by 8 byte aligned sections:
+#   rows           int32[nnz]      catchment (row) index, sorted ascending
+#   cols           int32[nnz]      flattened grid cell index (y * nx + x)
+#   weights        float32[nnz]    weight of the cell for the catchment
+#   catchment_ids  S{id_width}[n]  catchment ID of each row
+WEIGHTS_MAGIC = b"EVALWGTS"
+WEIGHTS_VERSION = 1
+WEIGHTS_HEADER = struct.Struct("<8sIIQQII24x")
+
+
+class SparseWeights(NamedTuple):
+    """Sparse (catchment x grid cell) weights in COO form."""
+    catchment_ids: np.ndarray
+    rows: np.ndarray
+    cols: np.ndarray
+    weights: np.ndarray
+    grid_shape: Tuple[int, int]
+
+
+def _align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _weights_sections(n_catchments: int, nnz: int, id_width: int) -> list:
+    """Offsets, dtypes and lengths of the sections of a weights file."""
+    sections = []
+    offset = WEIGHTS_HEADER.size
+    for name, dtype, length in [
+        ("rows", np.dtype("<i4"), nnz),
+        ("cols", np.dtype("<i4"), nnz),
+        ("weights", np.dtype("<f4"), nnz),
+        ("catchment_ids", np.dtype(f"S{id_width}"), n_catchments),
+    ]:
+        offset = _align(offset)
+        sections.append((name, dtype, offset, length))
+        offset += dtype.itemsize * length
+    return sections
+
+
+def weights_dict_to_sparse(
+    crosswalk_dict: dict,
+    grid_shape: Tuple[int, int]
+) -> SparseWeights:
+    """Convert a crosswalk dict of np.where index arrays to SparseWeights."""
+    catchment_ids = np.array([str(k) for k in crosswalk_dict.keys()])
+    counts = [len(v[0]) for v in crosswalk_dict.values()]
+    rows = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+    if rows.size > 0:
+        cols = np.concatenate([
+            np.ravel_multi_index(
+                (np.asarray(v[0], dtype=np.int64), np.asarray(v[1], dtype=np.int64)),
+                grid_shape
+            )
+            for v in crosswalk_dict.values()
+        ]).astype(np.int32)
+    else:
+        cols = np.zeros(0, dtype=np.int32)
+    weights = np.ones(len(cols), dtype=np.float32)
+    return SparseWeights(catchment_ids, rows, cols, weights, tuple(grid_shape))
+
+
+def save_weights_file(weights: SparseWeights, filepath: str):
+    """Save weights in the binary weights file format.
+
+    The file is written through `atomic_write`, readers never see a
+    partial file.
+    """
+    order = np.argsort(weights.rows, kind="stable")
+    catchment_ids = np.asarray(weights.catchment_ids).astype(bytes)
+    id_width = max(catchment_ids.dtype.itemsize, 1)
+    nnz = len(order)
+
+    arrays = {
+        "rows": np.asarray(weights.rows)[order],
+        "cols": np.asarray(weights.cols)[order],
+        "weights": np.asarray(weights.weights)[order],
+        "catchment_ids": catchment_ids,
+    }
+
+    with atomic_write(filepath) as tmp_filepath, open(tmp_filepath, "wb") as f:
+        f.write(WEIGHTS_HEADER.pack(
+            WEIGHTS_MAGIC,
+            WEIGHTS_VERSION,
+            id_width,
+            len(catchment_ids),
+            nnz,
+            weights.grid_shape[0],
+            weights.grid_shape[1],
+        ))
+        for name, dtype, offset, length in _weights_sections(
+            len(catchment_ids), nnz, id_width
+        ):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(arrays[name].astype(dtype).tobytes())
+
+
+def read_weights_file(filepath: str) -> SparseWeights:
+    """Read a binary weights file.
+
+    The index and weight arrays are memory-mapped read only, so the pages
+    are shared by every process that reads the same file.
+    """
+    with open(filepath, "rb") as f:
+        header = f.read(WEIGHTS_HEADER.size)
+    if len(header) < WEIGHTS_HEADER.size:
+        raise ValueError(f"{filepath} is not a weights file")
+
+    magic, version, id_width, n_catchments, nnz, ny, nx = WEIGHTS_HEADER.unpack(header)
+    if magic != WEIGHTS_MAGIC:
+        raise ValueError(f"{filepath} is not a weights file")
+    if version != WEIGHTS_VERSION:
+        raise ValueError(
+            f"Unsupported weights file version {version} in {filepath}"
+        )
+
+    arrays = {}
+    for name, dtype, offset, length in _weights_sections(n_catchments, nnz, id_width):
+        if length == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(
+                filepath,
+                dtype=dtype,
+                mode="r",
+                offset=offset,
+                shape=(length,)
+            )
+
+    return SparseWeights(
+        catchment_ids=arrays["catchment_ids"].astype(str),
+        rows=arrays["rows"],
+        cols=arrays["cols"],
+        weights=arrays["weights"],
+        grid_shape=(ny, nx),
+    )
+
+
+def convert_weights_dict_file(
+    json_filepath: str,
+    weights_filepath: str,
+    grid_shape: Tuple[int, int]
+):
+    """Convert a legacy JSON crosswalk file to the binary weights format."""
+    crosswalk_dict = read_weights_dict(json_filepath)
+    save_weights_file(weights_dict_to_sparse(crosswalk_dict, grid_shape), weights_filepath)
@@ -0,0 +1,229 @@
+"""Compressed Zarr cache of forcing grids, one store per run.
+
+Instead of one uncompressed NetCDF file per hour, every timestep of a run
+(reference time) is written into a single Zarr store with a time
+dimension.  Chunks are one timestep by a spatial tile, compressed with
+Blosc/zstd after quantizing the values to a fixed number of decimals,
+so a whole forecast cube can later be read lazily and in parallel.
+
+The store is created with every timestep of the run (see
+blob_names.lead_hours) and each timestep is written to its own region,
+so process pool workers can fill different hours of one store at once.
+Region writes only add chunks, the metadata of a store is complete when
+it is created and consolidated once, so readers open it consolidated
+and the `written` flags are read from their chunks, never from stale
+metadata.
+"""
+import os
+
+import blob_names
+import config
+import utils
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from datetime import timedelta
+from typing import List, Tuple
+
+from numcodecs import Blosc, Quantize
+
+COMPRESSOR = Blosc(cname="zstd", clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+# Decimals kept per variable, others are stored losslessly.  RAINRATE is
+# in mm/s, 6 decimals is < 0.002 mm/hr of error.
+QUANTIZE_DIGITS = {
+    "RAINRATE": 6,
+}
+
+# (y, x) chunk shape, 30 chunks per timestep of the CONUS grid
+SPATIAL_CHUNKS = (768, 768)
+
+
+def store_location(blob_name: str) -> Tuple[str, int, List]:
+    """Zarr store, timestep index and value times of the run of a blob.
+
+    e.g. nwm.20230101/forcing_medium_range/nwm.t00z.medium_range.forcing.f001.conus.nc
+    is timestep 0 of nwm.20230101/forcing_medium_range/nwm.t00z.medium_range.forcing.conus.zarr
+
+    Returns
+    -------
+    store_path : str
+        None if the blob name does not follow the NWM pattern.
+    time_index : int
+    value_times : List[datetime]
+        Value time of every timestep of the run.
+    """
+    parts = blob_names.parse_blob_name(blob_name)
+    if parts is None:
+        return None, None, None
+
+    reference_time = parts["reference_time"]
+    version = blob_names.nwm_version(reference_time)
+    specs = blob_names.config_specs(
+        parts["configuration"],
+        parts["domain"],
+        version,
+        parts["member"]
+    )
+    leads = blob_names.lead_hours(
+        parts["configuration"],
+        parts["domain"],
+        version,
+        parts["member"]
+    )
+    if parts["lead_hrs"] not in leads:
+        return None, None, None
+
+    sign = 1 if specs["is_forecast"] else -1
+    value_times = [reference_time + sign * timedelta(hours=lead) for lead in leads]
+
+    directory, filename = os.path.split(blob_name)
+    tokens = filename.split(".")
+    store_name = ".".join(tokens[:-3] + tokens[-2:-1]) + ".zarr"
+    store_path = os.path.join(config.NWM_ZARR_CACHE_DIR, directory, store_name)
+
+    return store_path, leads.index(parts["lead_hrs"]), value_times
+
+
+def _encoding(variable: str, chunks: Tuple[int, int, int]) -> dict:
+    encoding = {"compressors": [COMPRESSOR], "chunks": chunks}
+    if variable in QUANTIZE_DIGITS:
+        encoding["filters"] = [Quantize(digits=QUANTIZE_DIGITS[variable], dtype="f4")]
+    return encoding
+
+
+def create_store(store_path: str, ds: xr.Dataset, value_times: List):
+    """Create an empty store for every timestep of a run.
+
+    The variables, coordinates and attributes are those of `ds`, one
+    timestep of the run.  The store is written to a temporary directory
+    and renamed into place, if another process created it first its store
+    is kept.
+    """
+    n_times = len(value_times)
+    grid_shape = (ds.sizes["y"], ds.sizes["x"])
+    chunks = (1, min(SPATIAL_CHUNKS[0], grid_shape[0]), min(SPATIAL_CHUNKS[1], grid_shape[1]))
+
+    data_vars = {}
+    encoding = {}
+    for variable in ds.data_vars:
+        data_vars[variable] = xr.Variable(
+            ("time", "y", "x"),
+            da.full((n_times,) + grid_shape, np.nan, chunks=chunks, dtype=np.float32),
+            attrs=ds[variable].attrs,
+        )
+        encoding[variable] = _encoding(variable, chunks)
+    # Which timesteps were written, one chunk per timestep
+    data_vars["written"] = xr.Variable(
+        "time",
+        da.zeros(n_times, chunks=1, dtype=np.int8)
+    )
+    encoding["written"] = {"chunks": (1,)}
+
+    template = xr.Dataset(
+        data_vars,
+        coords={
+            "time": pd.DatetimeIndex(value_times),
+            "y": ds["y"],
+            "x": ds["x"],
+        },
+        attrs=ds.attrs,
+    )
+
+    try:
+        with utils.atomic_write(store_path) as tmp_path:
+            template.to_zarr(
+                tmp_path,
+                mode="w",
+                compute=False,
+                encoding=encoding,
+                zarr_format=2,
+                consolidated=True,
+            )
+    except OSError:
+        # Created by another process in the meantime
+        if not os.path.isdir(store_path):
+            raise
+
+
+def write_blob(blob_name: str, ds: xr.Dataset) -> bool:
+    """Write the full grid of one blob into the store of its run.
+
+    Returns
+    -------
+    written : bool
+        False if the blob can not be cached, because its name does not
+        follow the NWM pattern or the store was created with other
+        variables.
+    """
+    store_path, time_index, value_times = store_location(blob_name)
+    if store_path is None:
+        return False
+
+    variables = list(ds.data_vars)
+    if not os.path.exists(store_path):
+        create_store(store_path, ds, value_times)
+
+    with xr.open_zarr(store_path, consolidated=True) as store:
+        if not set(variables) <= set(store.data_vars):
+            return False
+
+    region = {"time": slice(time_index, time_index + 1)}
+    region_ds = ds[variables].astype(np.float32)
+    region_ds = region_ds.drop_vars(list(region_ds.coords))
+    region_ds.to_zarr(store_path, region=region, zarr_format=2, consolidated=False)
+
+    # Flagged after the data is written, so a reader never sees a flagged
+    # timestep with missing chunks
+    written_ds = xr.Dataset({"written": xr.Variable("time", np.ones(1, dtype=np.int8))})
+    written_ds.to_zarr(store_path, region=region, zarr_format=2, consolidated=False)
+    return True
+
+
+def contains(blob_name: str) -> bool:
+    """If the timestep of a blob was written to the store of its run."""
+    store_path, time_index, _ = store_location(blob_name)
+    if store_path is None or not os.path.exists(store_path):
+        return False
+    with xr.open_zarr(store_path, consolidated=True) as store:
+        return bool(store["written"][time_index])
+
+
+def read_blobs(
+    blob_list: List[str],
+    variables: List[str],
+    window: Tuple[slice, slice] = None,
+    load: bool = True,
+) -> xr.Dataset:
+    """Read the timesteps of some blobs of one run in one lazy, parallel
+    read.
+
+    Returns
+    -------
+    ds : xr.Dataset
+        (time, y, x) variables with one timestep per blob, or None if any
+        blob is not in the cache.  Dask-backed (chunked like the store)
+        if `load` is False.
+    """
+    locations = [store_location(blob_name) for blob_name in blob_list]
+    store_paths = {store_path for store_path, _, _ in locations}
+    if len(store_paths) != 1 or None in store_paths:
+        return None
+    store_path = store_paths.pop()
+    if not os.path.exists(store_path):
+        return None
+
+    time_indexes = [time_index for _, time_index, _ in locations]
+    store = xr.open_zarr(store_path, consolidated=True)
+    if not set(variables) <= set(store.data_vars):
+        return None
+    if not store["written"].values[time_indexes].all():
+        return None
+
+    ds = store[variables].isel(time=time_indexes)
+    if window is not None:
+        ds = ds.isel(y=window[0], x=window[1])
+    return ds.load() if load else ds
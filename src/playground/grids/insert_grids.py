@@ -8,7 +8,7 @@ import xarray as xr
 from google.cloud import storage
 
 import grids.config as config
-from grids.utils import get_cache_dir, profile
+from grids.utils import get_cache_dir, get_storage_client, profile
 
 BUCKET = "national-water-model"
 
@@ -44,8 +44,8 @@ def list_blobs(
         issue_date = tokens[0]
         issue_time = tokens[1].lower()
 
-        # Connect to bucket with anonymous client
-        client = storage.Client.create_anonymous_client()
+        # Connect to bucket with the shared anonymous client
+        client = get_storage_client()
         bucket = client.bucket(BUCKET)
 
         # Get list of blobs
@@ -74,15 +74,16 @@ def get_blob(blob_name: str) -> bytes:
             The data stored in the blob.
         
         """
-        # Setup anonymous client and retrieve blob data
-        client = storage.Client.create_anonymous_client()
+        # Retrieve blob data with the shared anonymous client
+        client = get_storage_client()
         bucket = client.bucket(BUCKET)
         return bucket.blob(blob_name).download_as_bytes(timeout=120)
 
 
 def get_dataset(
         blob_name: str,
-        use_cache: bool = True
+        use_cache: bool = True,
+        chunks: dict = None
         ) -> xr.Dataset:
         """Retrieve a blob from the data service as xarray.Dataset.
 
@@ -96,6 +97,9 @@ def get_dataset(
             If cache should be used.  
             If True, checks to see if file is in cache, and 
             if fetched from remote will save to cache.
+        chunks: dict, optional
+            Dask chunks, e.g. {"y": 768, "x": 768}.  If set the dataset
+            is opened lazily and dask-backed instead of loaded in memory.
 
         Returns
         -------
@@ -112,12 +116,7 @@ def get_dataset(
         if os.path.exists(nc_filepath) and use_cache:
 
             # Get dataset from cache
-            ds = xr.load_dataset(
-                nc_filepath,
-                engine='h5netcdf',
-                mask_and_scale=False,
-                decode_coords="all"
-                )
+            ds = _open_dataset(nc_filepath, chunks)
 
             return ds
         
@@ -127,12 +126,7 @@ def get_dataset(
             raw_bytes = get_blob(blob_name)
 
             # Create Dataset
-            ds = xr.load_dataset(
-                BytesIO(raw_bytes),
-                engine='h5netcdf',
-                mask_and_scale=False,
-                decode_coords="all"
-                )
+            ds = _open_dataset(BytesIO(raw_bytes), chunks)
 
             if use_cache:
                 # Subset and cache
@@ -144,6 +138,24 @@ def get_dataset(
             return ds
 
 
+def _open_dataset(source, chunks: dict = None) -> xr.Dataset:
+    """Load a NetCDF file, or open it lazily with dask if chunks is set."""
+    if chunks is None:
+        return xr.load_dataset(
+            source,
+            engine='h5netcdf',
+            mask_and_scale=False,
+            decode_coords="all"
+            )
+    return xr.open_dataset(
+        source,
+        engine='h5netcdf',
+        mask_and_scale=False,
+        decode_coords="all",
+        chunks=chunks
+        )
+
+
 def ds_to_tiff(ds: xr.Dataset, variable: str, blob_name: str) -> str:
     """Saves xr.Dataset to geotiff."""
 
@@ -3,8 +3,13 @@ import time
 from functools import wraps
 from pathlib import Path
 
+from google.cloud import storage
+
 import grids.config as config
 
+# Anonymous storage clients by process ID
+_storage_clients = {}
+
 
 def get_cache_dir(create: bool = True):
 
@@ -16,6 +21,18 @@ def get_cache_dir(create: bool = True):
 
     return config.NWM_CACHE_DIR
 
+def get_storage_client() -> storage.Client:
+    """Anonymous storage client shared within a process.
+
+    Reusing the client reuses its HTTP connection pool instead of
+    setting up a new session for every request.
+    """
+    pid = os.getpid()
+    if pid not in _storage_clients:
+        _storage_clients.clear()
+        _storage_clients[pid] = storage.Client.create_anonymous_client()
+    return _storage_clients[pid]
+
 def make_parent_dir(filepath):
     Path(filepath).parent.mkdir(parents=True, exist_ok=True)
 
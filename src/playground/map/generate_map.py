@@ -14,7 +14,7 @@ from google.cloud import storage
 from rasterstats import zonal_stats
 
 import grids.config as config
-from grids.utils import get_cache_dir, profile
+from grids.utils import get_cache_dir, get_storage_client, profile
 
 # import geopandas as gpd
 # import pandas as pd
@@ -64,8 +64,8 @@ def list_blobs(
         issue_date = tokens[0]
         issue_time = tokens[1].lower()
 
-        # Connect to bucket with anonymous client
-        client = storage.Client.create_anonymous_client()
+        # Connect to bucket with the shared anonymous client
+        client = get_storage_client()
         bucket = client.bucket(BUCKET)
 
         # Get list of blobs
@@ -94,8 +94,8 @@ def get_blob(blob_name: str) -> bytes:
             The data stored in the blob.
         
         """
-        # Setup anonymous client and retrieve blob data
-        client = storage.Client.create_anonymous_client()
+        # Retrieve blob data with the shared anonymous client
+        client = get_storage_client()
         bucket = client.bucket(BUCKET)
         return bucket.blob(blob_name).download_as_bytes(timeout=120)
 
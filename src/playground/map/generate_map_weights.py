@@ -21,7 +21,7 @@ from rasterio.io import MemoryFile
 from rasterstats import zonal_stats
 
 import grids.config as config
-from grids.utils import get_cache_dir, make_parent_dir, profile
+from grids.utils import get_cache_dir, get_storage_client, make_parent_dir, profile
 
 BUCKET = "national-water-model"
 WEIGHTS_FILE_NAME = "wbdhu10_forcing_medium_range.pkl"
@@ -70,8 +70,8 @@ def list_blobs_forcing(
     issue_date = tokens[0]
     issue_time = tokens[1].lower()
 
-    # Connect to bucket with anonymous client
-    client = storage.Client.create_anonymous_client()
+    # Connect to bucket with the shared anonymous client
+    client = get_storage_client()
     bucket = client.bucket(BUCKET)
 
     # Get list of blobs
@@ -110,8 +110,8 @@ def list_blobs_assim(
         parameters.
     """
 
-    # Connect to bucket with anonymous client
-    client = storage.Client.create_anonymous_client()
+    # Connect to bucket with the shared anonymous client
+    client = get_storage_client()
     bucket = client.bucket(BUCKET)
 
     # Get list of blobs
@@ -140,8 +140,8 @@ def get_blob(blob_name: str) -> bytes:
         The data stored in the blob.
 
     """
-    # Setup anonymous client and retrieve blob data
-    client = storage.Client.create_anonymous_client()
+    # Retrieve blob data with the shared anonymous client
+    client = get_storage_client()
     bucket = client.bucket(BUCKET)
     return bucket.blob(blob_name).download_as_bytes(timeout=120)
 